@@ -0,0 +1,269 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from redis import RedisError
+from rest_framework.request import Request
+
+from common.auth import auth_scope
+from common.counters import Counters
+from common.metrics import Metrics
+from common.responses import build_response
+from logger.services.Logger import Logger
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Snapshot:
+    content: bytes
+    headers: dict
+    fetched_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+class BotCatalog:
+    """
+    Enriched bot list and bot details as Yadro returned them, kept pre-serialized in memory.
+    The list is shared between workers through Redis, a detail is only served once it was fetched from bots/<id>.
+
+    The catalog is the same for every client, but it is only served to clients whose token Yadro accepted for
+    a bots call within the last BOT_CATALOG_AUTH_TTL seconds. Other clients go upstream, which validates them.
+    An expired entry is refreshed by the next request going upstream with its own token,
+    requests arriving during that call are served the stale entry (stale-while-revalidate).
+    """
+
+    stats = Counters('hits', 'stale_hits', 'misses', 'unauthorized', 'refreshes')
+
+    __REDIS_KEY = 'proxy:bots:catalog'
+    __AUTH_KEY_PREFIX = 'proxy:bots:auth'
+    __MAX_AUTHORIZED_SCOPES = 10000
+    __LIST = 'list'
+    __REJECTED_STATUS_CODES = (401, 403,)
+
+    def __init__(self) -> None:
+        self.__list: Optional[_Snapshot] = None
+        self.__details: dict[str, _Snapshot] = {}
+        self.__authorized: dict[str, float] = {}
+        self.__refreshing: dict[str, float] = {}
+        self.__lock = threading.Lock()
+
+    def get(self, request: Request, bot_id: Optional[int] = None) -> Optional[requests.Response]:
+        """Returns None when the request has to go upstream, the caller then passes the response to update"""
+        if not self.__can_serve(request):
+            return None
+        scope = auth_scope(request)
+        if not self.__is_authorized(scope) and not self.__is_authorized_shared(scope):
+            self.stats.increment('unauthorized')
+            return None
+        if bot_id is None and self.__list is None:
+            self.__adopt(self.__read_shared())
+        return self.__serve(request=request, bot_id=bot_id)
+
+    async def aget(self, request: Request, bot_id: Optional[int] = None) -> Optional[requests.Response]:
+        if not self.__can_serve(request):
+            return None
+        scope = auth_scope(request)
+        if not self.__is_authorized(scope) and not await self.__ais_authorized_shared(scope):
+            self.stats.increment('unauthorized')
+            return None
+        if bot_id is None and self.__list is None:
+            self.__adopt(await self.__aread_shared())
+        return self.__serve(request=request, bot_id=bot_id)
+
+    def update(self, request: Request, response: requests.Response, bot_id: Optional[int] = None) -> None:
+        """Stores the enriched bot list returned by BotTemplate or a bot detail returned by Route"""
+        if response.status_code in self.__REJECTED_STATUS_CODES:
+            self.forget_client(request)
+        snapshot = self.__on_response(request=request, response=response, bot_id=bot_id)
+        if snapshot is None:
+            return
+        self.__remember_shared(auth_scope(request))
+        if bot_id is None:
+            self.__write_shared(snapshot)
+
+    async def aupdate(self, request: Request, response: requests.Response, bot_id: Optional[int] = None) -> None:
+        if response.status_code in self.__REJECTED_STATUS_CODES:
+            await self.aforget_client(request)
+        snapshot = self.__on_response(request=request, response=response, bot_id=bot_id)
+        if snapshot is None:
+            return
+        await self.__aremember_shared(auth_scope(request))
+        if bot_id is None:
+            await self.__awrite_shared(snapshot)
+
+    def forget_client(self, request: Request) -> None:
+        """Called on logout and rejected tokens, the token is validated upstream again before it is served"""
+        scope = self.__forget(request)
+        try:
+            cache.delete(self.__auth_key(scope))
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+
+    async def aforget_client(self, request: Request) -> None:
+        scope = self.__forget(request)
+        try:
+            await cache.adelete(self.__auth_key(scope))
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+
+    def __can_serve(self, request: Request) -> bool:
+        return settings.BOT_CATALOG_ENABLED and bool(request.headers.get('Authorization'))
+
+    def __serve(self, request: Request, bot_id: Optional[int]) -> Optional[requests.Response]:
+        key = self.__LIST if bot_id is None else str(bot_id)
+        snapshot = self.__list if bot_id is None else self.__details.get(key)
+        if snapshot is None or snapshot.age > settings.BOT_CATALOG_MAX_STALE:
+            self.stats.increment('misses')
+            return None
+
+        if snapshot.age > settings.BOT_CATALOG_TTL:
+            if self.__claim_refresh(key):
+                self.stats.increment('refreshes')
+                return None
+            self.stats.increment('stale_hits')
+        else:
+            self.stats.increment('hits')
+
+        Logger().log_client_request(request=request)
+        return build_response(status_code=200, headers=snapshot.headers, content=snapshot.content, request=None)
+
+    def __claim_refresh(self, key: str) -> bool:
+        """The first request finding the entry expired refreshes it, until its upstream call could have timed out"""
+        now = time.monotonic()
+        claim_timeout = settings.UPSTREAM_CONNECT_TIMEOUT + settings.UPSTREAM_READ_TIMEOUT
+        with self.__lock:
+            claimed_at = self.__refreshing.get(key)
+            if claimed_at is not None and now - claimed_at < claim_timeout:
+                return False
+            self.__refreshing[key] = now
+            return True
+
+    def __on_response(self, request: Request, response: requests.Response,
+                      bot_id: Optional[int]) -> Optional[_Snapshot]:
+        key = self.__LIST if bot_id is None else str(bot_id)
+        with self.__lock:
+            self.__refreshing.pop(key, None)
+        if not self.__can_serve(request) or response.status_code != 200 or getattr(response, 'from_cache', False):
+            return None
+
+        snapshot = _Snapshot(content=response.content, headers=dict(response.headers), fetched_at=time.time())
+        self.__remember(auth_scope(request))
+        if bot_id is None:
+            self.__adopt(snapshot)
+        else:
+            with self.__lock:
+                self.__details[key] = snapshot
+        return snapshot
+
+    def __adopt(self, snapshot: Optional[_Snapshot]) -> None:
+        with self.__lock:
+            if snapshot is not None and (self.__list is None or snapshot.fetched_at > self.__list.fetched_at):
+                self.__list = snapshot
+
+    def __is_authorized(self, scope: str) -> bool:
+        validated_at = self.__authorized.get(scope)
+        return validated_at is not None and time.time() - validated_at <= settings.BOT_CATALOG_AUTH_TTL
+
+    def __remember(self, scope: str, validated_at: Optional[float] = None) -> None:
+        with self.__lock:
+            if len(self.__authorized) >= self.__MAX_AUTHORIZED_SCOPES:
+                expired_before = time.time() - settings.BOT_CATALOG_AUTH_TTL
+                self.__authorized = {
+                    known: known_at for known, known_at in self.__authorized.items() if known_at >= expired_before
+                }
+                if len(self.__authorized) >= self.__MAX_AUTHORIZED_SCOPES:
+                    self.__authorized.clear()
+            self.__authorized[scope] = time.time() if validated_at is None else validated_at
+
+    def __forget(self, request: Request) -> str:
+        scope = auth_scope(request)
+        with self.__lock:
+            self.__authorized.pop(scope, None)
+        return scope
+
+    def __is_authorized_shared(self, scope: str) -> bool:
+        """A token another worker validated is adopted with the time it was validated"""
+        try:
+            validated_at = cache.get(self.__auth_key(scope))
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+            return False
+        return self.__adopt_authorized(scope, validated_at)
+
+    async def __ais_authorized_shared(self, scope: str) -> bool:
+        try:
+            validated_at = await cache.aget(self.__auth_key(scope))
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+            return False
+        return self.__adopt_authorized(scope, validated_at)
+
+    def __adopt_authorized(self, scope: str, validated_at: Optional[float]) -> bool:
+        if validated_at is None:
+            return False
+        self.__remember(scope, validated_at=validated_at)
+        return self.__is_authorized(scope)
+
+    def __remember_shared(self, scope: str) -> None:
+        try:
+            cache.set(self.__auth_key(scope), time.time(), settings.BOT_CATALOG_AUTH_TTL)
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+
+    async def __aremember_shared(self, scope: str) -> None:
+        try:
+            await cache.aset(self.__auth_key(scope), time.time(), settings.BOT_CATALOG_AUTH_TTL)
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+
+    def __auth_key(self, scope: str) -> str:
+        return f'{self.__AUTH_KEY_PREFIX}:{scope}'
+
+    def __read_shared(self) -> Optional[_Snapshot]:
+        try:
+            return self.__from_shared(cache.get(self.__REDIS_KEY))
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+            return None
+
+    async def __aread_shared(self) -> Optional[_Snapshot]:
+        try:
+            return self.__from_shared(await cache.aget(self.__REDIS_KEY))
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+            return None
+
+    def __write_shared(self, snapshot: _Snapshot) -> None:
+        try:
+            cache.set(self.__REDIS_KEY, self.__to_shared(snapshot), settings.BOT_CATALOG_MAX_STALE)
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+
+    async def __awrite_shared(self, snapshot: _Snapshot) -> None:
+        try:
+            await cache.aset(self.__REDIS_KEY, self.__to_shared(snapshot), settings.BOT_CATALOG_MAX_STALE)
+        except RedisError:
+            logger.warning('Bot catalog is unavailable in Redis', exc_info=True)
+
+    @staticmethod
+    def __to_shared(snapshot: _Snapshot) -> dict:
+        return {'content': snapshot.content, 'headers': snapshot.headers, 'fetched_at': snapshot.fetched_at}
+
+    def __from_shared(self, shared: Optional[dict]) -> Optional[_Snapshot]:
+        if shared is None or (self.__list is not None and shared['fetched_at'] <= self.__list.fetched_at):
+            return None
+        return _Snapshot(**shared)
+
+
+bot_catalog = BotCatalog()
+
+Metrics.register_collector(prefix='proxy_bot_catalog', snapshot=BotCatalog.stats.snapshot)
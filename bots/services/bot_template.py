@@ -11,10 +11,10 @@ class BotTemplate(Route):
     def __init__(self, request: Request) -> None:
         super().__init__(request=request)
 
-    def send(self, endpoint: str) -> requests.Response:
-        yadro_response = super().send(endpoint=endpoint)
-        response = self.__add_additional_fields_to_response(yadro_response)
-        return response
+    def _transform_response(self, response: requests.Response) -> requests.Response:
+        if not response.ok:
+            return response
+        return self.__add_additional_fields_to_response(response)
 
     def __add_additional_fields_to_response(self, response: requests.Response) -> requests.Response:
         content = {'result': []}
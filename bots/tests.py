@@ -0,0 +1,112 @@
+import time
+
+import fakeredis
+import requests
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.request import Request
+
+from bots.services.bot_catalog import BotCatalog
+from common.responses import build_response
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://fake-redis',
+            'OPTIONS': {'connection_class': fakeredis.FakeConnection},
+        },
+    },
+    BOT_CATALOG_ENABLED=True,
+    BOT_CATALOG_TTL=60,
+    BOT_CATALOG_MAX_STALE=600,
+    BOT_CATALOG_AUTH_TTL=60,
+)
+class BotCatalogTests(SimpleTestCase):
+    """Every test gets its own catalog, the workers it shares Redis with are simulated by other catalogs"""
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.factory = RequestFactory()
+        self.catalog = BotCatalog()
+
+    def test_serves_the_list_to_the_token_yadro_accepted(self) -> None:
+        self.assertIsNone(self.catalog.get(request=self.__request('token')))
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+
+        served = self.catalog.get(request=self.__request('token'))
+        self.assertEqual(served.status_code, 200)
+        self.assertEqual(served.content, b'{"result": []}')
+
+    def test_never_serves_unvalidated_tokens(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+        self.assertIsNone(self.catalog.get(request=self.__request('other')))
+        self.assertIsNone(self.catalog.get(request=self.__request(None)))
+
+    def test_rejected_and_logged_out_tokens_are_forgotten(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{}', status_code=401))
+        self.assertIsNone(self.catalog.get(request=self.__request('token')))
+
+        self.catalog.update(request=self.__request('other'), response=self.__response(b'{"result": []}'))
+        self.catalog.forget_client(self.__request('other'))
+        self.assertIsNone(self.catalog.get(request=self.__request('other')))
+        self.assertIsNone(BotCatalog().get(request=self.__request('other')))
+
+    @override_settings(BOT_CATALOG_AUTH_TTL=0.05)
+    def test_validation_expires(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+        time.sleep(0.06)
+        self.assertIsNone(self.catalog.get(request=self.__request('token')))
+
+    def test_validation_and_list_are_shared_between_workers(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+        served = BotCatalog().get(request=self.__request('token'))
+        self.assertEqual(served.content, b'{"result": []}')
+
+    def test_serves_only_details_fetched_from_their_endpoint(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": [{"id": 1}]}'))
+        self.assertIsNone(self.catalog.get(request=self.__request('token'), bot_id=1))
+
+        detail = self.__response(b'{"id": 1}', headers={'ETag': '"detail"'})
+        self.catalog.update(request=self.__request('token'), response=detail, bot_id=1)
+        served = self.catalog.get(request=self.__request('token'), bot_id=1)
+        self.assertEqual(served.content, b'{"id": 1}')
+        self.assertEqual(served.headers['ETag'], '"detail"')
+        self.assertIsNone(self.catalog.get(request=self.__request('token'), bot_id=2))
+
+    @override_settings(BOT_CATALOG_TTL=0.05)
+    def test_stale_entry_is_refreshed_by_one_request(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+        time.sleep(0.06)
+        refreshes = BotCatalog.stats.snapshot()['refreshes']
+
+        self.assertIsNone(self.catalog.get(request=self.__request('token')))
+        stale = self.catalog.get(request=self.__request('token'))
+        self.assertEqual(stale.content, b'{"result": []}')
+        self.assertEqual(BotCatalog.stats.snapshot()['refreshes'], refreshes + 1)
+
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": [{"id": 2}]}'))
+        fresh = self.catalog.get(request=self.__request('token'))
+        self.assertEqual(fresh.content, b'{"result": [{"id": 2}]}')
+
+    @override_settings(BOT_CATALOG_TTL=0.01, BOT_CATALOG_MAX_STALE=0.05)
+    def test_entries_older_than_max_stale_are_not_served(self) -> None:
+        self.catalog.update(request=self.__request('token'), response=self.__response(b'{"result": []}'))
+        time.sleep(0.06)
+        self.assertIsNone(self.catalog.get(request=self.__request('token')))
+        self.assertIsNone(self.catalog.get(request=self.__request('token')))
+
+    def __request(self, token: str) -> Request:
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        return Request(self.factory.get('/api/v0/bots/', **headers))
+
+    @staticmethod
+    def __response(content: bytes, status_code: int = 200, headers: dict = None) -> requests.Response:
+        return build_response(
+            status_code=status_code,
+            headers={'Content-Type': 'application/json', **(headers or {})},
+            content=content,
+            request=None,
+        )
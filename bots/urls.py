@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.urls import path
 
-from bots.views import BotView
+from bots.views import AsyncBotView, BotView
+
+view = AsyncBotView if settings.PROXY_ASYNC_VIEWS else BotView
 
 urlpatterns = [
-    path('', BotView.as_view(), name='bot-list'),
-    path('<int:bot_id>/', BotView.as_view(), name='bot-detail'),
+    path('', view.as_view(), name='bot-list'),
+    path('<int:bot_id>/', view.as_view(), name='bot-detail'),
 ]
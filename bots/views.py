@@ -4,8 +4,10 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from bots.services.bot_catalog import bot_catalog
 from bots.services.bot_template import BotTemplate
 from common.route import Route
+from common.views import AsyncProxyView
 from logger.services.Logger import Logger
 from proxy.decorators import handle_json_decode_error
 
@@ -16,12 +18,35 @@ class BotView(APIView):
     @handle_json_decode_error
     def get(self, request: Request, *args: Any, **kwargs: dict) -> Response:
         bot_id = kwargs.get('bot_id')
-        if bot_id is None:
+        response = bot_catalog.get(request=request, bot_id=bot_id)
+        if response is None and bot_id is None:
             response = BotTemplate(request=request).send(endpoint='bots')
-        else:
+            bot_catalog.update(request=request, response=response)
+        elif response is None:
             response = Route(request=request).send(endpoint=f'bots/{bot_id}')
+            bot_catalog.update(request=request, response=response, bot_id=bot_id)
 
         Logger().log_proxy_response_to_client(response=response)
         Logger().save_to_db()
 
         return response
+
+
+class AsyncBotView(AsyncProxyView):
+    """Async view that returns the list of existing bots or details for a specific bot"""
+
+    @handle_json_decode_error
+    async def get(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        bot_id = kwargs.get('bot_id')
+        response = await bot_catalog.aget(request=request, bot_id=bot_id)
+        if response is None and bot_id is None:
+            response = await BotTemplate(request=request).asend(endpoint='bots')
+            await bot_catalog.aupdate(request=request, response=response)
+        elif response is None:
+            response = await Route(request=request).asend(endpoint=f'bots/{bot_id}')
+            await bot_catalog.aupdate(request=request, response=response, bot_id=bot_id)
+
+        Logger().log_proxy_response_to_client(response=response)
+        await Logger().asave_to_db()
+
+        return response
@@ -0,0 +1,25 @@
+import hashlib
+
+from django.conf import settings
+from rest_framework.request import Request
+
+
+def auth_scope(request: Request) -> str:
+    """Returns a hash of the client's Authorization header, so the token itself never ends up in Redis keys"""
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return 'anonymous'
+    return hashlib.sha256(authorization.encode('utf-8')).hexdigest()[:32]
+
+
+def client_address(request: Request) -> str:
+    """
+    Behind PROXY_TRUSTED_PROXY_COUNT reverse proxies REMOTE_ADDR is the nearest proxy, so the client is the entry
+    that many from the right of X-Forwarded-For, the entries left of it are sent by the client and may be forged
+    """
+    count = settings.PROXY_TRUSTED_PROXY_COUNT
+    if count > 0:
+        forwarded = [address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        if len(forwarded) >= count and forwarded[-count]:
+            return forwarded[-count]
+    return request.META.get('REMOTE_ADDR', '')
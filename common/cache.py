@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import uuid
+from typing import Optional
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from redis import RedisError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+
+from common.auth import auth_scope
+from common.compression import decode_from_storage, encode_for_storage
+from common.counters import Counters
+from common.endpoints import endpoint_pattern
+from common.metrics import Metrics
+from common.responses import build_response, response_etag
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cache_control(value: Optional[str]) -> dict:
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+class ResponseCache:
+    """
+    Redis cache of upstream responses to GET requests.
+    An entry is scoped by the endpoint, the query params and the client's Authorization header,
+    it keeps the body compressed, status and headers of the response for the TTL set in PROXY_CACHE_TTLS.
+
+    Every key also carries the version of its endpoint, a successful or failed mutation of an endpoint
+    replaces the versions of the endpoint and of its parent ('dialogues/7' and 'dialogues'),
+    and of the endpoints listed for it in PROXY_CACHE_INVALIDATES once Yadro accepted it ('users/logout' drops
+    the cached 'users/email-verification/check'), so the client's stale entries become unreachable without
+    scanning keys.
+    """
+
+    stats = Counters('hits', 'misses', 'stores', 'invalidations', 'errors')
+
+    __KEY_PREFIX = 'proxy:response'
+    __VERSION_PREFIX = 'proxy:version'
+    __INITIAL_VERSION = '0'
+
+    def __init__(self, request: Request, endpoint: str, namespace: str) -> None:
+        self.request = request
+        self.endpoint = endpoint
+        self.namespace = namespace
+        self.scope = auth_scope(request)
+        self.ttl = settings.PROXY_CACHE_TTLS.get(endpoint_pattern(endpoint))
+        self.__directives = parse_cache_control(request.headers.get('Cache-Control'))
+        self.__key = None
+
+    @property
+    def is_enabled(self) -> bool:
+        is_cacheable = self.request.method == 'GET' and bool(self.ttl) and 'no-store' not in self.__directives
+        return settings.PROXY_CACHE_ENABLED and is_cacheable
+
+    @property
+    def can_lookup(self) -> bool:
+        """A client asking for no-cache or max-age=0 gets a fresh response, which is still cached"""
+        return self.is_enabled and 'no-cache' not in self.__directives and self.__directives.get('max-age') != '0'
+
+    def invalidates(self, response: Optional[requests.Response]) -> bool:
+        has_cached = any(
+            endpoint_pattern(endpoint) in settings.PROXY_CACHE_TTLS
+            for endpoint in self.__invalidated_endpoints(response)
+        )
+        return settings.PROXY_CACHE_ENABLED and has_cached
+
+    def get(self, prepared_request: requests.PreparedRequest) -> Optional[requests.Response]:
+        """Looks the response up, the key is resolved before the upstream call so a concurrent mutation wins"""
+        if not self.is_enabled:
+            return None
+        try:
+            version = cache.get(self.__version_key(self.endpoint), self.__INITIAL_VERSION)
+            self.__key = self.__build_key(version=version)
+            entry = cache.get(self.__key) if self.can_lookup else None
+        except RedisError:
+            self.__on_error()
+            return None
+        return self.__to_response(entry=entry, prepared_request=prepared_request)
+
+    async def aget(self, prepared_request: requests.PreparedRequest) -> Optional[requests.Response]:
+        if not self.is_enabled:
+            return None
+        try:
+            version = await cache.aget(self.__version_key(self.endpoint), self.__INITIAL_VERSION)
+            self.__key = self.__build_key(version=version)
+            entry = await cache.aget(self.__key) if self.can_lookup else None
+        except RedisError:
+            self.__on_error()
+            return None
+        return self.__to_response(entry=entry, prepared_request=prepared_request)
+
+    def poll(self, prepared_request: requests.PreparedRequest) -> Optional[requests.Response]:
+        """Re-reads the entry resolved by get(), used while another worker fetches the same response"""
+        try:
+            entry = cache.get(self.__key)
+        except RedisError:
+            self.__on_error()
+            return None
+        return None if entry is None else self.__to_response(entry=entry, prepared_request=prepared_request)
+
+    async def apoll(self, prepared_request: requests.PreparedRequest) -> Optional[requests.Response]:
+        try:
+            entry = await cache.aget(self.__key)
+        except RedisError:
+            self.__on_error()
+            return None
+        return None if entry is None else self.__to_response(entry=entry, prepared_request=prepared_request)
+
+    def set(self, response: requests.Response) -> None:
+        entry, ttl = self.__to_entry(response=response)
+        if entry is None:
+            return
+        try:
+            cache.set(self.__key, entry, ttl)
+        except RedisError:
+            self.__on_error()
+        else:
+            self.stats.increment('stores')
+
+    async def aset(self, response: requests.Response) -> None:
+        entry, ttl = self.__to_entry(response=response)
+        if entry is None:
+            return
+        try:
+            await cache.aset(self.__key, entry, ttl)
+        except RedisError:
+            self.__on_error()
+        else:
+            self.stats.increment('stores')
+
+    def invalidate(self, response: Optional[requests.Response]) -> None:
+        """response is None when the call to Yadro failed without one, a mutation may still have been applied"""
+        if not self.invalidates(response):
+            return
+        try:
+            cache.set_many(self.__new_versions(response), self.__version_ttl())
+        except RedisError:
+            self.__on_error()
+        else:
+            self.stats.increment('invalidations')
+
+    async def ainvalidate(self, response: Optional[requests.Response]) -> None:
+        if not self.invalidates(response):
+            return
+        try:
+            await cache.aset_many(self.__new_versions(response), self.__version_ttl())
+        except RedisError:
+            self.__on_error()
+        else:
+            self.stats.increment('invalidations')
+
+    def __build_key(self, version: str) -> str:
+        params = urlencode(sorted(self.request.query_params.lists()), doseq=True)
+        digest = hashlib.sha256(f'{self.endpoint}?{params}'.encode('utf-8')).hexdigest()[:32]
+        return f'{self.__KEY_PREFIX}:{self.namespace}:{self.scope}:{version}:{digest}'
+
+    def __version_key(self, endpoint: str) -> str:
+        return f'{self.__VERSION_PREFIX}:{self.scope}:{endpoint}'
+
+    def __invalidated_endpoints(self, response: Optional[requests.Response]) -> list:
+        """
+        A mutation invalidates its endpoint and parent whatever its status, Yadro may have applied it before failing.
+        Logout and the like invalidate the endpoints listed in PROXY_CACHE_INVALIDATES whatever the method
+        of the request, but only once Yadro accepted them with a 2xx status.
+        """
+        endpoints = []
+        if self.request.method not in SAFE_METHODS:
+            parent, _, _ = self.endpoint.rpartition('/')
+            endpoints.extend([self.endpoint, parent] if parent else [self.endpoint])
+        if response is not None and 200 <= response.status_code < 300:
+            endpoints.extend(settings.PROXY_CACHE_INVALIDATES.get(endpoint_pattern(self.endpoint), ()))
+        return endpoints
+
+    def __new_versions(self, response: Optional[requests.Response]) -> dict:
+        version = uuid.uuid4().hex[:12]
+        return {self.__version_key(endpoint): version for endpoint in self.__invalidated_endpoints(response)}
+
+    @staticmethod
+    def __version_ttl() -> int:
+        """A version only has to outlive the entries stored under the previous one"""
+        return max(settings.PROXY_CACHE_TTLS.values())
+
+    def __on_error(self) -> None:
+        logger.warning('Response cache is unavailable', exc_info=True)
+        self.stats.increment('errors')
+
+    def __to_response(self, entry: Optional[dict],
+                      prepared_request: requests.PreparedRequest) -> Optional[requests.Response]:
+        if entry is None or any(self.request.headers.get(name) != value for name, value in entry['vary'].items()):
+            self.stats.increment('misses')
+            return None
+
+        self.stats.increment('hits')
+        response = build_response(
+            status_code=entry['status_code'],
+            headers=entry['headers'],
+            content=b'',
+            request=prepared_request,
+        )
+        decode_from_storage(response, encoding=entry.get('encoding'), data=entry['content'])
+        response.from_cache = True
+        return response
+
+    def __to_entry(self, response: requests.Response) -> tuple:
+        """Returns the entry to store and its TTL, honouring Cache-Control and Vary of the upstream response"""
+        if not self.is_enabled or self.__key is None or response.status_code != 200:
+            return None, None
+        directives = parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in directives or 'no-cache' in directives:
+            return None, None
+
+        ttl = self.ttl
+        max_age = directives.get('s-maxage') or directives.get('max-age')
+        if max_age is not None:
+            ttl = min(ttl, int(max_age)) if max_age.isdigit() else 0
+        if ttl <= 0:
+            return None, None
+
+        vary = [name.strip() for name in response.headers.get('Vary', '').split(',') if name.strip()]
+        if '*' in vary:
+            return None, None
+
+        headers = dict(response.headers)
+        if settings.PROXY_ETAGS_ENABLED:
+            headers['ETag'] = response_etag(response)
+        encoding, content = encode_for_storage(response)
+        entry = {
+            'status_code': response.status_code,
+            'headers': headers,
+            'encoding': encoding,
+            'content': content,
+            'vary': {name: self.request.headers.get(name) for name in vary},
+        }
+        return entry, ttl
+
+
+Metrics.register_collector(prefix='proxy_response_cache', snapshot=ResponseCache.stats.snapshot)
@@ -0,0 +1,184 @@
+import gzip
+import zlib
+from dataclasses import dataclass
+from typing import Any, Mapping, Optional
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpRequest
+from requests.exceptions import ContentDecodingError
+from requests.structures import CaseInsensitiveDict
+
+from common.counters import Counters
+from common.metrics import Metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+BROTLI = 'br'
+IDENTITY = 'identity'
+
+_COMPRESSIBLE_CONTENT_TYPES = ('application/json', 'application/problem+json',)
+_DECODE_ERRORS = (OSError, EOFError, zlib.error, *((brotli.error,) if brotli is not None else ()))
+
+stats = Counters('relayed', 'compressed', 'uncompressed', 'bytes_saved')
+
+
+@dataclass(frozen=True, slots=True)
+class EncodedContent:
+    """
+    Compressed bytes of a response body as Yadro sent them or as they were compressed once by the proxy.
+    content is the decoded body they stand for, a route replacing the body leaves them stale and they are ignored.
+    """
+    encoding: str
+    data: bytes
+    content: bytes
+
+
+def attach_encoded(response: requests.Response, encoding: str, data: bytes) -> None:
+    response.encoded_content = EncodedContent(encoding=encoding, data=data, content=response.content)
+
+
+def get_encoded(response: requests.Response) -> Optional[EncodedContent]:
+    encoded = getattr(response, 'encoded_content', None)
+    if encoded is None or encoded.content is not response.content:
+        return None
+    return encoded
+
+
+def upstream_accept_encoding() -> str:
+    """Yadro may compress with anything the proxy can decode for logging and transforms"""
+    return ', '.join((BROTLI, GZIP, DEFLATE) if brotli is not None else (GZIP, DEFLATE))
+
+
+def decode(encoding: str, data: bytes) -> bytes:
+    try:
+        if encoding == GZIP:
+            return gzip.decompress(data)
+        if encoding == DEFLATE:
+            try:
+                return zlib.decompress(data)
+            except zlib.error:
+                return zlib.decompress(data, -zlib.MAX_WBITS)
+        if encoding == BROTLI and brotli is not None:
+            return brotli.decompress(data)
+    except _DECODE_ERRORS as exc:
+        raise ContentDecodingError(f'Failed to decode {encoding} response body') from exc
+    raise ContentDecodingError(f'Unsupported response Content-Encoding {encoding!r}')
+
+
+def encode(encoding: str, content: bytes) -> bytes:
+    if encoding == GZIP:
+        return gzip.compress(content, compresslevel=settings.PROXY_COMPRESSION_GZIP_LEVEL, mtime=0)
+    if encoding == BROTLI:
+        return _brotli().compress(content, quality=settings.PROXY_COMPRESSION_BROTLI_QUALITY)
+    raise ImproperlyConfigured(f'Unsupported PROXY_COMPRESSION_ENCODINGS entry {encoding!r}, expected br or gzip')
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> dict:
+    """Parses Accept-Encoding into {encoding: q}, encodings with q=0 are refused"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        param_name, _, value = params.partition('=')
+        if param_name.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def is_accepted(encoding: str, accepted: Mapping[str, float]) -> bool:
+    return accepted.get(encoding, accepted.get('*', 0.0)) > 0
+
+
+def encode_for_storage(response: requests.Response) -> tuple[str, bytes]:
+    """
+    Returns the encoding and bytes a cached body is stored with, the bytes Yadro sent or the body compressed once.
+    The compressed bytes are also attached to the response, so they are sent to the client without compressing again.
+    """
+    encoded = get_encoded(response)
+    if encoded is not None:
+        return encoded.encoding, encoded.data
+    if not _is_compressible(response):
+        return IDENTITY, response.content
+    encoding = settings.PROXY_COMPRESSION_ENCODINGS[0]
+    data = encode(encoding, response.content)
+    attach_encoded(response, encoding=encoding, data=data)
+    return encoding, data
+
+
+def decode_from_storage(response: requests.Response, encoding: Optional[str], data: bytes) -> None:
+    """Sets the decoded body of a cached response, its stored bytes stay attached to be sent as they are"""
+    if encoding in (None, IDENTITY):
+        response._content = data
+        return
+    response._content = decode(encoding, data)
+    attach_encoded(response, encoding=encoding, data=data)
+
+
+def encode_for_client(request: HttpRequest, response: requests.Response) -> tuple[bytes, CaseInsensitiveDict]:
+    """
+    Returns the body and headers to send, in the first of these the client accepts:
+    the compressed bytes the response already has, the body compressed once with the first accepted encoding
+    of PROXY_COMPRESSION_ENCODINGS, the plain body. A strong ETag becomes weak for a compressed body.
+    """
+    headers = CaseInsensitiveDict(response.headers)
+    if not _is_compressible(response):
+        return response.content, headers
+
+    vary = [name.strip() for name in headers.get('Vary', '').split(',') if name.strip()]
+    if 'accept-encoding' not in {name.lower() for name in vary}:
+        headers['Vary'] = ', '.join([*vary, 'Accept-Encoding'])
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding'))
+    encoded = get_encoded(response)
+    if encoded is not None and is_accepted(encoded.encoding, accepted):
+        stats.increment('relayed')
+        return _encoded_body(headers, encoding=encoded.encoding, data=encoded.data, size=len(response.content))
+
+    encoding = next((name for name in settings.PROXY_COMPRESSION_ENCODINGS if is_accepted(name, accepted)), None)
+    if encoding is None:
+        stats.increment('uncompressed')
+        return response.content, headers
+    stats.increment('compressed')
+    data = encode(encoding, response.content)
+    return _encoded_body(headers, encoding=encoding, data=data, size=len(response.content))
+
+
+def _encoded_body(headers: CaseInsensitiveDict, encoding: str, data: bytes,
+                  size: int) -> tuple[bytes, CaseInsensitiveDict]:
+    stats.increment('bytes_saved', max(0, size - len(data)))
+    headers['Content-Encoding'] = encoding
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+    return data, headers
+
+
+def _is_compressible(response: requests.Response) -> bool:
+    """Small bodies are not worth compressing, bodies Yadro compressed are relayed whatever their size"""
+    if get_encoded(response) is not None:
+        return True
+    content_type = response.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    is_large_enough = len(response.content) >= settings.PROXY_COMPRESSION_MIN_SIZE
+    return settings.PROXY_COMPRESSION_ENABLED and content_type in _COMPRESSIBLE_CONTENT_TYPES and is_large_enough
+
+
+def _brotli() -> Any:
+    if brotli is None:
+        raise ImproperlyConfigured('br in PROXY_COMPRESSION_ENCODINGS requires the brotli package')
+    return brotli
+
+
+Metrics.register_collector(prefix='proxy_compression', snapshot=stats.snapshot)
@@ -0,0 +1,122 @@
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+from common.counters import Counters
+from common.endpoints import endpoint_pattern
+from common.exceptions import UpstreamError, UpstreamTimeout, UpstreamUnavailable
+from common.metrics import Metrics
+
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+
+
+@dataclass(slots=True)
+class Slot:
+    """Outcome of the upstream call made within the slot, read by the limiter when the slot is released"""
+    latency: Optional[float] = None
+    is_failure: bool = False
+
+    def observe(self, latency: float, is_failure: bool = False) -> None:
+        self.latency, self.is_failure = latency, is_failure
+
+
+class ConcurrencyLimiter:
+    """
+    Limits the upstream calls in flight in this worker with an AIMD limit.
+    The limit grows by one for every call answered in time while it is at least half used, and is multiplied by
+    PROXY_CONCURRENCY_BACKOFF_RATIO for every failed call and every call slower than PROXY_CONCURRENCY_LATENCY_TOLERANCE
+    times the usual latency of its endpoint. A request over the limit is answered with 503 and Retry-After at once.
+    Requests of lower priority may only use a share of the limit, so logins still pass when dialogue listings are shed.
+    """
+
+    stats = Counters('admitted', 'shed', 'decreased')
+
+    __BASELINE_WEIGHT = 0.02
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__limit: Optional[float] = None
+        self.__in_flight = 0
+        self.__baselines: dict[tuple[str, str], float] = {}
+        self.__shed_by_priority = Counters(PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+    @staticmethod
+    def priority(endpoint: str, method: str) -> str:
+        priorities = settings.PROXY_CONCURRENCY_PRIORITIES
+        pattern = endpoint_pattern(endpoint)
+        return priorities.get(f'{method} {pattern}', priorities.get(pattern, PRIORITY_NORMAL))
+
+    @contextmanager
+    def acquire(self, endpoint: str, method: str) -> Iterator[Slot]:
+        slot = Slot()
+        if not settings.PROXY_CONCURRENCY_LIMIT_ENABLED:
+            yield slot
+            return
+
+        priority = self.priority(endpoint=endpoint, method=method)
+        with self.__lock:
+            limit = self.__current_limit()
+            allowed = max(1, int(limit * settings.PROXY_CONCURRENCY_PRIORITY_SHARES[priority]))
+            is_shed = self.__in_flight >= allowed
+            if not is_shed:
+                self.__in_flight += 1
+                in_flight = self.__in_flight
+        if is_shed:
+            self.stats.increment('shed')
+            self.__shed_by_priority.increment(priority)
+            raise UpstreamUnavailable(wait=settings.PROXY_CONCURRENCY_RETRY_AFTER)
+
+        self.stats.increment('admitted')
+        try:
+            yield slot
+        except (UpstreamTimeout, UpstreamError):
+            slot.is_failure = True
+            raise
+        finally:
+            with self.__lock:
+                self.__in_flight -= 1
+                self.__update(slot, key=(method, endpoint_pattern(endpoint)), in_flight=in_flight)
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            values = {'limit': round(self.__current_limit()), 'in_flight': self.__in_flight}
+        shed = self.__shed_by_priority.snapshot()
+        return {**self.stats.snapshot(), **values, **{f'shed_{name}': value for name, value in shed.items()}}
+
+    def __current_limit(self) -> float:
+        if self.__limit is None:
+            self.__limit = float(settings.PROXY_CONCURRENCY_INITIAL_LIMIT)
+        return self.__limit
+
+    def __update(self, slot: Slot, key: tuple[str, str], in_flight: int) -> None:
+        """Called under the lock, a call without an observed latency (e.g. throttled before it was sent) is ignored"""
+        is_slow = False
+        if slot.latency is not None and not slot.is_failure:
+            baseline = self.__baselines.get(key)
+            is_slow = baseline is not None and slot.latency > settings.PROXY_CONCURRENCY_LATENCY_TOLERANCE * baseline
+            self.__baselines[key] = slot.latency if baseline is None else (
+                baseline + self.__BASELINE_WEIGHT * (slot.latency - baseline)
+            )
+        elif not slot.is_failure:
+            return
+
+        limit = self.__current_limit()
+        if slot.is_failure or is_slow:
+            self.__limit = max(settings.PROXY_CONCURRENCY_MIN_LIMIT, limit * settings.PROXY_CONCURRENCY_BACKOFF_RATIO)
+            self.stats.increment('decreased')
+        elif in_flight * 2 >= limit:
+            self.__limit = min(settings.PROXY_CONCURRENCY_MAX_LIMIT, limit + 1)
+
+
+concurrency_limiter = ConcurrencyLimiter()
+
+Metrics.register_collector(
+    prefix='proxy_concurrency',
+    snapshot=concurrency_limiter.snapshot,
+    gauges=('limit', 'in_flight'),
+)
@@ -0,0 +1,17 @@
+import threading
+
+
+class Counters:
+    """Thread-safe named counters of a single process"""
+
+    def __init__(self, *names: str) -> None:
+        self.__lock = threading.Lock()
+        self.__values = dict.fromkeys(names, 0)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.__lock:
+            self.__values[name] += value
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return dict(self.__values)
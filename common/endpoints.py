@@ -0,0 +1,8 @@
+def endpoint_pattern(endpoint: str) -> str:
+    """Replaces ids in the endpoint, 'dialogues/15' becomes 'dialogues/<id>'"""
+    return '/'.join('<id>' if segment.isdigit() else segment for segment in endpoint.split('/'))
+
+
+def endpoint_group(endpoint: str) -> str:
+    """Returns the resource the endpoint belongs to, 'dialogues/15' belongs to 'dialogues'"""
+    return endpoint.split('/', 1)[0]
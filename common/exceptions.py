@@ -0,0 +1,27 @@
+from typing import Optional
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class UpstreamUnavailable(APIException):
+    """Yadro is failing and calls to it are suspended, wait is sent as Retry-After"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The service is temporarily unavailable, try again later.'
+    default_code = 'upstream_unavailable'
+
+    def __init__(self, wait: Optional[float] = None, detail: Optional[str] = None) -> None:
+        super().__init__(detail=detail)
+        self.wait = max(1, round(wait)) if wait is not None else None
+
+
+class UpstreamTimeout(APIException):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = 'The service did not respond in time.'
+    default_code = 'upstream_timeout'
+
+
+class UpstreamError(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = 'The service could not be reached.'
+    default_code = 'upstream_error'
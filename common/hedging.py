@@ -0,0 +1,124 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from django.conf import settings
+
+from common.counters import Counters
+from common.endpoints import endpoint_pattern
+from common.metrics import Metrics
+from common.upstream_guard import RetryBudget
+
+T = TypeVar('T')
+
+
+class _LatencyWindow:
+    """Latencies of the last calls of an endpoint, the hedge delay is recomputed every RECOMPUTE_EVERY calls"""
+
+    SIZE = 1000
+    MIN_SAMPLES = 50
+    RECOMPUTE_EVERY = 50
+
+    def __init__(self) -> None:
+        self.__latencies: deque[float] = deque(maxlen=self.SIZE)
+        self.__observed = 0
+        self.delay: Optional[float] = None
+
+    def observe(self, latency: float) -> None:
+        self.__latencies.append(latency)
+        self.__observed += 1
+        if self.__observed % self.RECOMPUTE_EVERY == 0 and len(self.__latencies) >= self.MIN_SAMPLES:
+            latencies = sorted(self.__latencies)
+            index = min(len(latencies) - 1, math.ceil(settings.UPSTREAM_HEDGE_PERCENTILE / 100 * len(latencies)) - 1)
+            self.delay = max(settings.UPSTREAM_HEDGE_MIN_DELAY, latencies[index])
+
+
+class Hedger:
+    """
+    Sends a second identical GET when the first has not been answered within the UPSTREAM_HEDGE_PERCENTILE
+    latency of its endpoint, returns whichever response arrives first and cancels the other call.
+    Hedges are capped at UPSTREAM_HEDGE_MAX_RATE of the hedgeable requests of the worker.
+    Calls run as tasks on the event loop, so a hedge costs an upstream connection but no worker.
+    """
+
+    stats = Counters('requests', 'hedged', 'hedge_won', 'rate_limited')
+
+    def __init__(self) -> None:
+        self.__windows: dict[str, _LatencyWindow] = {}
+        self.__budget: Optional[RetryBudget] = None
+
+    @staticmethod
+    def is_enabled(endpoint: str, method: str) -> bool:
+        is_hedged_endpoint = endpoint_pattern(endpoint) in settings.UPSTREAM_HEDGE_ENDPOINTS
+        return settings.UPSTREAM_HEDGE_ENABLED and method == 'GET' and is_hedged_endpoint
+
+    async def run(self, endpoint: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """fn makes one upstream call, it is called a second time for the hedge"""
+        window = self.__window(endpoint_pattern(endpoint))
+        budget = self.__get_budget()
+        budget.record_request()
+        self.stats.increment('requests')
+
+        started = time.monotonic()
+        first = asyncio.ensure_future(fn())
+        if window.delay is None:
+            return await self.__observed(first, window=window, started=started)
+        try:
+            return await self.__observed(
+                asyncio.shield(first), window=window, started=started, timeout=window.delay,
+            )
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+
+        if not budget.try_withdraw():
+            self.stats.increment('rate_limited')
+            return await self.__observed(first, window=window, started=started)
+
+        self.stats.increment('hedged')
+        hedge_started = time.monotonic()
+        second = asyncio.ensure_future(fn())
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is second:
+                        self.stats.increment('hedge_won')
+                    window.observe(time.monotonic() - (hedge_started if task is second else started))
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def __observed(awaitable: Awaitable[T], window: _LatencyWindow, started: float,
+                         timeout: Optional[float] = None) -> T:
+        result = await asyncio.wait_for(awaitable, timeout=timeout) if timeout is not None else await awaitable
+        window.observe(time.monotonic() - started)
+        return result
+
+    def __window(self, pattern: str) -> _LatencyWindow:
+        window = self.__windows.get(pattern)
+        if window is None:
+            window = self.__windows[pattern] = _LatencyWindow()
+        return window
+
+    def __get_budget(self) -> RetryBudget:
+        """The hedge rate is limited like retries, without the minimum per second"""
+        if self.__budget is None:
+            self.__budget = RetryBudget(ratio=settings.UPSTREAM_HEDGE_MAX_RATE, min_per_second=0)
+        return self.__budget
+
+
+hedger = Hedger()
+
+Metrics.register_collector(prefix='proxy_hedging', snapshot=Hedger.stats.snapshot)
@@ -0,0 +1,266 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Any, Optional
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ProtocolError, ReadTimeoutError, SSLError
+
+from common.compression import IDENTITY, attach_encoded, decode
+from common.metrics import Metrics
+from common.responses import build_response
+from common.upstream_guard import Timeout, httpx_timeout
+
+
+class _PoolStats:
+    """Process-wide counters shared by every upstream connection pool"""
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__counters = {'created': 0, 'reused': 0, 'expired': 0, 'waited': 0}
+        self.pools = weakref.WeakSet()
+
+    def increment(self, name: str) -> None:
+        with self.__lock:
+            self.__counters[name] += 1
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            counters = dict(self.__counters)
+
+        in_use = idle = 0
+        for pool in list(self.pools):
+            queue = pool.pool
+            if queue is None:
+                continue
+            with queue.mutex:
+                pooled = list(queue.queue)
+            in_use += queue.maxsize - len(pooled)
+            idle += sum(1 for conn in pooled if conn is not None and conn.sock is not None)
+
+        counters.update({'open': in_use + idle, 'in_use': in_use, 'idle': idle})
+        return counters
+
+
+class _InstrumentedPoolMixin:
+    """
+    Counts reused/waited-for connections and closes the ones idle longer than the keep-alive timeout.
+    A blocking pool waits at most pool_timeout seconds for a free connection, then raises EmptyPoolError.
+    """
+
+    stats: _PoolStats
+    keep_alive_timeout: Optional[float] = None
+    pool_timeout: Optional[float] = None
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats.pools.add(self)
+
+    def _get_conn(self, timeout: Optional[float] = None) -> Any:
+        if self.block and self.pool is not None and self.pool.empty():
+            self.stats.increment('waited')
+
+        conn = super()._get_conn(timeout=timeout if timeout is not None else self.pool_timeout)
+
+        if conn.sock is not None:
+            last_used = getattr(conn, '_proxy_last_used', None)
+            can_expire = self.keep_alive_timeout is not None and last_used is not None
+            if can_expire and time.monotonic() - last_used > self.keep_alive_timeout:
+                conn.close()
+                self.stats.increment('expired')
+            else:
+                self.stats.increment('reused')
+
+        return conn
+
+    def _put_conn(self, conn: Any) -> None:
+        if conn is not None:
+            conn._proxy_last_used = time.monotonic()
+        super()._put_conn(conn)
+
+    def _new_conn(self) -> Any:
+        self.stats.increment('created')
+        return super()._new_conn()
+
+
+class _RejectCookiesPolicy(DefaultCookiePolicy):
+    """The session is shared by all clients, so upstream cookies must never be stored"""
+
+    def set_ok(self, cookie: Any, request: Any) -> bool:
+        return False
+
+
+class _PooledAdapter(HTTPAdapter):
+
+    def __init__(self, stats: _PoolStats, keep_alive_timeout: Optional[float], pool_timeout: Optional[float],
+                 **kwargs: Any) -> None:
+        attributes = {'stats': stats, 'keep_alive_timeout': keep_alive_timeout, 'pool_timeout': pool_timeout}
+        self.__pool_classes = {
+            'http': type('HTTPConnectionPool', (_InstrumentedPoolMixin, HTTPConnectionPool), attributes),
+            'https': type('HTTPSConnectionPool', (_InstrumentedPoolMixin, HTTPSConnectionPool), attributes),
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.__pool_classes
+
+
+class UpstreamClient:
+    """Process-wide pooled keep-alive HTTP client for communication with third-party services"""
+
+    __instance: Optional['UpstreamClient'] = None
+    __instance_pid: Optional[int] = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.__stats = _PoolStats()
+        self.session = requests.Session()
+        self.session.cookies.set_policy(_RejectCookiesPolicy())
+
+        adapter = _PooledAdapter(
+            stats=self.__stats,
+            keep_alive_timeout=settings.UPSTREAM_KEEP_ALIVE_TIMEOUT,
+            pool_timeout=settings.UPSTREAM_POOL_TIMEOUT,
+            pool_connections=settings.UPSTREAM_POOL_CONNECTIONS,
+            pool_maxsize=settings.UPSTREAM_POOL_MAXSIZE,
+            pool_block=settings.UPSTREAM_POOL_BLOCK,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def get_instance(cls) -> 'UpstreamClient':
+        """Returns the client of the current process, a forked worker never reuses the parent's sockets"""
+        pid = os.getpid()
+        if cls.__instance is None or cls.__instance_pid != pid:
+            with cls.__instance_lock:
+                if cls.__instance is None or cls.__instance_pid != pid:
+                    cls.__instance = cls()
+                    cls.__instance_pid = pid
+        return cls.__instance
+
+    def send(self, prepared_request: requests.PreparedRequest, stream: bool = False,
+             **kwargs: Any) -> requests.Response:
+        """A read response keeps the body bytes as Yadro encoded them next to the decoded content"""
+        if stream or not settings.PROXY_COMPRESSION_ENABLED:
+            return self.session.send(request=prepared_request, stream=stream, **kwargs)
+        response = self.session.send(request=prepared_request, stream=True, **kwargs)
+        _set_content(response, data=_read_raw(response))
+        return response
+
+    def pool_stats(self) -> dict:
+        return self.__stats.snapshot()
+
+
+class AsyncUpstreamClient:
+    """Pooled keep-alive HTTP client for the ASGI path, one instance per event loop"""
+
+    __instances: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncUpstreamClient]' = (
+        weakref.WeakKeyDictionary()
+    )
+
+    def __init__(self) -> None:
+        self.client = httpx.AsyncClient(
+            cookies=httpx.Cookies(CookieJar(policy=_RejectCookiesPolicy())),
+            limits=httpx.Limits(
+                max_connections=settings.UPSTREAM_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.UPSTREAM_POOL_MAXSIZE,
+                keepalive_expiry=settings.UPSTREAM_KEEP_ALIVE_TIMEOUT,
+            ),
+            timeout=None,
+            follow_redirects=True,
+        )
+
+    @classmethod
+    def get_instance(cls) -> 'AsyncUpstreamClient':
+        """httpx connections are bound to the loop that opened them, so every running loop gets its own client"""
+        loop = asyncio.get_running_loop()
+        instance = cls.__instances.get(loop)
+        if instance is None:
+            instance = cls.__instances[loop] = cls()
+        return instance
+
+    async def send(self, prepared_request: requests.PreparedRequest,
+                   timeout: Optional[Timeout] = None) -> requests.Response:
+        if not settings.PROXY_COMPRESSION_ENABLED:
+            response = await self.client.request(
+                method=prepared_request.method,
+                url=prepared_request.url,
+                headers=prepared_request.headers,
+                content=prepared_request.body,
+                timeout=httpx_timeout(timeout),
+            )
+            return build_response(
+                status_code=response.status_code,
+                headers=response.headers,
+                content=response.content,
+                request=prepared_request,
+                reason=response.reason_phrase,
+            )
+
+        response = await self.open_stream(prepared_request=prepared_request, timeout=timeout)
+        try:
+            data = b''.join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        built = build_response(
+            status_code=response.status_code,
+            headers=response.headers,
+            content=b'',
+            request=prepared_request,
+            reason=response.reason_phrase,
+        )
+        _set_content(built, data=data)
+        return built
+
+    async def open_stream(self, prepared_request: requests.PreparedRequest,
+                          timeout: Optional[Timeout] = None) -> httpx.Response:
+        """Returns as soon as the headers arrive, the caller reads the body and must close the response"""
+        request = self.client.build_request(
+            method=prepared_request.method,
+            url=prepared_request.url,
+            headers=prepared_request.headers,
+            content=prepared_request.body,
+            timeout=httpx_timeout(timeout),
+        )
+        return await self.client.send(request, stream=True)
+
+
+def _read_raw(response: requests.Response) -> bytes:
+    """Reads the body without decoding it, urllib3 errors are raised as requests would raise them"""
+    try:
+        data = response.raw.read(decode_content=False)
+    except ProtocolError as exc:
+        raise ChunkedEncodingError(exc)
+    except ReadTimeoutError as exc:
+        raise requests.ConnectionError(exc)
+    except SSLError as exc:
+        raise requests.exceptions.SSLError(exc)
+    response.raw.release_conn()
+    return data
+
+
+def _set_content(response: requests.Response, data: bytes) -> None:
+    encoding = response.headers.get('Content-Encoding', IDENTITY).strip().lower() or IDENTITY
+    response._content_consumed = True
+    if encoding == IDENTITY:
+        response._content = data
+        return
+    response._content = decode(encoding, data)
+    attach_encoded(response, encoding=encoding, data=data)
+
+
+Metrics.register_collector(
+    prefix='proxy_upstream_connections',
+    snapshot=lambda: UpstreamClient.get_instance().pool_stats(),
+    gauges=('open', 'in_use', 'idle'),
+)
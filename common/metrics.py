@@ -0,0 +1,203 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from django.conf import settings
+
+from common.processes import is_process_alive
+
+logger = logging.getLogger(__name__)
+
+Labels = tuple[tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_request_stages: ContextVar[Optional[list]] = ContextVar('request_stages', default=None)
+
+
+@dataclass(slots=True)
+class StageTiming:
+    duration: float = 0.0
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[StageTiming]:
+    """Times a stage of the current request, MetricsMiddleware observes it with the route and the final status"""
+    timing = StageTiming()
+    started = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.duration = time.perf_counter() - started
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, timing.duration))
+
+
+@contextmanager
+def track_request() -> Iterator[list]:
+    """Collects the stage timings of one request"""
+    stages = []
+    token = _request_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _request_stages.reset(token)
+
+
+class Metrics:
+    """
+    Latency histograms and counters of a single worker process.
+    Every thread observes into its own shard, so the request path never takes a lock. Each worker dumps its totals
+    to PROXY_METRICS_DIR from a background thread and /metrics sums the dumps of all live workers.
+    """
+
+    __FILE_PREFIX = 'metrics'
+    __collectors: list[tuple[str, Callable[[], dict], tuple[str, ...]]] = []
+
+    __instance: Optional['Metrics'] = None
+    __instance_pid: Optional[int] = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.__local = threading.local()
+        self.__shards = []
+        self.__dir = Path(settings.PROXY_METRICS_DIR) if settings.PROXY_METRICS_DIR else None
+        if self.__dir is not None:
+            threading.Thread(target=self.__run, name='metrics-dump', daemon=True).start()
+            atexit.register(self.__dump)
+
+    @classmethod
+    def get_instance(cls) -> 'Metrics':
+        """Returns the metrics of the current process, a forked worker starts from zero"""
+        pid = os.getpid()
+        if cls.__instance is None or cls.__instance_pid != pid:
+            with cls.__instance_lock:
+                if cls.__instance is None or cls.__instance_pid != pid:
+                    cls.__instance = cls()
+                    cls.__instance_pid = pid
+        return cls.__instance
+
+    @classmethod
+    def register_collector(cls, prefix: str, snapshot: Callable[[], dict], gauges: tuple[str, ...] = ()) -> None:
+        """Exposes the values of snapshot() as <prefix>_<name>_total counters, names listed in gauges as gauges"""
+        cls.__collectors.append((prefix, snapshot, gauges))
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        shard = getattr(self.__local, 'shard', None)
+        if shard is None:
+            shard = self.__local.shard = {}
+            self.__shards.append(shard)
+
+        series = shard.get((name, labels))
+        if series is None:
+            # a count per bucket with +Inf last, then the sum and the count of the observations
+            series = shard[(name, labels)] = [0] * (len(LATENCY_BUCKETS) + 3)
+        series[bisect_left(LATENCY_BUCKETS, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def snapshot(self) -> dict:
+        """Totals of this process, shards of other threads are copied without a lock and may lag by an observation"""
+        histograms = {}
+        for shard in list(self.__shards):
+            for (name, labels), series in dict(shard).items():
+                total = histograms.setdefault(json.dumps([name, labels]), [0] * len(series))
+                for i, value in enumerate(list(series)):
+                    total[i] += value
+
+        counters, gauges = {}, {}
+        for prefix, snapshot, gauge_names in self.__collectors:
+            try:
+                values = snapshot()
+            except Exception:
+                logger.exception('Failed to collect %s metrics', prefix)
+                continue
+            for name, value in values.items():
+                if name in gauge_names:
+                    gauges[f'{prefix}_{name}'] = value
+                else:
+                    counters[f'{prefix}_{name}_total'] = value
+
+        return {'histograms': histograms, 'counters': counters, 'gauges': gauges}
+
+    def render(self) -> str:
+        """Prometheus text format of all live workers"""
+        totals = self.snapshot()
+        for snapshot in self.__read_workers():
+            for kind in ('counters', 'gauges'):
+                for name, value in snapshot[kind].items():
+                    totals[kind][name] = totals[kind].get(name, 0) + value
+            for key, series in snapshot['histograms'].items():
+                total = totals['histograms'].setdefault(key, [0] * len(series))
+                for i, value in enumerate(series):
+                    total[i] += value
+
+        lines = []
+        for kind, metric_type in (('counters', 'counter'), ('gauges', 'gauge')):
+            for name, value in sorted(totals[kind].items()):
+                lines += [f'# TYPE {name} {metric_type}', f'{name} {value}']
+
+        rendered_types = set()
+        for key, series in sorted(totals['histograms'].items()):
+            name, labels = json.loads(key)
+            if name not in rendered_types:
+                rendered_types.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), series):
+                cumulative += count
+                lines.append(f'{name}_bucket{self.__format_labels([*labels, ["le", str(bound)]])} {cumulative}')
+            lines.append(f'{name}_sum{self.__format_labels(labels)} {series[-2]}')
+            lines.append(f'{name}_count{self.__format_labels(labels)} {series[-1]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def __run(self) -> None:
+        while True:
+            time.sleep(settings.PROXY_METRICS_DUMP_INTERVAL)
+            self.__dump()
+
+    def __dump(self) -> None:
+        """The file is replaced atomically, so a reader never sees a partial dump"""
+        path = self.__dir / f'{self.__FILE_PREFIX}.{os.getpid()}.json'
+        tmp_path = path.with_suffix('.tmp')
+        try:
+            self.__dir.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(self.snapshot()), encoding='utf-8')
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception('Failed to dump metrics to %s', path)
+
+    def __read_workers(self) -> Iterable[dict]:
+        """Dumps of other live workers, those of dead workers are removed and their counters start again"""
+        if self.__dir is None or not self.__dir.is_dir():
+            return
+        for path in self.__dir.glob(f'{self.__FILE_PREFIX}.*.json'):
+            pid = int(path.suffixes[0].lstrip('.'))
+            if pid == os.getpid():
+                continue
+            if not is_process_alive(pid):
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                yield json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+
+    @staticmethod
+    def __format_labels(labels: Iterable) -> str:
+        def escape(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        formatted = ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+        return f'{{{formatted}}}' if formatted else ''
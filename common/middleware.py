@@ -0,0 +1,42 @@
+import asyncio
+import time
+from typing import Callable
+
+from django.http import HttpRequest
+from django.http.response import HttpResponseBase
+from django.utils.decorators import sync_and_async_middleware
+
+from common.metrics import Metrics, track_request
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response: Callable) -> Callable:
+    """
+    Observes the latency of every request and of its stages by route, method and status.
+    Streaming responses are observed once their headers are ready, not when the client has read the body.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest) -> HttpResponseBase:
+            started = time.perf_counter()
+            with track_request() as stages:
+                response = await get_response(request)
+            _observe(request=request, response=response, duration=time.perf_counter() - started, stages=stages)
+            return response
+    else:
+        def middleware(request: HttpRequest) -> HttpResponseBase:
+            started = time.perf_counter()
+            with track_request() as stages:
+                response = get_response(request)
+            _observe(request=request, response=response, duration=time.perf_counter() - started, stages=stages)
+            return response
+
+    return middleware
+
+
+def _observe(request: HttpRequest, response: HttpResponseBase, duration: float, stages: list) -> None:
+    route = request.resolver_match.route if request.resolver_match is not None else 'unmatched'
+    labels = (('route', route), ('method', request.method), ('status', str(response.status_code)))
+    metrics = Metrics.get_instance()
+    metrics.observe('proxy_request_duration_seconds', duration, labels)
+    for stage, stage_duration in stages:
+        metrics.observe('proxy_stage_duration_seconds', stage_duration, (('stage', stage), *labels))
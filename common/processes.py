@@ -0,0 +1,12 @@
+import os
+
+
+def is_process_alive(pid: int) -> bool:
+    """Whether a worker that left files behind (log spills, metric dumps) is still running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
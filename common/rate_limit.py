@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from redis import RedisError
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+
+from common.auth import auth_scope, client_address
+from common.counters import Counters
+from common.endpoints import endpoint_group, endpoint_pattern
+from common.exceptions import UpstreamUnavailable
+from common.metrics import Metrics
+from common.redis import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# GCRA of the client key (KEYS[1]) and of the global outbound key (KEYS[2]), both in milliseconds of Redis time.
+# ARGV: client emission interval and tolerance, global emission interval, tolerance and longest queue wait.
+# A request is admitted only if both admit it, the global limit may admit it after a wait instead of rejecting.
+# Returns {status, milliseconds}: {0, wait before sending}, {1, client retry after}, {2, global retry after}
+_GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local function tat_of(key)
+    local tat = tonumber(redis.call('GET', key))
+    if tat == nil or tat < now then
+        return now
+    end
+    return tat
+end
+
+local client_interval, client_tolerance = tonumber(ARGV[1]), tonumber(ARGV[2])
+local client_tat = 0
+if client_interval > 0 then
+    client_tat = tat_of(KEYS[1])
+    if client_tat - now > client_tolerance then
+        return {1, client_tat - now - client_tolerance}
+    end
+end
+
+local global_interval, global_tolerance, max_wait = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local wait = 0
+if global_interval > 0 then
+    local global_tat = tat_of(KEYS[2])
+    wait = global_tat - now - global_tolerance
+    if wait > max_wait then
+        return {2, wait - max_wait}
+    end
+    redis.call('SET', KEYS[2], global_tat + global_interval, 'PX', global_tat + global_interval - now + 1)
+end
+
+if client_interval > 0 then
+    redis.call('SET', KEYS[1], client_tat + client_interval, 'PX', client_tat + client_interval - now + 1)
+end
+return {0, math.max(wait, 0)}
+"""
+
+_scripts: 'weakref.WeakKeyDictionary[Any, Any]' = weakref.WeakKeyDictionary()
+
+
+def _gcra_script(client: Any) -> Any:
+    """The script is sent once per client, later checks call it by its SHA"""
+    script = _scripts.get(client)
+    if script is None:
+        script = _scripts[client] = client.register_script(_GCRA_SCRIPT)
+    return script
+
+
+@dataclass(frozen=True, slots=True)
+class Rate:
+    """'60/min' admits 60 requests per minute, all of them at once after a minute without requests"""
+    interval_ms: int
+    tolerance_ms: int
+
+    @classmethod
+    def parse(cls, rate: Optional[str]) -> Optional['Rate']:
+        if not rate:
+            return None
+        try:
+            count, period = rate.split('/')
+            count, seconds = int(count), _PERIODS[period.strip()[0]]
+        except (ValueError, KeyError, IndexError):
+            raise ImproperlyConfigured(f"Invalid rate {rate!r}, expected '<count>/<s|min|h|d>'") from None
+        if count <= 0:
+            raise ImproperlyConfigured(f'Invalid rate {rate!r}, the count must be greater than 0')
+        interval_ms = max(1, seconds * 1000 // count)
+        return cls(interval_ms=interval_ms, tolerance_ms=interval_ms * (count - 1))
+
+
+class RateLimiter:
+    """
+    Admission control of the upstream calls of a request, a single Redis round trip per check.
+    Clients, the hash of their Authorization header or their address (see client_address) when anonymous,
+    are limited per endpoint group by PROXY_RATE_LIMITS and get 429 with Retry-After beyond it. All calls to Yadro
+    together are limited by PROXY_UPSTREAM_RATE_LIMIT, a call over it waits up to PROXY_UPSTREAM_QUEUE_TIMEOUT
+    seconds before the request gets 503. Without Redis requests are admitted.
+    """
+
+    stats = Counters('admitted', 'queued', 'throttled', 'rejected', 'errors')
+
+    __KEY_PREFIX = 'proxy:rate'
+    __GLOBAL_KEY = f'{__KEY_PREFIX}:upstream'
+
+    def __init__(self, request: Request, endpoint: str) -> None:
+        self.request = request
+        self.endpoint = endpoint
+        limits = settings.PROXY_RATE_LIMITS
+        self.__limit_name = next(
+            (name for name in (endpoint_pattern(endpoint), endpoint_group(endpoint)) if name in limits), None,
+        )
+        self.__client_rate = Rate.parse(limits[self.__limit_name]) if self.__limit_name else None
+        self.__global_rate = Rate.parse(settings.PROXY_UPSTREAM_RATE_LIMIT)
+
+    @property
+    def is_enabled(self) -> bool:
+        return settings.PROXY_RATE_LIMIT_ENABLED and (self.__client_rate is not None or self.__global_rate is not None)
+
+    def check(self) -> None:
+        if not self.is_enabled:
+            return
+        try:
+            status, milliseconds = _gcra_script(get_redis())(keys=self.__keys(), args=self.__args())
+        except RedisError:
+            self.__on_error()
+            return
+        wait = self.__on_result(status=int(status), milliseconds=int(milliseconds))
+        if wait:
+            time.sleep(wait)
+
+    async def acheck(self) -> None:
+        if not self.is_enabled:
+            return
+        try:
+            status, milliseconds = await _gcra_script(get_async_redis())(keys=self.__keys(), args=self.__args())
+        except RedisError:
+            self.__on_error()
+            return
+        wait = self.__on_result(status=int(status), milliseconds=int(milliseconds))
+        if wait:
+            await asyncio.sleep(wait)
+
+    def __keys(self) -> list[str]:
+        return [f'{self.__KEY_PREFIX}:{self.__limit_name}:{self.__client_key()}', self.__GLOBAL_KEY]
+
+    def __args(self) -> list[int]:
+        client_rate, global_rate = self.__client_rate, self.__global_rate
+        return [
+            client_rate.interval_ms if client_rate else 0,
+            client_rate.tolerance_ms if client_rate else 0,
+            global_rate.interval_ms if global_rate else 0,
+            global_rate.tolerance_ms if global_rate else 0,
+            int(settings.PROXY_UPSTREAM_QUEUE_TIMEOUT * 1000),
+        ]
+
+    def __client_key(self) -> str:
+        scope = auth_scope(self.request)
+        if scope == 'anonymous':
+            return f'anonymous:{client_address(self.request)}'
+        return scope
+
+    def __on_result(self, status: int, milliseconds: int) -> float:
+        """Raises for a rejected request, returns the seconds an admitted one waits for the global limit"""
+        if status == 1:
+            self.stats.increment('throttled')
+            raise Throttled(wait=milliseconds / 1000)
+        if status == 2:
+            self.stats.increment('rejected')
+            raise UpstreamUnavailable(wait=milliseconds / 1000)
+        self.stats.increment('admitted')
+        if milliseconds:
+            self.stats.increment('queued')
+        return milliseconds / 1000
+
+    def __on_error(self) -> None:
+        self.stats.increment('errors')
+        logger.warning('Rate limiter is unavailable, admitting %s', self.endpoint, exc_info=True)
+
+
+Metrics.register_collector(prefix='proxy_rate_limit', snapshot=RateLimiter.stats.snapshot)
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Optional
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_client: Optional[redis.Redis] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.asyncio.Redis]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _url() -> str:
+    return f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}'
+
+
+def get_redis() -> redis.Redis:
+    """Returns the Redis client of the current process, for the commands the Django cache API does not offer"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = redis.Redis.from_url(_url())
+                _client_pid = pid
+    return _client
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    """Returns the asyncio Redis client of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = redis.asyncio.Redis.from_url(_url())
+    return client
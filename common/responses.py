@@ -0,0 +1,49 @@
+import hashlib
+from typing import Mapping, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+def build_response(
+    status_code: int,
+    headers: Mapping[str, str],
+    content: bytes,
+    request: Optional[requests.PreparedRequest],
+    reason: Optional[str] = None,
+) -> requests.Response:
+    """Builds a requests.Response, so responses that did not come from the sync client look the same downstream"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.reason = reason
+    response.request = request
+    response.url = request.url if request is not None else None
+    response._content = content
+    return response
+
+
+def clone_response(response: requests.Response) -> requests.Response:
+    """Copies the response with its own headers, so every waiter of a shared upstream call may change its copy"""
+    clone = build_response(
+        status_code=response.status_code,
+        headers=response.headers,
+        content=response.content,
+        request=response.request,
+        reason=response.reason,
+    )
+    clone.encoding = response.encoding
+    clone.elapsed = response.elapsed
+    if hasattr(response, 'encoded_content'):
+        clone.encoded_content = response.encoded_content
+    return clone
+
+
+def response_etag(response: requests.Response) -> str:
+    """The ETag Yadro sent, otherwise a strong ETag of the body"""
+    etag = response.headers.get('ETag')
+    if etag:
+        return etag
+    return f'"{hashlib.sha256(response.content).hexdigest()[:32]}"'
@@ -1,8 +1,26 @@
+from typing import Awaitable, Mapping, Union
+
+import httpx
 import requests
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from requests import Response
+from requests.structures import CaseInsensitiveDict
 from rest_framework.request import Request
 
+from common.auth import auth_scope
+from common.cache import ResponseCache
+from common.compression import upstream_accept_encoding
+from common.concurrency import concurrency_limiter
+from common.exceptions import UpstreamError, UpstreamTimeout
+from common.hedging import hedger
+from common.http_client import AsyncUpstreamClient, UpstreamClient
+from common.metrics import stage_timer
+from common.rate_limit import RateLimiter
+from common.responses import build_response
+from common.single_flight import single_flight
+from common.streaming import astream_response, is_streaming_response, stream_response
+from common.upstream_guard import FAILURE_STATUS_CODES, UpstreamGuard
 from logger.services.Logger import Logger
 
 
@@ -10,39 +28,254 @@ class Route:
     """Base Route for communication with third-party services"""
 
     __ALLOWED_CLIENT_HEADERS = ('Authorization', 'Content-Type',)
-    __HEADERS_FOR_DELETE = ('Connection', 'Keep-Alive', 'Content-Length',)
+    __ALLOWED_STREAMING_CLIENT_HEADERS = ('Accept',)
+    __CONDITIONAL_CLIENT_HEADERS = ('If-None-Match', 'If-Modified-Since',)
+    __RAW_BODY_CONTENT_TYPES = ('application/json',)
+    __HEADERS_FOR_DELETE = ('Connection', 'Keep-Alive', 'Content-Length', 'Transfer-Encoding', 'Content-Encoding',)
 
     def __init__(self, request: Request) -> None:
         self.request = request
         Logger().log_client_request(request=self.request)
 
     def send(self, endpoint: str) -> requests.Response:
-        prepared_request = self._prepare_request(endpoint=endpoint)
-        response = self._send_request(prepared_request=prepared_request)
-        self._filter_response_headers(response=response)
-        Logger().log_proxy_request_core_response(response=response)
+        with stage_timer('prepare'):
+            prepared_request = self._prepare_request(endpoint=endpoint)
+        cache = self._get_cache(endpoint=endpoint)
+        with stage_timer('cache'):
+            response = cache.get(prepared_request=prepared_request)
+        if response is not None:
+            return response
+
+        if not self.__can_share_upstream_call():
+            return self.__fetch(endpoint=endpoint, prepared_request=prepared_request, cache=cache)
+
+        return single_flight.do(
+            key=self.__flight_key(prepared_request=prepared_request),
+            fn=lambda: self.__fetch(endpoint=endpoint, prepared_request=prepared_request, cache=cache),
+            lookup=(lambda: cache.poll(prepared_request=prepared_request)) if cache.can_lookup else None,
+        )
+
+    async def asend(self, endpoint: str) -> requests.Response:
+        with stage_timer('prepare'):
+            prepared_request = self._prepare_request(endpoint=endpoint)
+        cache = self._get_cache(endpoint=endpoint)
+        with stage_timer('cache'):
+            response = await cache.aget(prepared_request=prepared_request)
+        if response is not None:
+            return response
+
+        if not self.__can_share_upstream_call():
+            return await self.__afetch(endpoint=endpoint, prepared_request=prepared_request, cache=cache)
+
+        return await single_flight.ado(
+            key=self.__flight_key(prepared_request=prepared_request),
+            fn=lambda: self.__afetch(endpoint=endpoint, prepared_request=prepared_request, cache=cache),
+            lookup=(lambda: cache.apoll(prepared_request=prepared_request)) if cache.can_lookup else None,
+        )
+
+    def send_streaming(self, endpoint: str) -> Union[requests.Response, StreamingHttpResponse]:
+        """
+        Relays a chunked or text/event-stream Yadro response to the client as its chunks arrive.
+        Responses of a known length are read and returned like send does, but are never cached.
+        """
+        with stage_timer('prepare'):
+            prepared_request = self._prepare_request(endpoint=endpoint, streaming=True)
+        cache = self._get_cache(endpoint=endpoint)
+        try:
+            response = self.__call_upstream(endpoint=endpoint, prepared_request=prepared_request, stream=True)
+        except (UpstreamTimeout, UpstreamError):
+            cache.invalidate(response=None)
+            raise
+        if not is_streaming_response(response.headers):
+            response = self._handle_response(response=response)
+            cache.invalidate(response=response)
+            return response
+
+        cache.invalidate(response=response)
+        return stream_response(
+            response=response,
+            headers=self.__filter_headers(response.headers),
+            record=Logger().detach_record(),
+        )
+
+    async def asend_streaming(self, endpoint: str) -> Union[requests.Response, StreamingHttpResponse]:
+        with stage_timer('prepare'):
+            prepared_request = self._prepare_request(endpoint=endpoint, streaming=True)
+        cache = self._get_cache(endpoint=endpoint)
+        try:
+            response = await self.__acall_upstream(endpoint=endpoint, prepared_request=prepared_request, stream=True)
+        except (UpstreamTimeout, UpstreamError):
+            await cache.ainvalidate(response=None)
+            raise
+        if not is_streaming_response(response.headers):
+            await response.aread()
+            response = self._handle_response(response=build_response(
+                status_code=response.status_code,
+                headers=response.headers,
+                content=response.content,
+                request=prepared_request,
+                reason=response.reason_phrase,
+            ))
+            await cache.ainvalidate(response=response)
+            return response
+
+        await cache.ainvalidate(response=response)
+        return astream_response(
+            response=response,
+            prepared_request=prepared_request,
+            headers=self.__filter_headers(response.headers),
+            record=Logger().detach_record(),
+        )
+
+    def __fetch(self, endpoint: str, prepared_request: requests.PreparedRequest,
+                cache: ResponseCache) -> requests.Response:
+        try:
+            response = self.__call_upstream(endpoint=endpoint, prepared_request=prepared_request)
+        except (UpstreamTimeout, UpstreamError):
+            cache.invalidate(response=None)
+            raise
+        response = self._handle_response(response=response)
+        with stage_timer('cache'):
+            cache.set(response=response)
+            cache.invalidate(response=response)
+        return response
+
+    async def __afetch(self, endpoint: str, prepared_request: requests.PreparedRequest,
+                       cache: ResponseCache) -> requests.Response:
+        try:
+            response = await self.__acall_upstream(endpoint=endpoint, prepared_request=prepared_request)
+        except (UpstreamTimeout, UpstreamError):
+            await cache.ainvalidate(response=None)
+            raise
+        response = self._handle_response(response=response)
+        with stage_timer('cache'):
+            await cache.aset(response=response)
+            await cache.ainvalidate(response=response)
+        return response
+
+    def __call_upstream(self, endpoint: str, prepared_request: requests.PreparedRequest,
+                        stream: bool = False) -> requests.Response:
+        """
+        Sheds the request when the worker already has too many upstream calls in flight, then checks the rate limits.
+        A streamed call holds its concurrency slot until the response headers arrive.
+        """
+        with concurrency_limiter.acquire(endpoint=endpoint, method=prepared_request.method) as slot:
+            with stage_timer('admission'):
+                RateLimiter(request=self.request, endpoint=endpoint).check()
+            with stage_timer('upstream') as timing:
+                response = self._send_request(endpoint=endpoint, prepared_request=prepared_request, stream=stream)
+            slot.observe(latency=timing.duration, is_failure=response.status_code in FAILURE_STATUS_CODES)
+        Logger().log_upstream_duration(duration=timing.duration)
         return response
 
-    def _prepare_request(self, endpoint: str) -> requests.PreparedRequest:
+    async def __acall_upstream(self, endpoint: str, prepared_request: requests.PreparedRequest,
+                               stream: bool = False) -> Union[requests.Response, httpx.Response]:
+        with concurrency_limiter.acquire(endpoint=endpoint, method=prepared_request.method) as slot:
+            with stage_timer('admission'):
+                await RateLimiter(request=self.request, endpoint=endpoint).acheck()
+            with stage_timer('upstream') as timing:
+                response = await self._asend_request(
+                    endpoint=endpoint, prepared_request=prepared_request, stream=stream,
+                )
+            slot.observe(latency=timing.duration, is_failure=response.status_code in FAILURE_STATUS_CODES)
+        Logger().log_upstream_duration(duration=timing.duration)
+        return response
+
+    def __can_share_upstream_call(self) -> bool:
+        return settings.PROXY_SINGLE_FLIGHT_ENABLED and self.request.method == 'GET'
+
+    def __flight_key(self, prepared_request: requests.PreparedRequest) -> str:
+        """
+        Identical GETs of the same client share an upstream call, the response is never shared between clients.
+        Forwarded conditional headers are part of the key, as Yadro may answer them with a bodiless 304.
+        """
+        conditions = ':'.join(prepared_request.headers.get(name, '') for name in self.__CONDITIONAL_CLIENT_HEADERS)
+        return f'{type(self).__name__}:{auth_scope(self.request)}:{conditions}:{prepared_request.url}'
+
+    def _get_cache(self, endpoint: str) -> ResponseCache:
+        """Responses are cached after _transform_response, so every Route class gets its own namespace"""
+        return ResponseCache(request=self.request, endpoint=endpoint, namespace=type(self).__name__)
+
+    def _prepare_request(self, endpoint: str, streaming: bool = False) -> requests.PreparedRequest:
+        """A streaming request also forwards Accept, so Yadro knows the client reads an event stream"""
         url = f'{settings.THIRD_PARTY_APP_URL}/{settings.APP_ID}/{endpoint}/'
         prepared_request = requests.Request(
             method=self.request.method,
             url=url,
-            json=self.request.data,
             params=self.request.query_params,
-            headers=self.__filter_request_headers(self.request.headers)
+            headers=self.__filter_request_headers(self.request.headers, streaming=streaming),
+            **self.__get_body(),
         ).prepare()
 
         return prepared_request
 
+    def __get_body(self) -> dict:
+        """
+        JSON bodies are forwarded as the exact bytes the client sent, without DRF parsing and serializing them again.
+        Bodies of other content types are still converted to JSON from the parsed request data.
+        """
+        content_type = self.request.content_type.split(';', 1)[0].strip().lower()
+        body = self.request.body
+        if not body:
+            return {}
+        if content_type in self.__RAW_BODY_CONTENT_TYPES or not content_type:
+            return {'data': body}
+        return {'json': self.request.data}
+
+    @staticmethod
+    def _send_request(endpoint: str, prepared_request: requests.PreparedRequest,
+                      stream: bool = False) -> requests.Response:
+        """Fails with a standardized 502/503/504 error when Yadro can not be reached or its endpoint group is down"""
+        guard = UpstreamGuard(endpoint=endpoint, method=prepared_request.method)
+        return guard.call(lambda: UpstreamClient.get_instance().send(
+            prepared_request=prepared_request, stream=stream, timeout=guard.timeout,
+        ))
+
     @staticmethod
-    def _send_request(prepared_request: requests.PreparedRequest) -> requests.Response:
-        session = requests.Session()
-        return session.send(request=prepared_request)
+    async def _asend_request(endpoint: str, prepared_request: requests.PreparedRequest,
+                             stream: bool = False) -> Union[requests.Response, httpx.Response]:
+        """
+        A streamed call returns the httpx response as soon as its headers arrive.
+        Slow GETs of UPSTREAM_HEDGE_ENDPOINTS are hedged, the breaker and retries see the hedged pair as one call.
+        """
+        guard = UpstreamGuard(endpoint=endpoint, method=prepared_request.method)
+        client = AsyncUpstreamClient.get_instance()
+        if stream:
+            return await guard.acall(
+                lambda: client.open_stream(prepared_request=prepared_request, timeout=guard.timeout),
+            )
 
-    def __filter_request_headers(self, headers: dict) -> dict:
-        return {k: v for k, v in headers.items() if k in self.__ALLOWED_CLIENT_HEADERS}
+        def send() -> Awaitable[requests.Response]:
+            return client.send(prepared_request=prepared_request, timeout=guard.timeout)
+
+        if hedger.is_enabled(endpoint=endpoint, method=prepared_request.method):
+            return await guard.acall(lambda: hedger.run(endpoint=endpoint, fn=send))
+        return await guard.acall(send)
+
+    def _handle_response(self, response: requests.Response) -> requests.Response:
+        self._filter_response_headers(response=response)
+        Logger().log_proxy_request_core_response(response=response)
+        with stage_timer('transform'):
+            return self._transform_response(response=response)
+
+    def _transform_response(self, response: requests.Response) -> requests.Response:
+        """Hook for routes that change the Yadro response before it is returned to the client"""
+        return response
+
+    def __filter_request_headers(self, headers: dict, streaming: bool = False) -> dict:
+        allowed_headers = self.__ALLOWED_CLIENT_HEADERS
+        if streaming:
+            allowed_headers += self.__ALLOWED_STREAMING_CLIENT_HEADERS
+        if settings.UPSTREAM_CONDITIONAL_REQUESTS and self.request.method == 'GET':
+            allowed_headers += self.__CONDITIONAL_CLIENT_HEADERS
+        filtered_headers = {k: v for k, v in headers.items() if k in allowed_headers}
+        if settings.PROXY_COMPRESSION_ENABLED and not streaming:
+            filtered_headers['Accept-Encoding'] = upstream_accept_encoding()
+        return filtered_headers
 
     def _filter_response_headers(self, response: Response) -> None:
-        filtered_headers = {k: v for k, v in response.headers.items() if k not in self.__HEADERS_FOR_DELETE}
-        response.headers = filtered_headers
+        response.headers = self.__filter_headers(response.headers)
+
+    def __filter_headers(self, headers: Mapping[str, str]) -> CaseInsensitiveDict:
+        headers_for_delete = {header.lower() for header in self.__HEADERS_FOR_DELETE}
+        return CaseInsensitiveDict({k: v for k, v in headers.items() if k.lower() not in headers_for_delete})
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+import requests
+from django.conf import settings
+from redis import RedisError
+from redis.asyncio.lock import Lock as AsyncLock
+from redis.lock import Lock
+
+from common.counters import Counters
+from common.metrics import Metrics
+from common.redis import get_async_redis, get_redis
+from common.responses import clone_response
+from logger.services.Logger import Logger
+
+Lookup = Callable[[], Optional[requests.Response]]
+AsyncLookup = Callable[[], Awaitable[Optional[requests.Response]]]
+
+
+class _Call:
+    """response is a copy of the leader's response, the leader keeps changing its own one downstream"""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response: Optional[requests.Response] = None
+        self.log_fields: dict = {}
+        self.error: Optional[Exception] = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical upstream GETs into one call.
+    Within a process the waiters get a copy of the leader's response and log its upstream call. Across workers
+    (PROXY_SINGLE_FLIGHT_DISTRIBUTED) the leader holds a short Redis lock and the other workers
+    wait for its response to appear in the response cache, falling back to their own call.
+    """
+
+    stats = Counters('calls', 'collapsed', 'remote_collapsed')
+
+    __LOCK_PREFIX = 'proxy:flight'
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__calls = {}
+        self.__tasks = {}
+
+    def do(self, key: str, fn: Callable[[], requests.Response], lookup: Optional[Lookup]) -> requests.Response:
+        with self.__lock:
+            call = self.__calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.__calls[key] = _Call()
+
+        if not is_leader:
+            self.stats.increment('collapsed')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            Logger().log_shared_upstream_call(call.log_fields)
+            return clone_response(call.response)
+
+        self.stats.increment('calls')
+        try:
+            response = self.__do_across_workers(key=key, fn=fn, lookup=lookup)
+            call.response = clone_response(response)
+            call.log_fields = Logger().upstream_call_fields()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+        return response
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[requests.Response]],
+                  lookup: Optional[AsyncLookup]) -> requests.Response:
+        """
+        The shared call runs in its own task, so a cancelled leader request does not fail its waiters.
+        The task's response is never changed, the leader and every waiter get their own copy of it.
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (loop, key)
+        task = self.__tasks.get(task_key)
+        is_leader = task is None
+        if is_leader:
+            self.stats.increment('calls')
+            task = self.__tasks[task_key] = loop.create_task(self.__ashared_call(key=key, fn=fn, lookup=lookup))
+            task.add_done_callback(lambda _: self.__tasks.pop(task_key, None))
+        else:
+            self.stats.increment('collapsed')
+
+        response, log_fields = await asyncio.shield(task)
+        if not is_leader:
+            Logger().log_shared_upstream_call(log_fields)
+        return clone_response(response)
+
+    async def __ashared_call(self, key: str, fn: Callable[[], Awaitable[requests.Response]],
+                             lookup: Optional[AsyncLookup]) -> tuple[requests.Response, dict]:
+        """Runs in a copy of the leader's context, so it sees the leader's log record"""
+        response = await self.__ado_across_workers(key=key, fn=fn, lookup=lookup)
+        return response, Logger().upstream_call_fields()
+
+    def __do_across_workers(self, key: str, fn: Callable[[], requests.Response],
+                            lookup: Optional[Lookup]) -> requests.Response:
+        if not settings.PROXY_SINGLE_FLIGHT_DISTRIBUTED or lookup is None:
+            return fn()
+
+        lock = get_redis().lock(self.__lock_name(key), timeout=settings.PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT)
+        try:
+            acquired = lock.acquire(blocking=False)
+        except RedisError:
+            return fn()
+
+        if acquired:
+            try:
+                return fn()
+            finally:
+                self.__release(lock)
+
+        deadline = time.monotonic() + settings.PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(settings.PROXY_SINGLE_FLIGHT_POLL_INTERVAL)
+            is_released = not self.__is_locked(lock)
+            response = lookup()
+            if response is not None:
+                self.stats.increment('remote_collapsed')
+                return response
+            if is_released:
+                break
+        return fn()
+
+    async def __ado_across_workers(self, key: str, fn: Callable[[], Awaitable[requests.Response]],
+                                   lookup: Optional[AsyncLookup]) -> requests.Response:
+        if not settings.PROXY_SINGLE_FLIGHT_DISTRIBUTED or lookup is None:
+            return await fn()
+
+        lock = get_async_redis().lock(self.__lock_name(key), timeout=settings.PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT)
+        try:
+            acquired = await lock.acquire(blocking=False)
+        except RedisError:
+            return await fn()
+
+        if acquired:
+            try:
+                return await fn()
+            finally:
+                await self.__arelease(lock)
+
+        deadline = time.monotonic() + settings.PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.PROXY_SINGLE_FLIGHT_POLL_INTERVAL)
+            is_released = not await self.__ais_locked(lock)
+            response = await lookup()
+            if response is not None:
+                self.stats.increment('remote_collapsed')
+                return response
+            if is_released:
+                break
+        return await fn()
+
+    def __lock_name(self, key: str) -> str:
+        return f'{self.__LOCK_PREFIX}:{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}'
+
+    @staticmethod
+    def __is_locked(lock: Lock) -> bool:
+        try:
+            return lock.locked()
+        except RedisError:
+            return False
+
+    @staticmethod
+    async def __ais_locked(lock: AsyncLock) -> bool:
+        try:
+            return await lock.locked()
+        except RedisError:
+            return False
+
+    @staticmethod
+    def __release(lock: Lock) -> None:
+        """The lock may have expired during a slow upstream call, another worker owns it then"""
+        try:
+            lock.release()
+        except RedisError:
+            pass
+
+    @staticmethod
+    async def __arelease(lock: AsyncLock) -> None:
+        try:
+            await lock.release()
+        except RedisError:
+            pass
+
+
+single_flight = SingleFlight()
+
+Metrics.register_collector(prefix='proxy_single_flight', snapshot=SingleFlight.stats.snapshot)
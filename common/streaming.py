@@ -0,0 +1,109 @@
+from typing import Any, AsyncIterator, Iterator, Mapping, Optional, Union
+
+import httpx
+import requests
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from logger.services.Logger import Logger
+from logger.services.log_record import LogRecord
+
+_STREAMING_CONTENT_TYPES = ('text/event-stream',)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept event stream clients, only errors and buffered bodies are rendered here"""
+
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data: Any, accepted_media_type: Optional[str] = None,
+               renderer_context: Optional[dict] = None) -> bytes:
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return JSONRenderer().render(data)
+
+
+def is_streaming_response(headers: Mapping[str, str]) -> bool:
+    """Event streams and chunked bodies of unknown length are relayed, bodies of a known length are buffered"""
+    content_type = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    if content_type in _STREAMING_CONTENT_TYPES:
+        return True
+    return 'chunked' in headers.get('Transfer-Encoding', '').lower() and 'Content-Length' not in headers
+
+
+class _Capture:
+    """Keeps the first bytes of a relayed body for the log and counts the rest"""
+
+    def __init__(self) -> None:
+        self.prefix = bytearray()
+        self.size = 0
+
+    def feed(self, chunk: bytes) -> bytes:
+        missing = settings.LOGGER_STREAM_PREFIX_SIZE - len(self.prefix)
+        if missing > 0:
+            self.prefix += chunk[:missing]
+        self.size += len(chunk)
+        return chunk
+
+
+def stream_response(response: requests.Response, headers: Mapping[str, str],
+                    record: Optional[LogRecord]) -> StreamingHttpResponse:
+    """Relays a response sent with stream=True, the log is saved once the client has got the whole body"""
+
+    def relay() -> Iterator[bytes]:
+        capture = _Capture()
+        try:
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk:
+                    yield capture.feed(chunk)
+        finally:
+            response.close()
+            if record is not None:
+                Logger.log_streamed_response(
+                    record=record,
+                    prepared_request=response.request,
+                    status_code=response.status_code,
+                    headers=dict(headers),
+                    prefix=bytes(capture.prefix),
+                    size=capture.size,
+                )
+                Logger.save_record(record)
+
+    return _build_streaming_response(content=relay(), status_code=response.status_code, headers=headers)
+
+
+def astream_response(response: httpx.Response, prepared_request: requests.PreparedRequest,
+                     headers: Mapping[str, str], record: Optional[LogRecord]) -> StreamingHttpResponse:
+    """Async counterpart of stream_response for a response opened by AsyncUpstreamClient.open_stream"""
+
+    async def relay() -> AsyncIterator[bytes]:
+        capture = _Capture()
+        try:
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    yield capture.feed(chunk)
+        finally:
+            await response.aclose()
+            if record is not None:
+                Logger.log_streamed_response(
+                    record=record,
+                    prepared_request=prepared_request,
+                    status_code=response.status_code,
+                    headers=dict(headers),
+                    prefix=bytes(capture.prefix),
+                    size=capture.size,
+                )
+                await Logger().asave_record(record)
+
+    return _build_streaming_response(content=relay(), status_code=response.status_code, headers=headers)
+
+
+def _build_streaming_response(content: Union[Iterator[bytes], AsyncIterator[bytes]], status_code: int,
+                              headers: Mapping[str, str]) -> StreamingHttpResponse:
+    streaming_response = StreamingHttpResponse(streaming_content=content, status=status_code, headers=headers)
+    # nginx would otherwise buffer the relayed chunks again
+    streaming_response['X-Accel-Buffering'] = 'no'
+    return streaming_response
@@ -0,0 +1,677 @@
+import asyncio
+import gzip
+import io
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Optional
+from unittest import mock
+
+import fakeredis
+import httpx
+import requests
+from django.core.cache import cache
+from django.http import HttpRequest
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from requests.structures import CaseInsensitiveDict
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from common.cache import ResponseCache
+from common.compression import accepted_encodings, attach_encoded, encode_for_client
+from common.concurrency import ConcurrencyLimiter
+from common.rate_limit import RateLimiter
+from common.exceptions import UpstreamError, UpstreamTimeout, UpstreamUnavailable
+from common.responses import build_response
+from common.route import Route
+from common.single_flight import SingleFlight
+from common.upstream_guard import CircuitBreaker, UpstreamGuard
+
+_groups = itertools.count()
+
+_FAKE_REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://fake-redis',
+        'OPTIONS': {'connection_class': fakeredis.FakeConnection},
+    },
+}
+
+
+def _response(status_code: int) -> requests.Response:
+    """A response as the client returns it, with a raw body the guard closes before retrying"""
+    response = build_response(status_code=status_code, headers={}, content=b'{}', request=None)
+    response.raw = io.BytesIO(b'{}')
+    return response
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+
+    def test_opens_after_consecutive_failures(self) -> None:
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(UpstreamUnavailable):
+            self.breaker.before_call()
+
+    def test_success_resets_the_failure_count(self) -> None:
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.breaker.record_success()
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_probe_after_reset_timeout_closes_on_success(self) -> None:
+        self.__open()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_failed_probe_opens_again(self) -> None:
+        self.__open()
+        time.sleep(0.06)
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(UpstreamUnavailable):
+            self.breaker.before_call()
+
+    def __open(self) -> None:
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+@override_settings(
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD=2,
+    UPSTREAM_BREAKER_RESET_TIMEOUT=30.0,
+    UPSTREAM_MAX_RETRIES=2,
+    UPSTREAM_RETRY_BUDGET_RATIO=0.0,
+    UPSTREAM_RETRY_MIN_PER_SECOND=10.0,
+    UPSTREAM_RETRY_BACKOFF=0.0,
+    UPSTREAM_TIMEOUTS={},
+)
+class UpstreamGuardTests(SimpleTestCase):
+    """Every test calls an endpoint group of its own, breakers and retry budgets are kept per group"""
+
+    def setUp(self) -> None:
+        self.endpoint = f'guard-test-{next(_groups)}/1'
+        self.breaker = CircuitBreaker.for_group(self.endpoint.split('/', 1)[0])
+
+    def test_retries_idempotent_calls_until_success(self) -> None:
+        responses = iter([_response(503), _response(200)])
+        response = UpstreamGuard(endpoint=self.endpoint, method='GET').call(lambda: next(responses))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_does_not_retry_other_methods(self) -> None:
+        calls = []
+
+        def fn() -> requests.Response:
+            calls.append(1)
+            return _response(503)
+
+        response = UpstreamGuard(endpoint=self.endpoint, method='POST').call(fn)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(calls), 1)
+
+    def test_opens_the_breaker_and_rejects_without_calling(self) -> None:
+        def fn() -> requests.Response:
+            raise requests.ConnectionError()
+
+        with self.assertRaises(UpstreamError):
+            UpstreamGuard(endpoint=self.endpoint, method='GET').call(fn)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        calls = []
+        with self.assertRaises(UpstreamUnavailable):
+            UpstreamGuard(endpoint=self.endpoint, method='GET').call(lambda: calls.append(1) or _response(200))
+        self.assertEqual(calls, [])
+
+    def test_retries_non_safe_idempotent_calls_only_after_connect_failures(self) -> None:
+        refused = requests.ConnectionError(MaxRetryError(None, '/', reason=NewConnectionError(None, 'refused')))
+        self.assertEqual(self.__calls('PUT', [refused, _response(200)]), 2)
+        self.assertEqual(self.__calls('DELETE', [requests.ConnectTimeout(), _response(200)]), 2)
+
+        with self.assertRaises(UpstreamTimeout):
+            self.__calls('PUT', [requests.ReadTimeout(), _response(200)])
+        with self.assertRaises(UpstreamError):
+            self.__calls('DELETE', [requests.ConnectionError('Connection aborted.'), _response(200)])
+        self.assertEqual(self.__calls('PUT', [_response(503), _response(200)]), 1)
+        self.assertEqual(self.__calls('GET', [requests.ReadTimeout(), _response(200)]), 2)
+
+    def test_async_retries_non_safe_idempotent_calls_only_after_connect_failures(self) -> None:
+        self.assertEqual(self.__acalls('PUT', [httpx.ConnectError('refused'), _response(200)]), 2)
+        self.assertEqual(self.__acalls('DELETE', [httpx.ConnectTimeout('timed out'), _response(200)]), 2)
+
+        with self.assertRaises(UpstreamTimeout):
+            self.__acalls('PUT', [httpx.ReadTimeout('timed out'), _response(200)])
+        with self.assertRaises(UpstreamTimeout):
+            self.__acalls('PUT', [httpx.WriteTimeout('timed out'), _response(200)])
+        with self.assertRaises(UpstreamError):
+            self.__acalls('DELETE', [httpx.RemoteProtocolError('disconnected'), _response(200)])
+        self.assertEqual(self.__acalls('GET', [httpx.ReadTimeout('timed out'), _response(200)]), 2)
+
+    def test_client_errors_are_not_failures(self) -> None:
+        for _ in range(3):
+            response = UpstreamGuard(endpoint=self.endpoint, method='POST').call(lambda: _response(404))
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def __calls(self, method: str, outcomes: list) -> int:
+        """Calls a fresh endpoint group that fails or responds as outcomes says, returns the number of calls"""
+        outcomes, calls = iter(outcomes), []
+
+        def fn() -> requests.Response:
+            calls.append(1)
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        endpoint = f'guard-test-{next(_groups)}/1'
+        with override_settings(UPSTREAM_RETRY_BACKOFF=0):
+            UpstreamGuard(endpoint=endpoint, method=method).call(fn)
+        return len(calls)
+
+    def __acalls(self, method: str, outcomes: list) -> int:
+        outcomes, calls = iter(outcomes), []
+
+        async def fn() -> requests.Response:
+            calls.append(1)
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        endpoint = f'guard-test-{next(_groups)}/1'
+        with override_settings(UPSTREAM_RETRY_BACKOFF=0):
+            asyncio.run(UpstreamGuard(endpoint=endpoint, method=method).acall(fn))
+        return len(calls)
+
+
+@override_settings(
+    PROXY_CONCURRENCY_LIMIT_ENABLED=True,
+    PROXY_CONCURRENCY_INITIAL_LIMIT=10,
+    PROXY_CONCURRENCY_MIN_LIMIT=4,
+    PROXY_CONCURRENCY_BACKOFF_RATIO=0.5,
+    PROXY_CONCURRENCY_PRIORITIES={'users/login': 'high', 'GET dialogues': 'low'},
+    PROXY_CONCURRENCY_PRIORITY_SHARES={'high': 1.0, 'normal': 0.8, 'low': 0.5},
+)
+class ConcurrencyLimiterTests(SimpleTestCase):
+    """With a limit of 10, low priority calls may use 5 slots, normal ones 8 and high ones all 10"""
+
+    def setUp(self) -> None:
+        self.limiter = ConcurrencyLimiter()
+        self.slots = ExitStack()
+        self.addCleanup(self.slots.close)
+
+    def test_priorities(self) -> None:
+        self.assertEqual(self.limiter.priority(endpoint='users/login', method='POST'), 'high')
+        self.assertEqual(self.limiter.priority(endpoint='dialogues', method='GET'), 'low')
+        self.assertEqual(self.limiter.priority(endpoint='dialogues', method='POST'), 'normal')
+
+    def test_low_priority_is_shed_first(self) -> None:
+        self.__hold(5, endpoint='dialogues', method='GET')
+        with self.assertRaises(UpstreamUnavailable):
+            self.__hold(1, endpoint='dialogues', method='GET')
+        self.__hold(3, endpoint='dialogues', method='POST')
+        with self.assertRaises(UpstreamUnavailable):
+            self.__hold(1, endpoint='dialogues', method='POST')
+        self.__hold(2, endpoint='users/login', method='POST')
+        with self.assertRaises(UpstreamUnavailable):
+            self.__hold(1, endpoint='users/login', method='POST')
+
+        snapshot = self.limiter.snapshot()
+        self.assertEqual(snapshot['in_flight'], 10)
+        self.assertEqual((snapshot['shed_low'], snapshot['shed_normal'], snapshot['shed_high']), (1, 1, 1))
+
+    def test_released_slots_admit_again(self) -> None:
+        with self.limiter.acquire(endpoint='dialogues', method='GET'):
+            self.__hold(4, endpoint='dialogues', method='GET')
+        self.__hold(1, endpoint='dialogues', method='GET')
+        self.assertEqual(self.limiter.snapshot()['in_flight'], 5)
+
+    def test_failures_shrink_the_share_of_every_priority(self) -> None:
+        with self.assertRaises(UpstreamError), self.limiter.acquire(endpoint='dialogues', method='POST'):
+            raise UpstreamError()
+        self.assertEqual(self.limiter.snapshot()['limit'], 5)
+
+        self.__hold(2, endpoint='dialogues', method='GET')
+        with self.assertRaises(UpstreamUnavailable):
+            self.__hold(1, endpoint='dialogues', method='GET')
+        self.__hold(3, endpoint='users/login', method='POST')
+        with self.assertRaises(UpstreamUnavailable):
+            self.__hold(1, endpoint='users/login', method='POST')
+
+    def __hold(self, count: int, endpoint: str, method: str) -> None:
+        for _ in range(count):
+            self.slots.enter_context(self.limiter.acquire(endpoint=endpoint, method=method))
+
+
+@override_settings(
+    PROXY_COMPRESSION_ENABLED=True,
+    PROXY_COMPRESSION_MIN_SIZE=100,
+    PROXY_COMPRESSION_ENCODINGS=('gzip',),
+    PROXY_COMPRESSION_GZIP_LEVEL=6,
+)
+class EncodeForClientTests(SimpleTestCase):
+
+    CONTENT = b'{"result": [' + b', '.join(b'{"id": %d, "name": "gpt-4"}' % number for number in range(20)) + b']}'
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+
+    def test_accepted_encodings(self) -> None:
+        self.assertEqual(accepted_encodings('gzip, br;q=0.5, *;q=0'), {'gzip': 1.0, 'br': 0.5, '*': 0.0})
+        self.assertEqual(accepted_encodings('gzip;q=x'), {'gzip': 0.0})
+        self.assertEqual(accepted_encodings(None), {})
+
+    def test_compresses_for_a_client_accepting_gzip(self) -> None:
+        content, headers = self.__encode(accept_encoding='br;q=1, gzip;q=0.8', etag='"abc"')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(content), self.CONTENT)
+        self.assertEqual(headers['ETag'], 'W/"abc"')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+    def test_plain_body_for_refused_or_missing_encodings(self) -> None:
+        for accept_encoding in ('', 'identity', 'gzip;q=0', 'br', '*;q=0'):
+            with self.subTest(accept_encoding=accept_encoding):
+                content, headers = self.__encode(accept_encoding=accept_encoding, etag='"abc"')
+                self.assertEqual(content, self.CONTENT)
+                self.assertNotIn('Content-Encoding', headers)
+                self.assertEqual(headers['ETag'], '"abc"')
+                self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+    def test_wildcard_accepts_gzip(self) -> None:
+        _, headers = self.__encode(accept_encoding='*')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+
+    def test_relays_the_bytes_yadro_compressed(self) -> None:
+        response = self.__response()
+        attach_encoded(response, encoding='deflate', data=b'deflated')
+        content, headers = encode_for_client(request=self.__request('deflate, gzip'), response=response)
+        self.assertEqual(content, b'deflated')
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+
+        content, headers = encode_for_client(request=self.__request('gzip'), response=response)
+        self.assertEqual(gzip.decompress(content), self.CONTENT)
+
+    def test_small_or_other_bodies_are_not_compressed(self) -> None:
+        small = build_response(status_code=200, headers={'Content-Type': 'application/json'}, content=b'{}',
+                               request=None)
+        text = build_response(status_code=200, headers={'Content-Type': 'text/plain'}, content=self.CONTENT,
+                              request=None)
+        for response in (small, text):
+            content, headers = encode_for_client(request=self.__request('gzip'), response=response)
+            self.assertEqual(content, response.content)
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertNotIn('Vary', headers)
+
+    def test_keeps_the_vary_of_yadro(self) -> None:
+        _, headers = self.__encode(accept_encoding='gzip', vary='Authorization')
+        self.assertEqual(headers['Vary'], 'Authorization, Accept-Encoding')
+        _, headers = self.__encode(accept_encoding='gzip', vary='accept-encoding')
+        self.assertEqual(headers['Vary'], 'accept-encoding')
+
+    def __encode(self, accept_encoding: str, **headers: str) -> tuple[bytes, CaseInsensitiveDict]:
+        return encode_for_client(request=self.__request(accept_encoding), response=self.__response(**headers))
+
+    def __request(self, accept_encoding: str) -> HttpRequest:
+        return self.factory.get('/api/v0/bots/', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def __response(self, etag: str = '', vary: str = '') -> requests.Response:
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if etag:
+            headers['ETag'] = etag
+        if vary:
+            headers['Vary'] = vary
+        return build_response(status_code=200, headers=headers, content=self.CONTENT, request=None)
+
+
+@override_settings(CACHES=_FAKE_REDIS_CACHES)
+class _RedisTestCase(SimpleTestCase):
+    """Runs against an in-process Redis, emptied before every test"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def _request(self, path: str, method: str = 'get', token: str = 'token', **headers: str) -> Request:
+        if token:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        return Request(getattr(self.factory, method)(path, **headers))
+
+
+@override_settings(
+    PROXY_CACHE_ENABLED=True,
+    PROXY_CACHE_TTLS={'dialogues': 60, 'dialogues/<id>': 60, 'users/email-verification/check': 5},
+    PROXY_CACHE_INVALIDATES={'users/logout': ('users/email-verification/check',)},
+)
+class ResponseCacheTests(_RedisTestCase):
+
+    def test_stores_and_serves_a_response(self) -> None:
+        hits, misses, stores = self.__counts('hits', 'misses', 'stores')
+        self.assertIsNone(self.__store('/api/v0/dialogues/7/', endpoint='dialogues/7'))
+        cached = self.__get(self._request('/api/v0/dialogues/7/'), endpoint='dialogues/7')
+
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, b'{"id": 7}')
+        self.assertTrue(cached.from_cache)
+        self.assertEqual(self.__counts('hits', 'misses', 'stores'), (hits + 1, misses + 1, stores + 1))
+
+    def test_entries_are_scoped_by_authorization_and_query(self) -> None:
+        self.__store('/api/v0/dialogues/?page=1', endpoint='dialogues')
+        self.assertIsNotNone(self.__get(self._request('/api/v0/dialogues/?page=1'), endpoint='dialogues'))
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/?page=1', token='other'), endpoint='dialogues'))
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/?page=1', token=''), endpoint='dialogues'))
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/?page=2'), endpoint='dialogues'))
+
+    def test_entries_are_scoped_by_vary(self) -> None:
+        self.__store('/api/v0/dialogues/', endpoint='dialogues', headers={'Vary': 'Accept-Language'},
+                     HTTP_ACCEPT_LANGUAGE='ru')
+        same = self._request('/api/v0/dialogues/', HTTP_ACCEPT_LANGUAGE='ru')
+        other = self._request('/api/v0/dialogues/', HTTP_ACCEPT_LANGUAGE='en')
+        self.assertIsNotNone(self.__get(same, endpoint='dialogues'))
+        self.assertIsNone(self.__get(other, endpoint='dialogues'))
+
+    def test_no_cache_and_max_age_0_bypass_the_entry(self) -> None:
+        self.__store('/api/v0/dialogues/', endpoint='dialogues')
+        for cache_control in ('no-cache', 'max-age=0'):
+            with self.subTest(cache_control=cache_control):
+                request = self._request('/api/v0/dialogues/', HTTP_CACHE_CONTROL=cache_control)
+                self.assertIsNone(self.__get(request, endpoint='dialogues'))
+        self.assertIsNotNone(self.__get(self._request('/api/v0/dialogues/'), endpoint='dialogues'))
+
+    def test_no_store_is_not_cached(self) -> None:
+        self.__store('/api/v0/dialogues/', endpoint='dialogues', HTTP_CACHE_CONTROL='no-store')
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/'), endpoint='dialogues'))
+        self.__store('/api/v0/dialogues/', endpoint='dialogues', headers={'Cache-Control': 'no-store'})
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/'), endpoint='dialogues'))
+
+    def test_only_200_responses_are_stored(self) -> None:
+        for status_code in (201, 404, 500):
+            with self.subTest(status_code=status_code):
+                self.__store('/api/v0/dialogues/7/', endpoint='dialogues/7', status_code=status_code)
+                self.assertIsNone(self.__get(self._request('/api/v0/dialogues/7/'), endpoint='dialogues/7'))
+
+    def test_endpoints_without_a_ttl_are_not_cached(self) -> None:
+        self.__store('/api/v0/bots/', endpoint='bots')
+        self.assertIsNone(self.__get(self._request('/api/v0/bots/'), endpoint='bots'))
+
+    def test_mutations_invalidate_whatever_their_status(self) -> None:
+        for status_code in (200, 204, 400, 404, 500, 504):
+            with self.subTest(status_code=status_code):
+                self.__store('/api/v0/dialogues/7/', endpoint='dialogues/7')
+                self.__store('/api/v0/dialogues/', endpoint='dialogues')
+                self.__invalidate('/api/v0/dialogues/7/', endpoint='dialogues/7', method='put',
+                                  status_code=status_code)
+                self.assertIsNone(self.__get(self._request('/api/v0/dialogues/7/'), endpoint='dialogues/7'))
+                self.assertIsNone(self.__get(self._request('/api/v0/dialogues/'), endpoint='dialogues'))
+
+    def test_mutations_invalidate_only_the_client_entries(self) -> None:
+        self.__store('/api/v0/dialogues/7/', endpoint='dialogues/7')
+        self.__invalidate('/api/v0/dialogues/7/', endpoint='dialogues/7', method='delete', token='other')
+        self.assertIsNotNone(self.__get(self._request('/api/v0/dialogues/7/'), endpoint='dialogues/7'))
+
+    def test_logout_drops_the_verification_status_once_accepted(self) -> None:
+        check = '/api/v0/users/email-verification/check/'
+        self.__store(check, endpoint='users/email-verification/check')
+        for status_code in (401, 500):
+            with self.subTest(status_code=status_code):
+                self.__invalidate('/api/v0/users/logout/', endpoint='users/logout', method='post',
+                                  status_code=status_code)
+                self.assertIsNotNone(self.__get(self._request(check), endpoint='users/email-verification/check'))
+
+        self.__invalidate('/api/v0/users/logout/', endpoint='users/logout', method='post', status_code=200)
+        self.assertIsNone(self.__get(self._request(check), endpoint='users/email-verification/check'))
+
+    def test_failed_calls_invalidate_mutations_only(self) -> None:
+        check = '/api/v0/users/email-verification/check/'
+        self.__store(check, endpoint='users/email-verification/check')
+        self.__store('/api/v0/dialogues/7/', endpoint='dialogues/7')
+        self.__invalidate('/api/v0/users/logout/', endpoint='users/logout', method='post', status_code=None)
+        self.__invalidate('/api/v0/dialogues/7/', endpoint='dialogues/7', method='put', status_code=None)
+        self.assertIsNotNone(self.__get(self._request(check), endpoint='users/email-verification/check'))
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/7/'), endpoint='dialogues/7'))
+
+    @override_settings(
+        THIRD_PARTY_APP_URL='http://yadro.test', APP_ID='app', PROXY_RATE_LIMIT_ENABLED=False,
+        PROXY_CONCURRENCY_LIMIT_ENABLED=False, PROXY_SINGLE_FLIGHT_ENABLED=False,
+    )
+    def test_route_invalidates_a_mutation_that_timed_out(self) -> None:
+        self.__store('/api/v0/dialogues/7/', endpoint='dialogues/7', namespace='Route')
+        request = self._request('/api/v0/dialogues/7/', method='put')
+        with mock.patch('common.route.UpstreamGuard.call', side_effect=UpstreamTimeout()):
+            with self.assertRaises(UpstreamTimeout):
+                Route(request=request).send(endpoint='dialogues/7')
+        self.assertIsNone(self.__get(self._request('/api/v0/dialogues/7/'), endpoint='dialogues/7', namespace='Route'))
+
+    def __invalidate(self, path: str, endpoint: str, method: str, status_code: Optional[int] = 200,
+                     token: str = 'token') -> None:
+        """status_code None stands for a call that failed without a response"""
+        response = None
+        if status_code is not None:
+            response = build_response(status_code=status_code, headers={}, content=b'', request=None)
+        request = self._request(path, method=method, token=token)
+        ResponseCache(request=request, endpoint=endpoint, namespace='test').invalidate(response=response)
+
+    def __store(self, path: str, endpoint: str, status_code: int = 200, headers: Optional[dict] = None,
+                namespace: str = 'test', **request_headers: str) -> Optional[requests.Response]:
+        """Looks the response up and stores it as Route does after a miss, returns what the lookup found"""
+        response_cache = ResponseCache(request=self._request(path, **request_headers), endpoint=endpoint,
+                                       namespace=namespace)
+        cached = response_cache.get(prepared_request=None)
+        response = build_response(
+            status_code=status_code,
+            headers={'Content-Type': 'application/json', **(headers or {})},
+            content=b'{"id": 7}',
+            request=None,
+        )
+        response_cache.set(response=response)
+        return cached
+
+    @staticmethod
+    def __get(request: Request, endpoint: str, namespace: str = 'test') -> Optional[requests.Response]:
+        return ResponseCache(request=request, endpoint=endpoint, namespace=namespace).get(prepared_request=None)
+
+    @staticmethod
+    def __counts(*names: str) -> tuple:
+        snapshot = ResponseCache.stats.snapshot()
+        return tuple(snapshot[name] for name in names)
+
+
+@override_settings(
+    THIRD_PARTY_APP_URL='http://yadro.test',
+    APP_ID='app',
+    PROXY_SINGLE_FLIGHT_ENABLED=True,
+    PROXY_SINGLE_FLIGHT_DISTRIBUTED=False,
+    PROXY_CACHE_ENABLED=False,
+    PROXY_RATE_LIMIT_ENABLED=False,
+    PROXY_CONCURRENCY_LIMIT_ENABLED=False,
+)
+class SingleFlightTests(SimpleTestCase):
+    """Yadro is replaced by a slow echo of the Authorization header, so concurrent requests overlap"""
+
+    DELAY = 0.2
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+    def test_identical_gets_make_one_call(self) -> None:
+        responses = self.__send_concurrently(['token'] * 6)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({response.content for response in responses}, {b'{"authorization": "Bearer token"}'})
+        self.assertEqual(len({id(response) for response in responses}), 6)
+
+    def test_clients_never_share_a_response(self) -> None:
+        tokens = ['first', 'second'] * 3
+        responses = self.__send_concurrently(tokens)
+        self.assertEqual(sorted(self.calls), ['Bearer first', 'Bearer second'])
+        for token, response in zip(tokens, responses):
+            self.assertEqual(json.loads(response.content), {'authorization': f'Bearer {token}'})
+
+    def test_identical_async_gets_make_one_call(self) -> None:
+        async def send_all() -> list:
+            with mock.patch.object(Route, '_asend_request', side_effect=self.__aupstream):
+                return await asyncio.gather(*(
+                    Route(request=self.__request(token)).asend(endpoint='dialogues') for token in ('a', 'a', 'a', 'b')
+                ))
+
+        responses = asyncio.run(send_all())
+        self.assertEqual(sorted(self.calls), ['Bearer a', 'Bearer b'])
+        self.assertEqual([json.loads(response.content)['authorization'] for response in responses],
+                         ['Bearer a', 'Bearer a', 'Bearer a', 'Bearer b'])
+
+    def test_leader_error_reaches_the_waiters(self) -> None:
+        flight = SingleFlight()
+
+        def fail() -> requests.Response:
+            self.__record_call('leader')
+            time.sleep(self.DELAY)
+            raise UpstreamTimeout()
+
+        def call() -> Optional[Exception]:
+            try:
+                flight.do(key='dialogues', fn=fail, lookup=None)
+            except UpstreamTimeout as exc:
+                return exc
+            return None
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            errors = list(executor.map(lambda _: call(), range(4)))
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(isinstance(error, UpstreamTimeout) for error in errors))
+
+    def __send_concurrently(self, tokens: list[str]) -> list[requests.Response]:
+        with mock.patch.object(Route, '_send_request', side_effect=self.__upstream):
+            with ThreadPoolExecutor(max_workers=len(tokens)) as executor:
+                return list(executor.map(
+                    lambda token: Route(request=self.__request(token)).send(endpoint='dialogues'), tokens,
+                ))
+
+    def __request(self, token: str) -> Request:
+        return Request(self.factory.get('/api/v0/dialogues/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+
+    def __upstream(self, endpoint: str, prepared_request: requests.PreparedRequest,
+                   stream: bool = False) -> requests.Response:
+        time.sleep(self.DELAY)
+        return self.__echo(prepared_request)
+
+    async def __aupstream(self, endpoint: str, prepared_request: requests.PreparedRequest,
+                          stream: bool = False) -> requests.Response:
+        await asyncio.sleep(self.DELAY)
+        return self.__echo(prepared_request)
+
+    def __echo(self, prepared_request: requests.PreparedRequest) -> requests.Response:
+        authorization = prepared_request.headers['Authorization']
+        self.__record_call(authorization)
+        return build_response(
+            status_code=200,
+            headers={'Content-Type': 'application/json'},
+            content=json.dumps({'authorization': authorization}).encode('utf-8'),
+            request=prepared_request,
+        )
+
+    def __record_call(self, name: str) -> None:
+        with self.calls_lock:
+            self.calls.append(name)
+
+
+@override_settings(
+    PROXY_RATE_LIMIT_ENABLED=True,
+    PROXY_RATE_LIMITS={'bots': '2/min'},
+    PROXY_UPSTREAM_RATE_LIMIT='',
+    PROXY_UPSTREAM_QUEUE_TIMEOUT=90,
+    PROXY_TRUSTED_PROXY_COUNT=0,
+)
+class RateLimiterTests(_RedisTestCase):
+    """Rates are per minute, so the waits the GCRA script returns are far apart from the time the tests take"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        server = fakeredis.FakeServer()
+        for name, client in (('get_redis', fakeredis.FakeRedis(server=server)),
+                             ('get_async_redis', fakeredis.FakeAsyncRedis(server=server))):
+            patcher = mock.patch(f'common.rate_limit.{name}', return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sleeps = []
+        patcher = mock.patch('common.rate_limit.time.sleep', side_effect=self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_over_its_rate_gets_429_with_the_wait(self) -> None:
+        for _ in range(2):
+            self.__check(self._request('/api/v0/bots/'), endpoint='bots')
+        with self.assertRaises(Throttled) as raised:
+            self.__check(self._request('/api/v0/bots/'), endpoint='bots')
+        self.assertEqual(raised.exception.wait, 30)
+
+        self.__check(self._request('/api/v0/bots/', token='other'), endpoint='bots')
+        self.__check(self._request('/api/v0/dialogues/'), endpoint='dialogues')
+        self.assertEqual(self.sleeps, [])
+
+    def test_async_client_over_its_rate_gets_429(self) -> None:
+        async def check(times: int) -> None:
+            for _ in range(times):
+                await RateLimiter(request=self._request('/api/v0/bots/1/'), endpoint='bots/1').acheck()
+
+        with self.assertRaises(Throttled) as raised:
+            asyncio.run(check(times=3))
+        self.assertEqual(raised.exception.wait, 30)
+
+    def test_anonymous_clients_share_an_address_without_trusted_proxies(self) -> None:
+        for address in ('10.0.0.1', '10.0.0.2'):
+            self.__check(self.__anonymous(address), endpoint='bots')
+        with self.assertRaises(Throttled):
+            self.__check(self.__anonymous('10.0.0.3'), endpoint='bots')
+
+    @override_settings(PROXY_TRUSTED_PROXY_COUNT=1)
+    def test_anonymous_clients_are_told_apart_by_the_trusted_forwarded_address(self) -> None:
+        for address in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            for _ in range(2):
+                self.__check(self.__anonymous(address), endpoint='bots')
+        with self.assertRaises(Throttled):
+            self.__check(self.__anonymous('10.0.0.1'), endpoint='bots')
+        # a client forging the header only adds entries left of the one the trusted proxy appended
+        with self.assertRaises(Throttled):
+            self.__check(self.__anonymous('192.168.0.1, 10.0.0.1'), endpoint='bots')
+
+    @override_settings(PROXY_RATE_LIMITS={}, PROXY_UPSTREAM_RATE_LIMIT='1/min')
+    def test_upstream_limit_queues_calls_then_rejects_them(self) -> None:
+        queued, rejected = RateLimiter.stats.snapshot()['queued'], RateLimiter.stats.snapshot()['rejected']
+        self.__check(self._request('/api/v0/bots/'), endpoint='bots')
+        self.__check(self._request('/api/v0/dialogues/', token='other'), endpoint='dialogues')
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertAlmostEqual(self.sleeps[0], 60, delta=1)
+
+        for _ in range(2):
+            with self.assertRaises(UpstreamUnavailable) as raised:
+                self.__check(self._request('/api/v0/bots/'), endpoint='bots')
+            self.assertEqual(raised.exception.wait, 30)
+        self.assertEqual(RateLimiter.stats.snapshot()['queued'], queued + 1)
+        self.assertEqual(RateLimiter.stats.snapshot()['rejected'], rejected + 2)
+
+    def __anonymous(self, forwarded_for: str) -> Request:
+        return self._request('/api/v0/bots/', token='', REMOTE_ADDR='172.17.0.1', HTTP_X_FORWARDED_FOR=forwarded_for)
+
+    @staticmethod
+    def __check(request: Request, endpoint: str) -> None:
+        RateLimiter(request=request, endpoint=endpoint).check()
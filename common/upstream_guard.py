@@ -0,0 +1,270 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+import requests
+from django.conf import settings
+from urllib3.exceptions import EmptyPoolError, NewConnectionError
+
+from common.counters import Counters
+from common.endpoints import endpoint_group, endpoint_pattern
+from common.exceptions import UpstreamError, UpstreamTimeout, UpstreamUnavailable
+from common.metrics import Metrics
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS',)
+IDEMPOTENT_METHODS = (*SAFE_METHODS, 'PUT', 'DELETE',)
+FAILURE_STATUS_CODES = (502, 503, 504,)
+
+Timeout = tuple[float, float]
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint group of Yadro after UPSTREAM_BREAKER_FAILURE_THRESHOLD consecutive failures.
+    Calls fail fast for UPSTREAM_BREAKER_RESET_TIMEOUT seconds, then a single probe call decides whether
+    the breaker closes again or stays open for another period.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    stats = Counters('opened', 'rejected')
+
+    __breakers: dict[str, 'CircuitBreaker'] = {}
+    __breakers_lock = threading.Lock()
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__lock = threading.Lock()
+        self.__state = self.CLOSED
+        self.__failures = 0
+        self.__changed_at = 0.0
+
+    @classmethod
+    def for_group(cls, group: str) -> 'CircuitBreaker':
+        breaker = cls.__breakers.get(group)
+        if breaker is None:
+            with cls.__breakers_lock:
+                breaker = cls.__breakers.get(group)
+                if breaker is None:
+                    breaker = cls.__breakers[group] = cls(
+                        failure_threshold=settings.UPSTREAM_BREAKER_FAILURE_THRESHOLD,
+                        reset_timeout=settings.UPSTREAM_BREAKER_RESET_TIMEOUT,
+                    )
+                    # summed over the workers, the gauge is the number of workers not calling the group
+                    Metrics.register_collector(
+                        prefix='proxy_circuit_breaker',
+                        snapshot=lambda: {f'open_{group}': int(breaker.state != cls.CLOSED)},
+                        gauges=(f'open_{group}',),
+                    )
+        return breaker
+
+    @property
+    def state(self) -> str:
+        return self.__state
+
+    def before_call(self) -> None:
+        """Raises UpstreamUnavailable while open, a probe that never reported back is replaced after reset_timeout"""
+        with self.__lock:
+            if self.__state == self.CLOSED:
+                return
+            waited = time.monotonic() - self.__changed_at
+            if waited >= self.__reset_timeout:
+                self.__state, self.__changed_at = self.HALF_OPEN, time.monotonic()
+                return
+        self.stats.increment('rejected')
+        raise UpstreamUnavailable(wait=self.__reset_timeout - waited)
+
+    def record_success(self) -> None:
+        with self.__lock:
+            self.__state, self.__failures = self.CLOSED, 0
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.__failures += 1
+            if self.__state == self.HALF_OPEN or (
+                    self.__state == self.CLOSED and self.__failures >= self.__failure_threshold):
+                self.__state, self.__changed_at = self.OPEN, time.monotonic()
+                self.stats.increment('opened')
+
+
+class RetryBudget:
+    """
+    Caps retries of an endpoint group at UPSTREAM_RETRY_BUDGET_RATIO of its requests of the last WINDOW seconds,
+    plus UPSTREAM_RETRY_MIN_PER_SECOND, so retries never multiply the load on a struggling Yadro.
+    """
+
+    WINDOW = 10
+
+    __budgets: dict[str, 'RetryBudget'] = {}
+    __budgets_lock = threading.Lock()
+
+    def __init__(self, ratio: float, min_per_second: float) -> None:
+        self.__ratio = ratio
+        self.__min_retries = min_per_second * self.WINDOW
+        self.__lock = threading.Lock()
+        # [second, requests, retries] of every second of the window
+        self.__buckets: deque[list[int]] = deque()
+
+    @classmethod
+    def for_group(cls, group: str) -> 'RetryBudget':
+        budget = cls.__budgets.get(group)
+        if budget is None:
+            with cls.__budgets_lock:
+                budget = cls.__budgets.get(group)
+                if budget is None:
+                    budget = cls.__budgets[group] = cls(
+                        ratio=settings.UPSTREAM_RETRY_BUDGET_RATIO,
+                        min_per_second=settings.UPSTREAM_RETRY_MIN_PER_SECOND,
+                    )
+        return budget
+
+    def record_request(self) -> None:
+        with self.__lock:
+            self.__current_bucket()[1] += 1
+
+    def try_withdraw(self) -> bool:
+        with self.__lock:
+            bucket = self.__current_bucket()
+            requests_count = sum(requests_count for _, requests_count, _ in self.__buckets)
+            retries = sum(retries for _, _, retries in self.__buckets)
+            if retries >= self.__ratio * requests_count + self.__min_retries:
+                return False
+            bucket[2] += 1
+            return True
+
+    def __current_bucket(self) -> list[int]:
+        second = int(time.monotonic())
+        while self.__buckets and self.__buckets[0][0] <= second - self.WINDOW:
+            self.__buckets.popleft()
+        if not self.__buckets or self.__buckets[-1][0] != second:
+            self.__buckets.append([second, 0, 0])
+        return self.__buckets[-1]
+
+
+class UpstreamGuard:
+    """
+    Timeouts, circuit breaker and retries of the calls of one request to Yadro.
+    Connection errors, timeouts and 502/503/504 responses count as failures of the endpoint group.
+    Only idempotent methods are retried, up to UPSTREAM_MAX_RETRIES times within the group's retry budget.
+    PUT and DELETE are only retried when the connection failed, Yadro may have applied them before a read timeout
+    or a failure status, and a retry would then apply them again after a change made in between.
+    """
+
+    stats = Counters('calls', 'failures', 'timeouts', 'retries', 'retries_denied', 'pool_exhausted')
+
+    def __init__(self, endpoint: str, method: str) -> None:
+        group = endpoint_group(endpoint)
+        self.timeout: Timeout = settings.UPSTREAM_TIMEOUTS.get(
+            endpoint_pattern(endpoint), (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT),
+        )
+        self.__breaker = CircuitBreaker.for_group(group)
+        self.__budget = RetryBudget.for_group(group)
+        self.__max_retries = settings.UPSTREAM_MAX_RETRIES if method in IDEMPOTENT_METHODS else 0
+        self.__is_safe = method in SAFE_METHODS
+
+    def call(self, fn: Callable[[], requests.Response]) -> requests.Response:
+        self.__budget.record_request()
+        attempt = 0
+        while True:
+            self.__breaker.before_call()
+            self.stats.increment('calls')
+            try:
+                response = fn()
+            except EmptyPoolError as exc:
+                raise self.__pool_exhausted() from exc
+            except requests.Timeout as exc:
+                if not self.__on_failure(attempt, is_timeout=True, is_sent=not _is_connect_failure(exc)):
+                    raise UpstreamTimeout() from exc
+            except requests.ConnectionError as exc:
+                if not self.__on_failure(attempt, is_sent=not _is_connect_failure(exc)):
+                    raise UpstreamError() from exc
+            else:
+                if response.status_code not in FAILURE_STATUS_CODES:
+                    self.__breaker.record_success()
+                    return response
+                if not self.__on_failure(attempt):
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(self.__backoff(attempt))
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """fn returns a requests.Response or a streamed httpx.Response"""
+        self.__budget.record_request()
+        attempt = 0
+        while True:
+            self.__breaker.before_call()
+            self.stats.increment('calls')
+            try:
+                response = await fn()
+            except httpx.PoolTimeout as exc:
+                raise self.__pool_exhausted() from exc
+            except httpx.TimeoutException as exc:
+                if not self.__on_failure(attempt, is_timeout=True, is_sent=not isinstance(exc, httpx.ConnectTimeout)):
+                    raise UpstreamTimeout() from exc
+            except httpx.TransportError as exc:
+                if not self.__on_failure(attempt, is_sent=not isinstance(exc, httpx.ConnectError)):
+                    raise UpstreamError() from exc
+            else:
+                if response.status_code not in FAILURE_STATUS_CODES:
+                    self.__breaker.record_success()
+                    return response
+                if not self.__on_failure(attempt):
+                    return response
+                if isinstance(response, httpx.Response):
+                    await response.aclose()
+            attempt += 1
+            await asyncio.sleep(self.__backoff(attempt))
+
+    def __on_failure(self, attempt: int, is_timeout: bool = False, is_sent: bool = True) -> bool:
+        """Records the failure, returns whether the call is retried. is_sent: Yadro may have got the request"""
+        self.__breaker.record_failure()
+        self.stats.increment('failures')
+        if is_timeout:
+            self.stats.increment('timeouts')
+        if attempt >= self.__max_retries or self.__breaker.state == CircuitBreaker.OPEN:
+            return False
+        if is_sent and not self.__is_safe:
+            return False
+        if not self.__budget.try_withdraw():
+            self.stats.increment('retries_denied')
+            return False
+        self.stats.increment('retries')
+        return True
+
+    def __pool_exhausted(self) -> UpstreamUnavailable:
+        """All connections of the worker are busy, Yadro itself did not fail, so this is not retried or recorded"""
+        self.stats.increment('pool_exhausted')
+        return UpstreamUnavailable(wait=settings.UPSTREAM_POOL_TIMEOUT)
+
+    @staticmethod
+    def __backoff(attempt: int) -> float:
+        """Exponential with full jitter, so retries of concurrent requests do not arrive together"""
+        return random.uniform(0, settings.UPSTREAM_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+def _is_connect_failure(exc: requests.RequestException) -> bool:
+    """requests raises a plain ConnectionError for a refused connection too, only its urllib3 reason tells"""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def httpx_timeout(timeout: Optional[Timeout]) -> Optional[httpx.Timeout]:
+    """Read timeout also bounds writing the body, the wait for a pooled connection is UPSTREAM_POOL_TIMEOUT"""
+    if timeout is None:
+        return None
+    connect, read = timeout
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=settings.UPSTREAM_POOL_TIMEOUT)
+
+
+Metrics.register_collector(prefix='proxy_upstream', snapshot=UpstreamGuard.stats.snapshot)
+Metrics.register_collector(prefix='proxy_circuit_breaker', snapshot=CircuitBreaker.stats.snapshot)
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from django.http import HttpRequest
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+class AsyncProxyView(View):
+    """
+    Base view for the async proxy path.
+    DRF APIView can not run async handlers, so the request is wrapped into a DRF Request here
+    and Route works with it the same way as in the sync views.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs: Any) -> Callable:
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def dispatch(self, request: HttpRequest, *args: Any, **kwargs: Any) -> Any:
+        parsers = [parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]
+        drf_request = Request(request, parsers=parsers)
+        response = super().dispatch(drf_request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            return self.__handle_exceptions(response, request=drf_request, args=args, kwargs=kwargs)
+        return response
+
+    async def __handle_exceptions(self, response: Awaitable, request: Request, args: tuple, kwargs: dict) -> Any:
+        """APIExceptions become the same standardized error responses the sync APIViews return"""
+        try:
+            return await response
+        except APIException as exc:
+            context = {'view': self, 'args': args, 'kwargs': kwargs, 'request': request}
+            error_response: Response = api_settings.EXCEPTION_HANDLER(exc, context)
+            error_response.accepted_renderer = JSONRenderer()
+            error_response.accepted_media_type = JSONRenderer.media_type
+            error_response.renderer_context = {}
+            return error_response
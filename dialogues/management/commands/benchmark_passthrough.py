@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import requests
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.http import HttpRequest
+from django.test import RequestFactory, override_settings
+
+from common.responses import build_response
+from proxy.decorators import handle_json_decode_error
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the CPU time and peak memory per MB of a dialogue history body, '
+        'passed through as upstream bytes against parsed and rendered again by DRF.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--size', type=float, default=1.0, help='MB of the dialogue history body')
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument(
+            '--accept-encoding',
+            default='',
+            help='Accept-Encoding of the client, passthrough then includes compressing the body',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options['size'] <= 0 or options['runs'] <= 0:
+            raise CommandError('--size and --runs must be greater than 0')
+        content = self.__dialogue(size=int(options['size'] * 1024 * 1024))
+        megabytes = len(content) / 1024 / 1024
+        request = RequestFactory().get('/api/v0/dialogues/1/', HTTP_ACCEPT_ENCODING=options['accept_encoding'])
+
+        # an async view, so the decorator renders the DRF response itself as it does for the async dialogue views
+        @handle_json_decode_error
+        async def view(request: HttpRequest) -> requests.Response:
+            return self.__response(content)
+
+        loop = asyncio.new_event_loop()
+
+        def respond() -> None:
+            response = loop.run_until_complete(view(request))
+            if hasattr(response, 'render'):
+                response.render()
+
+        try:
+            for name, passthrough in (('passthrough', True), ('parse and render', False)):
+                with override_settings(PROXY_PASSTHROUGH_RESPONSES=passthrough, PROXY_ETAGS_ENABLED=False):
+                    elapsed, peak = self.__measure(respond, runs=options['runs'])
+                self.__report(name, elapsed=elapsed, peak=peak, megabytes=megabytes, runs=options['runs'])
+        finally:
+            loop.close()
+
+    def __report(self, name: str, elapsed: float, peak: int, megabytes: float, runs: int) -> None:
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {elapsed / megabytes * 1000:.3f} ms and {peak / megabytes / 1024 / 1024:.2f} MB peak '
+            f'allocations per MB ({megabytes:.2f} MB body, {runs} runs)'
+        ))
+
+    @staticmethod
+    def __measure(fn: Callable[[], None], runs: int) -> tuple[float, int]:
+        """Returns the mean seconds per run, and the peak memory allocated by a run measured separately"""
+        fn()
+        started = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        elapsed = (time.perf_counter() - started) / runs
+
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return elapsed, peak
+
+    @staticmethod
+    def __response(content: bytes) -> requests.Response:
+        return build_response(
+            status_code=200,
+            headers={'Content-Type': 'application/json', 'Content-Length': str(len(content))},
+            content=content,
+            request=None,
+        )
+
+    @staticmethod
+    def __dialogue(size: int) -> bytes:
+        """A dialogue history of alternating user and assistant messages, about size bytes long"""
+        message = {'role': 'user', 'content': 'Tell me about the weather in Moscow today. ' * 8}
+        count = max(1, size // len(json.dumps(message)))
+        messages = [
+            {**message, 'id': number, 'role': 'user' if number % 2 else 'assistant'} for number in range(count)
+        ]
+        return json.dumps({'result': messages}).encode('utf-8')
@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.urls import path
 
-from dialogues.views import DialoguesView
+from dialogues.views import AsyncDialoguesView, DialoguesView
+
+view = AsyncDialoguesView if settings.PROXY_ASYNC_VIEWS else DialoguesView
 
 urlpatterns = [
-    path('', DialoguesView.as_view(), name='dialogue-list'),
-    path('<int:dialogue_id>/', DialoguesView.as_view(), name='dialogue-operations'),
+    path('', view.as_view(), name='dialogue-list'),
+    path('<int:dialogue_id>/', view.as_view(), name='dialogue-operations'),
 ]
@@ -1,17 +1,31 @@
 from typing import Any
 from urllib.request import Request
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from common.route import Route
+from common.streaming import EventStreamRenderer
+from common.views import AsyncProxyView
 from logger.services.Logger import Logger
 from proxy.decorators import handle_json_decode_error
 
 
+def _wants_stream(request: Request) -> bool:
+    """Generated answers come back from mutations, GETs are streamed only when the client asks for an event stream"""
+    if not settings.PROXY_STREAMING_ENABLED:
+        return False
+    return request.method != 'GET' or 'text/event-stream' in request.headers.get('Accept', '')
+
+
 class DialoguesView(APIView):
     """View for dialogues CRUD operations"""
 
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
+
     def get(self, request: Request, *args: Any, **kwargs: dict) -> Response:
         """
         offset -- A first parameter
@@ -36,7 +50,48 @@ class DialoguesView(APIView):
     def __handle_request(request: Request, **kwargs: dict) -> Response:
         dialogue_id = kwargs.get('dialogue_id')
         endpoint = f'dialogues/{dialogue_id}' if dialogue_id else 'dialogues'
-        response = Route(request=request).send(endpoint=endpoint)
+        route = Route(request=request)
+        if not _wants_stream(request=request):
+            response = route.send(endpoint=endpoint)
+        else:
+            response = route.send_streaming(endpoint=endpoint)
+            if isinstance(response, StreamingHttpResponse):
+                return response
         Logger().log_proxy_response_to_client(response=response)
         Logger().save_to_db()
         return response
+
+
+class AsyncDialoguesView(AsyncProxyView):
+    """Async view for dialogues CRUD operations"""
+
+    async def get(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__handle_request(request=request, **kwargs)
+
+    async def post(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__handle_request(request=request, **kwargs)
+
+    async def put(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__handle_request(request=request, **kwargs)
+
+    async def patch(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__handle_request(request=request, **kwargs)
+
+    async def delete(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__handle_request(request=request, **kwargs)
+
+    @staticmethod
+    @handle_json_decode_error
+    async def __handle_request(request: Request, **kwargs: dict) -> Response:
+        dialogue_id = kwargs.get('dialogue_id')
+        endpoint = f'dialogues/{dialogue_id}' if dialogue_id else 'dialogues'
+        route = Route(request=request)
+        if not _wants_stream(request=request):
+            response = await route.asend(endpoint=endpoint)
+        else:
+            response = await route.asend_streaming(endpoint=endpoint)
+            if isinstance(response, StreamingHttpResponse):
+                return response
+        Logger().log_proxy_response_to_client(response=response)
+        await Logger().asave_to_db()
+        return response
@@ -1,8 +1,183 @@
+from typing import Iterator, Optional
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import HttpRequest
+from django.urls import URLResolver, get_resolver
+
+from logger.models import LogBody, LogModel, LogRollup
+from logger.services.log_counts import estimate_count
+from logger.services.log_policy import route_endpoint
+from logger.services.log_storage import BODY_FIELDS
+
+OLDER_VAR = 'before'
+NEWER_VAR = 'after'
+
+
+def _proxy_routes(patterns: Optional[list] = None, prefix: str = '') -> Iterator[str]:
+    """Routes of the proxy API as the logger saves them in LogModel.endpoint"""
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        route = f'{prefix}{pattern.pattern}'
+        if isinstance(pattern, URLResolver):
+            yield from _proxy_routes(pattern.url_patterns, prefix=route)
+        elif route.startswith('api/'):
+            yield route
+
+
+class EndpointListFilter(admin.SimpleListFilter):
+    """Choices come from the URL routes, not from a SELECT DISTINCT over the log"""
+    title = 'endpoint'
+    parameter_name = 'endpoint'
+
+    def lookups(self, request: HttpRequest, model_admin: admin.ModelAdmin) -> list[tuple[str, str]]:
+        return [(route, route_endpoint(route)) for route in _proxy_routes()]
+
+    def queryset(self, request: HttpRequest, queryset: QuerySet) -> QuerySet:
+        return queryset.filter(endpoint=self.value()) if self.value() else queryset
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    """Status classes are ranges over the indexed status code"""
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request: HttpRequest, model_admin: admin.ModelAdmin) -> list[tuple[str, str]]:
+        return [(str(status_class), f'{status_class}xx') for status_class in range(1, 6)]
+
+    def queryset(self, request: HttpRequest, queryset: QuerySet) -> QuerySet:
+        if self.value() not in {str(status_class) for status_class in range(1, 6)}:
+            return queryset
+        status_class = int(self.value()) * 100
+        return queryset.filter(
+            proxy_response_status_code__gte=status_class, proxy_response_status_code__lt=status_class + 100,
+        )
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist of the log without COUNT(*) and OFFSET, which both read the whole table.
+    A page is the list_per_page logs older (?before=<id>) or newer (?after=<id>) than the edge of the current page,
+    the number of logs is estimated and the list only loads the displayed columns.
+    """
+
+    COUNT_LIMIT = 10000
+
+    def get_filters_params(self, params: Optional[dict] = None) -> dict:
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(OLDER_VAR, None)
+        lookup_params.pop(NEWER_VAR, None)
+        return lookup_params
 
-from logger.models import LogModel
+    def get_queryset(self, request: HttpRequest) -> QuerySet:
+        return super().get_queryset(request).only(*self.model_admin.list_display)
+
+    def get_results(self, request: HttpRequest) -> None:
+        older, newer = self.__cursor(OLDER_VAR), self.__cursor(NEWER_VAR)
+        if newer is not None:
+            queryset = self.queryset.filter(id__gt=newer).order_by('id')
+        elif older is not None:
+            queryset = self.queryset.filter(id__lt=older).order_by('-id')
+        else:
+            queryset = self.queryset.order_by('-id')
+
+        result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        result_list = result_list[:self.list_per_page]
+        if newer is not None:
+            result_list.reverse()
+        has_newer = has_more if newer is not None else older is not None
+        has_older = has_more if newer is None else True
+
+        self.result_count, is_exact = estimate_count(self.queryset, limit=self.COUNT_LIMIT)
+        if is_exact:
+            self.result_count_label = str(self.result_count)
+        elif connections[self.queryset.db].vendor == 'postgresql':
+            self.result_count_label = f'~{self.result_count}'
+        else:
+            self.result_count_label = f'{self.result_count}+'
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_older or has_newer
+        self.paginator = None
+        self.newer_url = (self.get_query_string({NEWER_VAR: result_list[0].id}, remove=[OLDER_VAR])
+                          if has_newer and result_list else None)
+        self.older_url = (self.get_query_string({OLDER_VAR: result_list[-1].id}, remove=[NEWER_VAR])
+                          if has_older and result_list else None)
+
+    def __cursor(self, name: str) -> Optional[int]:
+        try:
+            return int(self.params[name])
+        except (KeyError, ValueError):
+            return None
 
 
 @admin.register(LogModel)
 class LogModelAdmin(admin.ModelAdmin):
-    ordering = ('id', 'created_at', 'proxy_method',)
+    ordering = ('-id',)
+    list_display = ('id', 'created_at', 'proxy_method', 'endpoint', 'proxy_url', 'proxy_response_status_code',
+                    'total_duration_ms', 'proxy_response_size',)
+    list_filter = (('created_at', admin.DateFieldListFilter), EndpointListFilter, StatusListFilter,)
+    sortable_by = ()
+    show_full_result_count = False
+    exclude = BODY_FIELDS
+    readonly_fields = ('proxy_request_body_text', 'core_request_body_text', 'core_response_body_text',
+                       'proxy_response_body_text',)
+
+    def get_changelist(self, request: HttpRequest, **kwargs) -> type[ChangeList]:
+        return KeysetChangeList
+
+    @admin.display(description='Proxy request body')
+    def proxy_request_body_text(self, log: LogModel) -> str:
+        return self.__body_text(log, 'proxy_request_body')
+
+    @admin.display(description='Core request body')
+    def core_request_body_text(self, log: LogModel) -> str:
+        return self.__body_text(log, 'core_request_body')
+
+    @admin.display(description='Core response body')
+    def core_response_body_text(self, log: LogModel) -> str:
+        return self.__body_text(log, 'core_response_body')
+
+    @admin.display(description='Proxy response body')
+    def proxy_response_body_text(self, log: LogModel) -> str:
+        return self.__body_text(log, 'proxy_response_body')
+
+    @staticmethod
+    def __body_text(log: LogModel, name: str) -> str:
+        try:
+            body = getattr(log, name)
+        except LogBody.DoesNotExist:
+            return '[expired]'
+        if body is None:
+            return ''
+        return f'{body.text}\n[truncated, {body.size} bytes]' if body.is_truncated else body.text
+
+
+@admin.register(LogRollup)
+class LogRollupAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'endpoint', 'method', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'status_counts',)
+    list_filter = ('method', 'endpoint',)
+    date_hierarchy = 'bucket'
+    ordering = ('-bucket', 'endpoint', 'method',)
+
+    @admin.display(description='p50, ms')
+    def p50_ms(self, rollup: LogRollup) -> Optional[float]:
+        return self.__quantile(rollup, 0.5)
+
+    @admin.display(description='p95, ms')
+    def p95_ms(self, rollup: LogRollup) -> Optional[float]:
+        return self.__quantile(rollup, 0.95)
+
+    @admin.display(description='p99, ms')
+    def p99_ms(self, rollup: LogRollup) -> Optional[float]:
+        return self.__quantile(rollup, 0.99)
+
+    @staticmethod
+    def __quantile(rollup: LogRollup, q: float) -> Optional[float]:
+        value = rollup.total_duration_quantile(q)
+        return round(value, 1) if value is not None else None
@@ -0,0 +1,71 @@
+import json
+import random
+import time
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
+
+from logger.services.log_record import LogRecord
+from logger.services.log_storage import save_logs
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures log insert throughput the way the background log writer inserts (batches of save_logs). '
+        'Everything is rolled back, run it before and after a schema change to compare.'
+    )
+
+    __WORDS = ('bot', 'dialogue', 'message', 'answer', 'token', 'model', 'user', 'text', 'result', 'content', 'role',
+               'assistant', 'system', 'name', 'id', 'created', 'updated', 'status', 'gpt-4', 'hello', 'world')
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--rows', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=settings.LOGGER_BATCH_SIZE)
+        parser.add_argument('--body-size', type=int, default=2048, help='Bytes of each request and response body')
+        parser.add_argument(
+            '--unique-bodies',
+            action='store_true',
+            help='Give every log its own bodies, by default all logs share them like the bots list does',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options['rows'] <= 0 or options['batch_size'] <= 0:
+            raise CommandError('--rows and --batch-size must be greater than 0')
+        inserted, elapsed = 0, 0.0
+        with transaction.atomic():
+            while inserted < options['rows']:
+                size = min(options['batch_size'], options['rows'] - inserted)
+                batch = [self.__record(i, options) for i in range(inserted, inserted + size)]
+                started = time.perf_counter()
+                save_logs(batch)
+                elapsed += time.perf_counter() - started
+                inserted += len(batch)
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{inserted} rows in {elapsed:.2f}s: {inserted / elapsed:.0f} rows/s, '
+            f'{elapsed / inserted * 1000:.3f} ms per row (batches of {options["batch_size"]})'
+        ))
+
+    @classmethod
+    def __record(cls, number: int, options: dict) -> LogRecord:
+        """Bodies of random words, so they compress about as well as real JSON does"""
+        words = random.Random(number if options['unique_bodies'] else 0).choices(cls.__WORDS, k=options['body_size'])
+        body = json.dumps({'text': ' '.join(words)[:options['body_size']]}).encode('utf-8')
+        return LogRecord(
+            proxy_method='POST',
+            proxy_url='/api/v0/dialogues/',
+            proxy_request_headers={'Content-Type': 'application/json'},
+            proxy_request_body=body,
+            core_method='POST',
+            core_url=f'{settings.THIRD_PARTY_APP_URL}/{settings.APP_ID}/dialogues/',
+            core_request_body=body,
+            core_response_body=body,
+            core_response_status_code=200,
+            proxy_response_body=body,
+            proxy_response_status_code=200,
+            endpoint='api/v0/dialogues/',
+            total_duration_ms=42.0,
+        )
@@ -0,0 +1,74 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from logger.services.log_export import FORMAT_JSONL, FORMATS, export_rows, iter_log_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports request logs with their bodies to JSONL or Parquet files of --rows-per-file logs, in constant memory. '
+        'The last exported id is kept in the output directory, --resume continues after it.'
+    )
+
+    STATE_FILE = 'export_state.json'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('output_dir', type=Path)
+        parser.add_argument('--format', choices=FORMATS, default=FORMAT_JSONL, help='parquet needs pyarrow')
+        parser.add_argument('--since', help='ISO datetime, logs created at or after it')
+        parser.add_argument('--until', help='ISO datetime, logs created before it')
+        parser.add_argument('--endpoint', help="Route of the logs as saved by the logger, e.g. 'api/v0/bots/'")
+        parser.add_argument('--rows-per-file', type=int, default=100000)
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time')
+        parser.add_argument('--after-id', type=int, default=0, help='Export logs with a greater id only')
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue after the last log of the previous export into the same directory, with the same filters',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        output_dir: Path = options['output_dir']
+        filters = {
+            'since': self.__parse_datetime(options['since'], name='--since'),
+            'until': self.__parse_datetime(options['until'], name='--until'),
+            'endpoint': options['endpoint'],
+        }
+        state = {
+            'format': options['format'],
+            **{name: value.isoformat() if isinstance(value, datetime) else value for name, value in filters.items()},
+        }
+
+        after_id = options['after_id']
+        state_path = output_dir / self.STATE_FILE
+        if options['resume'] and state_path.exists():
+            previous = json.loads(state_path.read_text())
+            last_id = previous.pop('last_id')
+            if previous != state:
+                raise CommandError(f'--resume needs the filters and format of the previous export: {previous}')
+            after_id = max(after_id, last_id)
+
+        exported = 0
+        rows = iter_log_rows(after_id=after_id, chunk_size=options['chunk_size'], **filters)
+        for file in export_rows(rows, output_dir=output_dir, file_format=options['format'],
+                                rows_per_file=options['rows_per_file']):
+            exported += file.rows
+            state_path.write_text(json.dumps({**state, 'last_id': file.last_id}))
+            self.stdout.write(f'Wrote {file.rows} logs to {file.path}')
+
+        self.stdout.write(self.style.SUCCESS(f'Exported {exported} logs after id {after_id}'))
+
+    @staticmethod
+    def __parse_datetime(value: Optional[str], name: str) -> Optional[datetime]:
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Invalid {name} datetime: {value}')
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
@@ -0,0 +1,64 @@
+from datetime import timedelta
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from logger.models import LogBody, LogModel
+from logger.services.log_partitions import create_partitions, expire_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the upcoming daily LogModel partitions and drops or archives the ones past the retention window. '
+        'Meant to be run daily, e.g. from cron. Without partitioning (not PostgreSQL) old logs are deleted in batches.'
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--retention-days', type=int, default=settings.LOGGER_RETENTION_DAYS)
+        parser.add_argument('--days-ahead', type=int, default=settings.LOGGER_PARTITIONS_AHEAD)
+        parser.add_argument(
+            '--archive',
+            action='store_true',
+            help=(
+                'Detach expired partitions and keep them as standalone tables instead of dropping them, '
+                'LogBody rows are then kept as well'
+            ),
+        )
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per DELETE without partitioning')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+
+        if not is_partitioned():
+            if options['archive']:
+                raise CommandError('--archive needs the partitioned PostgreSQL log table')
+            deleted = self.__delete_before(
+                queryset=LogModel.objects.filter(created_at__lt=cutoff), batch_size=options['batch_size'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} logs older than {cutoff:%Y-%m-%d %H:%M}'))
+        else:
+            for name in create_partitions(days_ahead=options['days_ahead']):
+                self.stdout.write(f'Created {name}')
+            for name in expire_partitions(cutoff=cutoff, archive=options['archive']):
+                self.stdout.write(f'{"Archived" if options["archive"] else "Dropped"} {name}')
+
+        if options['archive']:
+            self.stdout.write('Kept the bodies, the archived logs still reference them')
+            return
+        deleted = self.__delete_before(
+            queryset=LogBody.objects.filter(last_seen_at__lt=cutoff), batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} bodies last logged before {cutoff:%Y-%m-%d %H:%M}'))
+
+    @staticmethod
+    def __delete_before(queryset: QuerySet, batch_size: int) -> int:
+        """Short batches keep every DELETE transaction small, so the log writer is never blocked for long"""
+        deleted = 0
+        while True:
+            pks = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
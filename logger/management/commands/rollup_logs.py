@@ -0,0 +1,44 @@
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from logger.services.log_rollup import floor_to_bucket, next_rollup_start, rollup_logs
+
+
+class Command(BaseCommand):
+    help = 'Aggregates request logs into per-minute LogRollup rows, meant to be run periodically (e.g. from cron)'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--since',
+            help='ISO datetime to recompute rollups from, defaults to the minute after the last rollup',
+        )
+        parser.add_argument(
+            '--lag',
+            type=int,
+            default=120,
+            help='Seconds to wait before a minute is rolled up, so logs still queued by the workers are included',
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f'Invalid --since datetime: {options["since"]}')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        else:
+            since = next_rollup_start()
+
+        until = floor_to_bucket(timezone.now() - timedelta(seconds=options['lag']))
+        if since is None or since >= until:
+            self.stdout.write('Nothing to roll up')
+            return
+
+        saved = rollup_logs(since=since, until=until)
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {saved} rollups from {since:%Y-%m-%d %H:%M} to {until:%Y-%m-%d %H:%M}'
+        ))
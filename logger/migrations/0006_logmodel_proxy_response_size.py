@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0005_alter_logmodel_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='logmodel',
+            name='proxy_response_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0006_logmodel_proxy_response_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('endpoint', models.CharField(blank=True, max_length=255)),
+                ('method', models.CharField(blank=True, max_length=10)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('status_counts', models.JSONField(default=dict)),
+                ('total_duration_sum_ms', models.FloatField(default=0)),
+                ('total_duration_sketch', models.JSONField(default=dict)),
+                ('upstream_duration_sketch', models.JSONField(default=dict)),
+                ('request_bytes', models.PositiveBigIntegerField(default=0)),
+                ('response_bytes', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Log rollup',
+                'verbose_name_plural': 'Log rollups',
+                'ordering': ('-bucket', 'endpoint', 'method'),
+            },
+        ),
+        migrations.AddField(
+            model_name='logmodel',
+            name='endpoint',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='logmodel',
+            name='proxy_request_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='logmodel',
+            name='total_duration_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='logmodel',
+            name='upstream_duration_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='logrollup',
+            constraint=models.UniqueConstraint(
+                fields=('bucket', 'endpoint', 'method'),
+                name='logger_rollup_unique_bucket',
+            ),
+        ),
+    ]
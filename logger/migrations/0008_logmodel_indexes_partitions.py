@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:29
+
+from datetime import datetime, time, timedelta, timezone
+
+from django.db import migrations, models
+
+
+def partition_by_day(apps, schema_editor):
+    """
+    On PostgreSQL the log table becomes partitioned by day of created_at. The existing table is kept as one
+    partition holding everything up to tomorrow, new days get their own partitions from the
+    maintain_log_partitions command and rows of days without a partition go to the default partition.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    table = apps.get_model('logger', 'LogModel')._meta.db_table
+    legacy, sequence = f'{table}_legacy', f'{table}_partitioned_id_seq'
+    tomorrow = datetime.now(tz=timezone.utc).date() + timedelta(days=1)
+    upper_bound = datetime.combine(tomorrow, time.min, tzinfo=timezone.utc).isoformat()
+    statements = (
+        f'ALTER TABLE "{table}" RENAME TO "{legacy}"',
+        f'ALTER INDEX IF EXISTS "{table}_pkey" RENAME TO "{legacy}_pkey"',
+        f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)',
+        f'CREATE SEQUENCE "{sequence}" OWNED BY "{table}".id',
+        f'SELECT setval(\'"{sequence}"\', COALESCE((SELECT MAX(id) FROM "{legacy}"), 0) + 1, false)',
+        f'ALTER TABLE "{table}" ALTER COLUMN id SET DEFAULT nextval(\'"{sequence}"\')',
+        f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, created_at)',
+        f'ALTER TABLE "{legacy}" ALTER COLUMN id DROP IDENTITY IF EXISTS',
+        f'ALTER TABLE "{legacy}" ALTER COLUMN id DROP DEFAULT',
+        f'ALTER TABLE "{table}" ATTACH PARTITION "{legacy}" FOR VALUES FROM (MINVALUE) TO (\'{upper_bound}\')',
+        f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT',
+    )
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0007_logmodel_analytics_logrollup'),
+    ]
+
+    operations = [
+        # partitioned first, so the indexes below are created on every partition
+        migrations.RunPython(partition_by_day, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='logmodel',
+            options={'ordering': ('-id',), 'verbose_name': 'Log', 'verbose_name_plural': 'Logs'},
+        ),
+        migrations.AddIndex(
+            model_name='logmodel',
+            index=models.Index(fields=['created_at'], name='logger_log_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logmodel',
+            index=models.Index(fields=['core_url'], name='logger_log_core_url_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logmodel',
+            index=models.Index(fields=['proxy_response_status_code'], name='logger_log_status_code_idx'),
+        ),
+    ]
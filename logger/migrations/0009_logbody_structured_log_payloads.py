@@ -0,0 +1,144 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:31
+
+import ast
+import hashlib
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+HEADER_FIELDS = ('proxy_request_headers', 'core_request_headers', 'core_response_headers', 'proxy_response_headers')
+BODY_FIELDS = ('proxy_request_body', 'core_request_body', 'core_response_body', 'proxy_response_body')
+BATCH_SIZE = 1000
+
+# Frozen copies of logger.services.log_bodies and the LOGGER_BODY_* defaults at the time of this migration,
+# so the backfill does not change with the code or the settings of whoever runs it
+BODY_MAX_SIZE = 65536
+BODY_COMPRESSION = 'zlib'
+
+
+def headers_to_json(value):
+    """Headers were saved as str(dict), they become JSON before the columns change their type"""
+    if not value:
+        return None
+    try:
+        return json.dumps(ast.literal_eval(value))
+    except (ValueError, SyntaxError):
+        return json.dumps(value)
+
+
+def body_to_bytes(body):
+    if not body:
+        return None
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return bytes(body)
+
+
+def body_digest(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def encode_body(body, digest):
+    content = body[:BODY_MAX_SIZE]
+    compressed, compression = zlib.compress(content, 6), BODY_COMPRESSION
+    if len(compressed) >= len(content):
+        compressed, compression = content, ''
+    return {
+        'digest': digest,
+        'content': compressed,
+        'compression': compression,
+        'size': len(body),
+        'is_truncated': len(body) > BODY_MAX_SIZE,
+    }
+
+
+def move_payloads(apps, schema_editor):
+    """Reads the log table in chunks, each batch of logs is moved in its own transaction"""
+    LogModel = apps.get_model('logger', 'LogModel')
+    logs = LogModel.objects.using(schema_editor.connection.alias).order_by('id')
+
+    batch = []
+    for log in logs.iterator(chunk_size=BATCH_SIZE):
+        batch.append(log)
+        if len(batch) == BATCH_SIZE:
+            move_batch(apps, schema_editor, batch)
+            batch = []
+    if batch:
+        move_batch(apps, schema_editor, batch)
+
+
+def move_batch(apps, schema_editor, logs):
+    LogModel = apps.get_model('logger', 'LogModel')
+    LogBody = apps.get_model('logger', 'LogBody')
+    alias = schema_editor.connection.alias
+    now = timezone.now()
+
+    bodies = {}
+    for log in logs:
+        for name in HEADER_FIELDS:
+            setattr(log, name, headers_to_json(getattr(log, name)))
+        for name in BODY_FIELDS:
+            body = body_to_bytes(getattr(log, name))
+            if body is None:
+                continue
+            digest = body_digest(body)
+            if digest not in bodies:
+                bodies[digest] = encode_body(body, digest=digest)
+            setattr(log, f'{name}_ref_id', digest)
+
+    with transaction.atomic(using=alias):
+        LogBody.objects.using(alias).bulk_create(
+            [LogBody(last_seen_at=now, **encoded) for encoded in bodies.values()],
+            ignore_conflicts=True,
+        )
+        LogModel.objects.using(alias).bulk_update(logs, [*HEADER_FIELDS, *(f'{name}_ref' for name in BODY_FIELDS)])
+
+
+def body_field():
+    return models.ForeignKey(
+        blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING,
+        related_name='+', to='logger.logbody',
+    )
+
+
+class Migration(migrations.Migration):
+
+    # the payloads of a large log table are moved in batches, without holding one transaction for all of them
+    atomic = False
+
+    dependencies = [
+        ('logger', '0008_logmodel_indexes_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogBody',
+            fields=[
+                ('digest', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('content', models.BinaryField()),
+                ('compression', models.CharField(blank=True, max_length=8)),
+                ('size', models.PositiveBigIntegerField()),
+                ('is_truncated', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_seen_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Log body',
+                'verbose_name_plural': 'Log bodies',
+            },
+        ),
+        *(migrations.AddField(model_name='logmodel', name=f'{name}_ref', field=body_field()) for name in BODY_FIELDS),
+        migrations.RunPython(move_payloads, migrations.RunPython.noop),
+        *(
+            migrations.AlterField(model_name='logmodel', name=name, field=models.JSONField(blank=True, null=True))
+            for name in HEADER_FIELDS
+        ),
+        *(migrations.RemoveField(model_name='logmodel', name=name) for name in BODY_FIELDS),
+        *(
+            migrations.RenameField(model_name='logmodel', old_name=f'{name}_ref', new_name=name)
+            for name in BODY_FIELDS
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0009_logbody_structured_log_payloads'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logmodel',
+            index=models.Index(fields=['endpoint', '-id'], name='logger_log_endpoint_idx'),
+        ),
+    ]
@@ -1,28 +1,72 @@
+from typing import Optional
+
 from django.db import models
 
+from logger.services.latency_sketch import LatencySketch
+from logger.services.log_bodies import decode_body
+
+
+class LogBody(models.Model):
+    """
+    Request or response body shared by every log with the identical body, e.g. the bots list.
+    Only the first LOGGER_BODY_MAX_SIZE bytes are kept, compressed with LOGGER_BODY_COMPRESSION.
+    """
+    digest = models.CharField(max_length=32, primary_key=True)
+    content = models.BinaryField()
+    compression = models.CharField(max_length=8, blank=True)
+    size = models.PositiveBigIntegerField()
+    is_truncated = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return f'{self.digest} | Size: {self.size}'
+
+    @property
+    def text(self) -> str:
+        return decode_body(self.content, self.compression).decode('utf-8', errors='replace')
+
+    class Meta:
+        verbose_name = 'Log body'
+        verbose_name_plural = 'Log bodies'
+
+
+def _body_field() -> models.ForeignKey:
+    """No database constraint, so bodies and partitioned logs are inserted and expired independently"""
+    return models.ForeignKey(
+        LogBody, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+', null=True, blank=True,
+    )
+
 
 class LogModel(models.Model):
     """From Client to Proxy fields"""
     proxy_method = models.CharField(max_length=10, null=True, blank=True)
     proxy_url = models.URLField(max_length=255, null=True, blank=True)
-    proxy_request_headers = models.TextField(null=True, blank=True)
-    proxy_request_body = models.TextField(null=True, blank=True)
+    proxy_request_headers = models.JSONField(null=True, blank=True)
+    proxy_request_body = _body_field()
 
     """From Proxy to Yadro fields"""
     core_method = models.CharField(max_length=10, null=True, blank=True)
     core_url = models.URLField(max_length=255, null=True, blank=True)
-    core_request_headers = models.TextField(null=True, blank=True)
-    core_request_body = models.TextField(null=True, blank=True)
+    core_request_headers = models.JSONField(null=True, blank=True)
+    core_request_body = _body_field()
 
     """From Yadro to Proxy fields"""
-    core_response_headers = models.TextField(null=True, blank=True)
-    core_response_body = models.TextField(null=True, blank=True)
+    core_response_headers = models.JSONField(null=True, blank=True)
+    core_response_body = _body_field()
     core_response_status_code = models.PositiveIntegerField(null=True, blank=True)
 
     """From Proxy to Client Fields"""
-    proxy_response_headers = models.TextField(null=True, blank=True)
-    proxy_response_body = models.TextField(null=True, blank=True)
+    proxy_response_headers = models.JSONField(null=True, blank=True)
+    proxy_response_body = _body_field()
     proxy_response_status_code = models.PositiveIntegerField(null=True, blank=True)
+    proxy_response_size = models.PositiveBigIntegerField(null=True, blank=True)
+
+    """Analytics fields"""
+    endpoint = models.CharField(max_length=255, null=True, blank=True)
+    proxy_request_size = models.PositiveBigIntegerField(null=True, blank=True)
+    upstream_duration_ms = models.FloatField(null=True, blank=True)
+    total_duration_ms = models.FloatField(null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -32,6 +76,69 @@ class LogModel(models.Model):
                 f'Proxy response status code: {self.proxy_response_status_code}')
 
     class Meta:
-        ordering = ('id', 'proxy_method',)
+        ordering = ('-id',)
         verbose_name = 'Log'
         verbose_name_plural = 'Logs'
+        indexes = (
+            models.Index(fields=('created_at',), name='logger_log_created_at_idx'),
+            models.Index(fields=('core_url',), name='logger_log_core_url_idx'),
+            models.Index(fields=('proxy_response_status_code',), name='logger_log_status_code_idx'),
+            models.Index(fields=('endpoint', '-id'), name='logger_log_endpoint_idx'),
+        )
+
+
+class LogRollupQuerySet(models.QuerySet):
+
+    def summarize(self) -> dict:
+        """Merges the selected rollups, e.g. p95 of /dialogues yesterday without touching LogModel"""
+        count, status_counts, total_duration_sum_ms = 0, {}, 0.0
+        total_duration_sketches, upstream_duration_sketches = [], []
+        for rollup in self.only('count', 'status_counts', 'total_duration_sum_ms',
+                                'total_duration_sketch', 'upstream_duration_sketch'):
+            count += rollup.count
+            total_duration_sum_ms += rollup.total_duration_sum_ms
+            for status, status_count in rollup.status_counts.items():
+                status_counts[status] = status_counts.get(status, 0) + status_count
+            total_duration_sketches.append(LatencySketch.from_dict(rollup.total_duration_sketch))
+            upstream_duration_sketches.append(LatencySketch.from_dict(rollup.upstream_duration_sketch))
+
+        total_duration = LatencySketch.merged(total_duration_sketches)
+        upstream_duration = LatencySketch.merged(upstream_duration_sketches)
+        return {
+            'count': count,
+            'status_counts': status_counts,
+            'avg_ms': total_duration_sum_ms / count if count else None,
+            **{f'p{q}_ms': total_duration.quantile(q / 100) for q in (50, 95, 99)},
+            **{f'upstream_p{q}_ms': upstream_duration.quantile(q / 100) for q in (50, 95, 99)},
+        }
+
+
+class LogRollup(models.Model):
+    """Requests of one endpoint and method within one minute, aggregated from LogModel by the rollup_logs command"""
+    bucket = models.DateTimeField()
+    endpoint = models.CharField(max_length=255, blank=True)
+    method = models.CharField(max_length=10, blank=True)
+
+    count = models.PositiveIntegerField(default=0)
+    status_counts = models.JSONField(default=dict)
+    total_duration_sum_ms = models.FloatField(default=0)
+    total_duration_sketch = models.JSONField(default=dict)
+    upstream_duration_sketch = models.JSONField(default=dict)
+    request_bytes = models.PositiveBigIntegerField(default=0)
+    response_bytes = models.PositiveBigIntegerField(default=0)
+
+    objects = LogRollupQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return f'{self.bucket:%Y-%m-%d %H:%M} | {self.method} {self.endpoint} | Count: {self.count}'
+
+    def total_duration_quantile(self, q: float) -> Optional[float]:
+        return LatencySketch.from_dict(self.total_duration_sketch).quantile(q)
+
+    class Meta:
+        ordering = ('-bucket', 'endpoint', 'method',)
+        verbose_name = 'Log rollup'
+        verbose_name_plural = 'Log rollups'
+        constraints = (
+            models.UniqueConstraint(fields=('bucket', 'endpoint', 'method'), name='logger_rollup_unique_bucket'),
+        )
@@ -1,41 +1,132 @@
+from contextvars import ContextVar
+from typing import Optional
+
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from rest_framework.request import Request
 
-from logger.models import LogModel
+from common.metrics import stage_timer
+from logger.services.log_policy import LEVEL_NONE, LogPolicy
+from logger.services.log_record import LogRecord
+from logger.services.log_storage import save_logs
+from logger.services.log_writer import LogWriter
+
+_current_record: ContextVar[Optional[LogRecord]] = ContextVar('log_record', default=None)
+
+_UPSTREAM_CALL_FIELDS = (
+    'core_method', 'core_url', 'core_request_headers', 'core_request_body',
+    'core_response_headers', 'core_response_body', 'core_response_status_code', 'upstream_duration_ms',
+)
 
 
 class Logger:
-    
-    MODEL_FIELDS = {}
+    """
+    Fills the log record of the current request.
+    The record lives in a context variable, so concurrent requests of threaded and async workers never share it.
+    """
+
+    @property
+    def record(self) -> LogRecord:
+        record = _current_record.get()
+        if record is None:
+            record = LogRecord()
+            _current_record.set(record)
+        return record
 
     def log_client_request(self, request: Request) -> None:
-        self.MODEL_FIELDS.update({
-            'proxy_method': request.method,
-            'proxy_url': request.get_full_path(),
-            'proxy_request_headers': dict(request.headers),
-            'proxy_request_body': request.body,
-        })
+        _current_record.set(LogRecord(
+            proxy_method=request.method,
+            proxy_url=request.get_full_path(),
+            proxy_request_headers=dict(request.headers),
+            proxy_request_body=request.body,
+            proxy_request_size=len(request.body),
+            endpoint=request.resolver_match.route if request.resolver_match is not None else None,
+        ))
+
+    def log_upstream_duration(self, duration: float) -> None:
+        """Time until Yadro's response headers arrived, in seconds"""
+        self.record.upstream_duration_ms = duration * 1000
 
     def log_proxy_request_core_response(self, response: requests.Response) -> None:
-        self.MODEL_FIELDS.update({
-            'core_method': response.request.method,
-            'core_url': response.request.url,
-            'core_request_headers': dict(response.request.headers),
-            'core_request_body': response.request.body.decode('utf-8'),
-            'core_response_headers': dict(response.headers),
-            'core_response_body': response.text,
-            'core_response_status_code': response.status_code,
-        })
+        record = self.record
+        record.core_method = response.request.method
+        record.core_url = response.request.url
+        record.core_request_headers = dict(response.request.headers)
+        record.core_request_body = response.request.body
+        record.core_response_headers = dict(response.headers)
+        record.core_response_body = response.content
+        record.core_response_status_code = response.status_code
+
+    def upstream_call_fields(self) -> dict:
+        """Fields of the upstream call of the current request, copied to the requests that shared the call"""
+        record = self.record
+        return {name: getattr(record, name) for name in _UPSTREAM_CALL_FIELDS}
+
+    def log_shared_upstream_call(self, call_fields: dict) -> None:
+        record = self.record
+        for name, value in call_fields.items():
+            setattr(record, name, dict(value) if isinstance(value, dict) else value)
 
     def log_proxy_response_to_client(self, response: requests.Response) -> None:
-        self.MODEL_FIELDS.update({
-            'proxy_response_headers': dict(response.headers),
-            'proxy_response_body': response.content if response.content else '',
-            'proxy_response_status_code': response.status_code,
-        })
+        record = self.record
+        record.proxy_response_headers = dict(response.headers)
+        record.proxy_response_body = response.content if response.content else ''
+        record.proxy_response_status_code = response.status_code
+        record.proxy_response_size = len(response.content)
+
+    @staticmethod
+    def log_streamed_response(record: LogRecord, prepared_request: requests.PreparedRequest, status_code: int,
+                              headers: dict, prefix: bytes, size: int) -> None:
+        """A streamed body is never held in full, only its first bytes and its total size are logged"""
+        record.core_method = prepared_request.method
+        record.core_url = prepared_request.url
+        record.core_request_headers = dict(prepared_request.headers)
+        record.core_request_body = prepared_request.body
+        record.core_response_headers = headers
+        record.core_response_body = prefix
+        record.core_response_status_code = status_code
+        record.proxy_response_headers = headers
+        record.proxy_response_body = prefix
+        record.proxy_response_status_code = status_code
+        record.proxy_response_size = size
+
+    def detach_record(self) -> Optional[LogRecord]:
+        """Takes the record out of the request context, a streamed response saves it after the view has returned"""
+        record = _current_record.get()
+        _current_record.set(None)
+        return record
 
     def save_to_db(self) -> None:
-        if settings.IS_NEED_LOGGER:
-            log = LogModel(**self.MODEL_FIELDS)
-            log.save()
+        with stage_timer('log_save'):
+            self.save_record(self.detach_record())
+
+    async def asave_to_db(self) -> None:
+        with stage_timer('log_save'):
+            await self.asave_record(self.detach_record())
+
+    @staticmethod
+    def save_record(record: Optional[LogRecord]) -> None:
+        if not settings.IS_NEED_LOGGER or record is None:
+            return
+
+        policy = LogPolicy.get_instance()
+        level = policy.decide(record)
+        if level == LEVEL_NONE:
+            return
+        policy.apply(record, level=level)
+        record.finish()
+
+        if settings.LOGGER_BACKGROUND_WRITES:
+            LogWriter.get_instance().put(record)
+        else:
+            save_logs([record])
+
+    async def asave_record(self, record: Optional[LogRecord]) -> None:
+        if not settings.IS_NEED_LOGGER or record is None:
+            return
+
+        if settings.LOGGER_BACKGROUND_WRITES and not LogWriter.get_instance().blocks_on_overflow:
+            self.save_record(record)
+        else:
+            await sync_to_async(self.save_record)(record)
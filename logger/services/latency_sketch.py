@@ -0,0 +1,70 @@
+import math
+from typing import Iterable, Optional
+
+
+class LatencySketch:
+    """
+    Mergeable quantile sketch of latencies in milliseconds (DDSketch with logarithmic buckets).
+    Any quantile is within RELATIVE_ACCURACY of the true value, and sketches of different minutes or workers
+    merge by adding their bucket counts, so rollups can be combined into any time range.
+    """
+
+    RELATIVE_ACCURACY = 0.01
+    # latencies below it, 1 microsecond, are counted as zero
+    MIN_VALUE = 0.001
+
+    __GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    __LOG_GAMMA = math.log(__GAMMA)
+
+    def __init__(self, buckets: Optional[dict[int, int]] = None, zero_count: int = 0) -> None:
+        self.buckets = buckets if buckets is not None else {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.buckets.values())
+
+    def add(self, value: float) -> None:
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.__LOG_GAMMA)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: 'LatencySketch') -> None:
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if not total:
+            return None
+
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.__GAMMA ** index / (self.__GAMMA + 1)
+        return 2 * self.__GAMMA ** max(self.buckets) / (self.__GAMMA + 1)
+
+    def to_dict(self) -> dict:
+        """JSON-friendly form, keys of JSON objects are always strings"""
+        return {'zero_count': self.zero_count, 'buckets': {str(index): count for index, count in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'LatencySketch':
+        if not data:
+            return cls()
+        buckets = {int(index): count for index, count in data.get('buckets', {}).items()}
+        return cls(buckets=buckets, zero_count=data.get('zero_count', 0))
+
+    @classmethod
+    def merged(cls, sketches: Iterable['LatencySketch']) -> 'LatencySketch':
+        result = cls()
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
@@ -0,0 +1,76 @@
+import hashlib
+import zlib
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_NONE = ''
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_ZSTD = 'zstd'
+
+
+@dataclass(slots=True)
+class EncodedBody:
+    digest: str
+    content: bytes
+    compression: str
+    size: int
+    is_truncated: bool
+
+
+def body_to_bytes(body: Any) -> Optional[bytes]:
+    """Bodies are logged as the proxy holds them, bytes of the wire or already decoded text"""
+    if not body:
+        return None
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return bytes(body)
+
+
+def body_digest(body: bytes) -> str:
+    """Identity of a body, computed over the whole body, so bodies differing after the logged prefix stay apart"""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def encode_body(body: bytes, digest: str, max_size: int, compression: str) -> EncodedBody:
+    """Truncates the body to max_size bytes and compresses it, unless compression does not make it smaller"""
+    content = body[:max_size]
+    compressed = _compress(content, compression)
+    if compressed is None or len(compressed) >= len(content):
+        compressed, compression = content, COMPRESSION_NONE
+    return EncodedBody(
+        digest=digest,
+        content=compressed,
+        compression=compression,
+        size=len(body),
+        is_truncated=len(body) > max_size,
+    )
+
+
+def decode_body(content: bytes, compression: str) -> bytes:
+    content = bytes(content)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(content)
+    if compression == COMPRESSION_ZSTD:
+        return _zstandard().ZstdDecompressor().decompress(content)
+    return content
+
+
+def _compress(content: bytes, compression: str) -> Optional[bytes]:
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(content, 6)
+    if compression == COMPRESSION_ZSTD:
+        return _zstandard().ZstdCompressor(level=3).compress(content)
+    return None
+
+
+def _zstandard() -> Any:
+    if zstandard is None:
+        raise ImproperlyConfigured('zstd log body compression requires the zstandard package')
+    return zstandard
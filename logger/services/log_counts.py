@@ -0,0 +1,25 @@
+import json
+
+from django.db import connections
+from django.db.models import QuerySet
+
+
+def estimate_count(queryset: QuerySet, limit: int) -> tuple[int, bool]:
+    """
+    Number of rows of the queryset without COUNT(*) over the whole table.
+    PostgreSQL returns the planner's estimate, other databases count at most limit rows.
+    Returns the count and whether it is exact.
+    """
+    queryset = queryset.order_by().values('pk')
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        count = queryset[:limit].count()
+        return count, count < limit
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows']), False
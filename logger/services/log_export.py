@@ -0,0 +1,161 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+
+from logger.models import LogModel
+from logger.services.log_storage import BODY_FIELDS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+FORMATS = (FORMAT_JSONL, FORMAT_PARQUET)
+
+JSON_FIELDS = tuple(field.name for field in LogModel._meta.concrete_fields if field.get_internal_type() == 'JSONField')
+
+
+@dataclass(slots=True)
+class ExportedFile:
+    path: Path
+    rows: int
+    last_id: int
+
+
+def iter_log_rows(since: Optional[datetime] = None, until: Optional[datetime] = None, endpoint: Optional[str] = None,
+                  after_id: int = 0, chunk_size: int = 2000) -> Iterator[dict]:
+    """
+    Logs in id order with their bodies decoded, read chunk_size rows at a time.
+    On PostgreSQL iterator() reads through a server-side cursor, so memory does not grow with the number of logs.
+    """
+    queryset = LogModel.objects.filter(id__gt=after_id)
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    if endpoint:
+        queryset = queryset.filter(endpoint=endpoint)
+
+    for log in queryset.select_related(*BODY_FIELDS).order_by('id').iterator(chunk_size=chunk_size):
+        yield log_to_row(log)
+
+
+def log_to_row(log: LogModel) -> dict:
+    """A body removed by maintain_log_partitions is exported as None"""
+    row = {}
+    for field in LogModel._meta.concrete_fields:
+        if field.name in BODY_FIELDS:
+            body = getattr(log, field.name)
+            row[field.name] = body.text if body is not None else None
+        else:
+            row[field.name] = getattr(log, field.attname)
+    return row
+
+
+def export_rows(rows: Iterable[dict], output_dir: Path, file_format: str,
+                rows_per_file: int) -> Iterator[ExportedFile]:
+    """
+    Writes rows into files of at most rows_per_file rows named after their first and last log id.
+    A file is written as .part and renamed once complete, so a file without the suffix is never partial.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    file, first_id, last_id, count = None, None, None, 0
+    for row in rows:
+        if file is None:
+            first_id, count = row['id'], 0
+            file = _open_file(output_dir / f'logs-{first_id:012d}.{file_format}.part', file_format=file_format)
+        file.write(row)
+        last_id, count = row['id'], count + 1
+        if count >= rows_per_file:
+            yield _complete(file, output_dir=output_dir, file_format=file_format, first_id=first_id,
+                            last_id=last_id, count=count)
+            file = None
+
+    if file is not None:
+        yield _complete(file, output_dir=output_dir, file_format=file_format, first_id=first_id,
+                        last_id=last_id, count=count)
+
+
+def _complete(file: Any, output_dir: Path, file_format: str, first_id: int, last_id: int,
+              count: int) -> ExportedFile:
+    file.close()
+    path = output_dir / f'logs-{first_id:012d}-{last_id:012d}.{file_format}'
+    file.path.rename(path)
+    return ExportedFile(path=path, rows=count, last_id=last_id)
+
+
+def _open_file(path: Path, file_format: str) -> Any:
+    if file_format == FORMAT_PARQUET:
+        return _ParquetFile(path)
+    return _JsonLinesFile(path)
+
+
+class _JsonLinesFile:
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.__file = path.open('w', encoding='utf-8')
+
+    def write(self, row: dict) -> None:
+        self.__file.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+        self.__file.write('\n')
+
+    def close(self) -> None:
+        self.__file.close()
+
+
+class _ParquetFile:
+    """Rows are buffered and written as one row group per ROW_GROUP_SIZE rows, headers are stored as JSON text"""
+
+    ROW_GROUP_SIZE = 10000
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.__schema = _parquet_schema()
+        self.__writer = _pyarrow().parquet.ParquetWriter(str(path), schema=self.__schema, compression='zstd')
+        self.__rows = []
+
+    def write(self, row: dict) -> None:
+        for name in JSON_FIELDS:
+            if row[name] is not None:
+                row[name] = json.dumps(row[name], ensure_ascii=False)
+        self.__rows.append(row)
+        if len(self.__rows) >= self.ROW_GROUP_SIZE:
+            self.__flush()
+
+    def close(self) -> None:
+        self.__flush()
+        self.__writer.close()
+
+    def __flush(self) -> None:
+        if self.__rows:
+            self.__writer.write_table(_pyarrow().Table.from_pylist(self.__rows, schema=self.__schema))
+            self.__rows = []
+
+
+def _parquet_schema() -> Any:
+    pa = _pyarrow()
+    types = {
+        'BigAutoField': pa.int64(),
+        'PositiveIntegerField': pa.int64(),
+        'PositiveBigIntegerField': pa.int64(),
+        'FloatField': pa.float64(),
+        'DateTimeField': pa.timestamp('us', tz='UTC'),
+    }
+    return pa.schema([
+        (field.name, types.get(field.get_internal_type(), pa.string())) for field in LogModel._meta.concrete_fields
+    ])
+
+
+def _pyarrow() -> Any:
+    if pyarrow is None:
+        raise ImproperlyConfigured('parquet log export requires the pyarrow package')
+    return pyarrow
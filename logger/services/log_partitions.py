@@ -0,0 +1,116 @@
+import logging
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+
+from django.db import connection, transaction
+
+from logger.models import LogModel
+
+logger = logging.getLogger(__name__)
+
+TABLE = LogModel._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def is_partitioned() -> bool:
+    """LogModel is partitioned by day of created_at on PostgreSQL only, see migration 0008"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)", [TABLE])
+        return cursor.fetchone()[0]
+
+
+def partition_name(day: date) -> str:
+    return f'{TABLE}_p{day:%Y%m%d}'
+
+
+def create_partitions(days_ahead: int) -> list[str]:
+    """Creates the partitions of today and of the next days_ahead days that do not exist yet"""
+    today = datetime.now(tz=timezone.utc).date()
+    existing = set(list_partitions())
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        name = partition_name(day)
+        if name not in existing:
+            _create_partition(day=day, name=name)
+            created.append(name)
+    return created
+
+
+def expire_partitions(cutoff: datetime, archive: bool) -> list[str]:
+    """
+    Drops, or detaches to keep them as standalone tables, partitions whose rows are all older than cutoff.
+    Both are a catalog change, no rows are read or deleted one by one.
+    """
+    expired = []
+    for name, upper_bound in list_partitions().items():
+        if upper_bound is None or upper_bound > cutoff:
+            continue
+        with connection.cursor() as cursor:
+            if archive:
+                cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+            else:
+                cursor.execute(f'DROP TABLE "{name}"')
+        expired.append(name)
+
+    # the default partition only gets rows when create_partitions was not run in time
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at < %s', [cutoff])
+    return expired
+
+
+def list_partitions() -> dict[str, Optional[datetime]]:
+    """Partitions of LogModel with the exclusive upper bound of their range, None for the default partition"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = {}
+    for name, bound in rows:
+        match = _UPPER_BOUND.search(bound)
+        partitions[name] = datetime.fromisoformat(match.group(1)) if match else None
+    return partitions
+
+
+def _create_partition(day: date, name: str) -> None:
+    """Rows of the day that already landed in the default partition are moved into the new partition"""
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= %s AND created_at < %s)',
+            [start, end],
+        )
+        has_default_rows = cursor.fetchone()[0]
+        if has_default_rows:
+            logger.warning('Moving rows of %s out of the default log partition', day)
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+
+        cursor.execute(
+            f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+        if has_default_rows:
+            cursor.execute(
+                f'INSERT INTO "{TABLE}" SELECT * FROM "{DEFAULT_PARTITION}" WHERE created_at >= %s AND created_at < %s',
+                [start, end],
+            )
+            cursor.execute(
+                f'DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at >= %s AND created_at < %s',
+                [start, end],
+            )
+            cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT')
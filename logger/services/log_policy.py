@@ -0,0 +1,154 @@
+import random
+import re
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from common.counters import Counters
+from common.metrics import Metrics
+from logger.services.log_record import LogRecord
+
+LEVEL_FULL = 'full'
+LEVEL_METADATA = 'metadata'
+LEVEL_NONE = 'none'
+LEVELS = (LEVEL_FULL, LEVEL_METADATA, LEVEL_NONE)
+
+PAYLOAD_FIELDS = (
+    'proxy_request_headers', 'proxy_request_body', 'core_request_headers', 'core_request_body',
+    'core_response_headers', 'core_response_body', 'proxy_response_headers', 'proxy_response_body',
+)
+
+_API_PREFIX = re.compile(r'^api/v\d+/')
+_ROUTE_PARAMETER = re.compile(r'<(?:\w+:)?\w+>')
+_STATUS_CLASS = re.compile(r'^([1-5])xx$')
+
+
+@dataclass(frozen=True, slots=True)
+class LogRule:
+    endpoint: Optional[str]
+    methods: Optional[frozenset[str]]
+    statuses: Optional[tuple[int, int]]
+    level: str
+    sample_rate: float
+
+    def matches_status(self, status_code: Optional[int]) -> bool:
+        if self.statuses is None:
+            return True
+        return status_code is not None and self.statuses[0] <= status_code <= self.statuses[1]
+
+
+class LogPolicy:
+    """
+    Decides per request what of its log is kept: everything, metadata only (no headers and bodies) or nothing.
+    Rules of LOGGER_POLICY_RULES are compiled once, the rules that may apply to an endpoint and method are
+    looked up in a table built on first use, so a decision is a dict lookup and a few status comparisons.
+    The first matching rule wins, a request no rule matches is logged at LOGGER_POLICY_DEFAULT_LEVEL.
+    A request sampled out of a full rule is still logged at metadata level, so the rollups count every request.
+    """
+
+    stats = Counters(*LEVELS, 'sampled_out')
+
+    __instance: Optional['LogPolicy'] = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, rules: Iterable[dict], default_level: str) -> None:
+        self.__rules = tuple(self.__compile(rule) for rule in rules)
+        self.__default_level = self.__validate_level(default_level)
+        self.__table: dict[tuple[str, str], tuple[LogRule, ...]] = {}
+
+    @classmethod
+    def get_instance(cls) -> 'LogPolicy':
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls(
+                        rules=settings.LOGGER_POLICY_RULES, default_level=settings.LOGGER_POLICY_DEFAULT_LEVEL,
+                    )
+        return cls.__instance
+
+    def decide(self, record: LogRecord) -> str:
+        endpoint, method = route_endpoint(record.endpoint), (record.proxy_method or '').upper()
+        rules = self.__table.get((endpoint, method))
+        if rules is None:
+            # the table is bounded by the routes of the proxy, a racing thread computes the same entry
+            rules = self.__table[(endpoint, method)] = tuple(
+                rule for rule in self.__rules if self.__matches(rule, endpoint=endpoint, method=method)
+            )
+
+        status_code = record.proxy_response_status_code or record.core_response_status_code
+        level = self.__default_level
+        for rule in rules:
+            if rule.matches_status(status_code):
+                level = rule.level
+                if level == LEVEL_FULL and rule.sample_rate < 1 and random.random() >= rule.sample_rate:
+                    self.stats.increment('sampled_out')
+                    level = LEVEL_METADATA
+                break
+
+        self.stats.increment(level)
+        return level
+
+    @staticmethod
+    def apply(record: LogRecord, level: str) -> None:
+        """Strips what the level does not keep, sizes, statuses and timings are always kept"""
+        if level == LEVEL_METADATA:
+            for name in PAYLOAD_FIELDS:
+                setattr(record, name, None)
+
+    @staticmethod
+    def __matches(rule: LogRule, endpoint: str, method: str) -> bool:
+        """'bots' matches the bot list and every bot, 'bots/<id>' matches single bots only"""
+        if rule.methods is not None and method not in rule.methods:
+            return False
+        return rule.endpoint is None or endpoint == rule.endpoint or endpoint.startswith(f'{rule.endpoint}/')
+
+    @classmethod
+    def __compile(cls, rule: dict) -> LogRule:
+        unknown = set(rule) - {'endpoint', 'methods', 'status', 'level', 'sample_rate'}
+        if unknown:
+            raise ImproperlyConfigured(f'Unknown keys {sorted(unknown)} in log policy rule {rule}')
+
+        sample_rate = float(rule.get('sample_rate', 1))
+        if not 0 <= sample_rate <= 1:
+            raise ImproperlyConfigured(f'sample_rate of log policy rule {rule} must be between 0 and 1')
+
+        methods = rule.get('methods')
+        return LogRule(
+            endpoint=rule['endpoint'].strip('/') if rule.get('endpoint') else None,
+            methods=frozenset(method.upper() for method in methods) if methods else None,
+            statuses=cls.__parse_status(rule['status']) if rule.get('status') is not None else None,
+            level=cls.__validate_level(rule.get('level', LEVEL_FULL)),
+            sample_rate=sample_rate,
+        )
+
+    @staticmethod
+    def __parse_status(status: object) -> tuple[int, int]:
+        """A status is 404, '5xx' or '400-499'"""
+        text = str(status).strip().lower()
+        match = _STATUS_CLASS.match(text)
+        if match:
+            return int(match.group(1)) * 100, int(match.group(1)) * 100 + 99
+        low, _, high = text.partition('-')
+        try:
+            return int(low), int(high or low)
+        except ValueError:
+            raise ImproperlyConfigured(f'Invalid status {status!r} in a log policy rule') from None
+
+    @staticmethod
+    def __validate_level(level: str) -> str:
+        if level not in LEVELS:
+            raise ImproperlyConfigured(f'Log policy level must be one of {LEVELS}, got {level!r}')
+        return level
+
+
+def route_endpoint(route: Optional[str]) -> str:
+    """The resolver route 'api/v0/bots/<int:bot_id>/' becomes 'bots/<id>', as endpoints are written in settings"""
+    if not route:
+        return ''
+    return _ROUTE_PARAMETER.sub('<id>', _API_PREFIX.sub('', route)).strip('/')
+
+
+Metrics.register_collector(prefix='proxy_log_policy', snapshot=LogPolicy.stats.snapshot)
@@ -0,0 +1,53 @@
+import time
+from dataclasses import dataclass, field, fields
+from typing import Any, Optional
+
+
+@dataclass(slots=True)
+class LogRecord:
+    """
+    Log fields of a single proxied request, mirrors LogModel.
+    Bodies reference the bytes the proxy already holds and are only decoded in as_model_fields.
+    """
+
+    proxy_method: Optional[str] = None
+    proxy_url: Optional[str] = None
+    proxy_request_headers: Any = None
+    proxy_request_body: Any = None
+
+    core_method: Optional[str] = None
+    core_url: Optional[str] = None
+    core_request_headers: Any = None
+    core_request_body: Any = None
+
+    core_response_headers: Any = None
+    core_response_body: Any = None
+    core_response_status_code: Optional[int] = None
+
+    proxy_response_headers: Any = None
+    proxy_response_body: Any = None
+    proxy_response_status_code: Optional[int] = None
+    proxy_response_size: Optional[int] = None
+
+    endpoint: Optional[str] = None
+    proxy_request_size: Optional[int] = None
+    upstream_duration_ms: Optional[float] = None
+    total_duration_ms: Optional[float] = None
+
+    started: float = field(default_factory=time.perf_counter, metadata={'model_field': False})
+
+    def finish(self) -> None:
+        """Called once the response is handed to the client, or once a streamed body has been relayed"""
+        if self.total_duration_ms is None:
+            self.total_duration_ms = (time.perf_counter() - self.started) * 1000
+
+    def as_model_fields(self, exclude: tuple[str, ...] = ()) -> dict:
+        model_fields = {}
+        for record_field in fields(self):
+            if not record_field.metadata.get('model_field', True) or record_field.name in exclude:
+                continue
+            value = getattr(self, record_field.name)
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', errors='replace')
+            model_fields[record_field.name] = value
+        return model_fields
@@ -0,0 +1,107 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+from logger.models import LogModel, LogRollup
+from logger.services.latency_sketch import LatencySketch
+
+BUCKET = timedelta(minutes=1)
+# minutes aggregated in memory at once
+WINDOW = timedelta(hours=1)
+
+_ROLLUP_FIELDS = (
+    'endpoint', 'proxy_method', 'proxy_response_status_code', 'proxy_request_size', 'proxy_response_size',
+    'upstream_duration_ms', 'total_duration_ms', 'created_at',
+)
+
+
+@dataclass(slots=True)
+class _Aggregate:
+    count: int = 0
+    status_counts: dict = field(default_factory=dict)
+    total_duration_sum_ms: float = 0.0
+    total_duration: LatencySketch = field(default_factory=LatencySketch)
+    upstream_duration: LatencySketch = field(default_factory=LatencySketch)
+    request_bytes: int = 0
+    response_bytes: int = 0
+
+    def add(self, status_code: Optional[int], request_size: Optional[int], response_size: Optional[int],
+            upstream_duration_ms: Optional[float], total_duration_ms: Optional[float]) -> None:
+        self.count += 1
+        status = str(status_code) if status_code is not None else 'unknown'
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        self.request_bytes += request_size or 0
+        self.response_bytes += response_size or 0
+        if total_duration_ms is not None:
+            self.total_duration_sum_ms += total_duration_ms
+            self.total_duration.add(total_duration_ms)
+        if upstream_duration_ms is not None:
+            self.upstream_duration.add(upstream_duration_ms)
+
+
+def floor_to_bucket(moment: datetime) -> datetime:
+    return moment.replace(second=0, microsecond=0)
+
+
+def next_rollup_start() -> Optional[datetime]:
+    """The minute after the last rolled up one, or the first logged minute when nothing is rolled up yet"""
+    last_bucket = LogRollup.objects.aggregate(last=Max('bucket'))['last']
+    if last_bucket is not None:
+        return last_bucket + BUCKET
+    first_log = LogModel.objects.aggregate(first=Min('created_at'))['first']
+    return floor_to_bucket(first_log) if first_log is not None else None
+
+
+def rollup_logs(since: datetime, until: datetime) -> int:
+    """
+    Aggregates logs of [since, until) into per-minute rollups and returns how many were saved.
+    Rollups of the range are recomputed from scratch, so running it twice over the same minutes is safe.
+    """
+    saved = 0
+    window_start = floor_to_bucket(since)
+    until = floor_to_bucket(until)
+    while window_start < until:
+        window_end = min(window_start + WINDOW, until)
+        saved += _rollup_window(window_start, window_end)
+        window_start = window_end
+    return saved
+
+
+def _rollup_window(since: datetime, until: datetime) -> int:
+    aggregates: dict[tuple, _Aggregate] = {}
+    rows = (
+        LogModel.objects
+        .filter(created_at__gte=since, created_at__lt=until)
+        .order_by()
+        .values_list(*_ROLLUP_FIELDS)
+        .iterator(chunk_size=2000)
+    )
+    for endpoint, method, status_code, request_size, response_size, upstream_ms, total_ms, created_at in rows:
+        key = (floor_to_bucket(created_at), endpoint or '', method or '')
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            aggregate = aggregates[key] = _Aggregate()
+        aggregate.add(status_code, request_size, response_size, upstream_ms, total_ms)
+
+    rollups = [
+        LogRollup(
+            bucket=bucket,
+            endpoint=endpoint,
+            method=method,
+            count=aggregate.count,
+            status_counts=aggregate.status_counts,
+            total_duration_sum_ms=aggregate.total_duration_sum_ms,
+            total_duration_sketch=aggregate.total_duration.to_dict(),
+            upstream_duration_sketch=aggregate.upstream_duration.to_dict(),
+            request_bytes=aggregate.request_bytes,
+            response_bytes=aggregate.response_bytes,
+        )
+        for (bucket, endpoint, method), aggregate in aggregates.items()
+    ]
+    with transaction.atomic():
+        LogRollup.objects.filter(bucket__gte=since, bucket__lt=until).delete()
+        LogRollup.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
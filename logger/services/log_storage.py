@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from logger.models import LogBody, LogModel
+from logger.services.log_bodies import body_digest, body_to_bytes, encode_body
+from logger.services.log_record import LogRecord
+
+BODY_FIELDS = ('proxy_request_body', 'core_request_body', 'core_response_body', 'proxy_response_body')
+
+
+class _KnownBodies:
+    """
+    Digests of bodies this process has already saved, with the time their last_seen_at was last set.
+    A known body is neither encoded nor written again until REFRESH_INTERVAL passed, then it is upserted like a new
+    one: that refreshes its last_seen_at, and saves it again if maintain_log_partitions deleted it meanwhile.
+    """
+
+    MAX_SIZE = 10000
+    REFRESH_INTERVAL = timedelta(hours=1)
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__digests: OrderedDict[str, datetime] = OrderedDict()
+
+    def seen_at(self, digest: str) -> Optional[datetime]:
+        with self.__lock:
+            seen_at = self.__digests.get(digest)
+            if seen_at is not None:
+                self.__digests.move_to_end(digest)
+            return seen_at
+
+    def remember(self, digests: Iterable[str], now: datetime) -> None:
+        with self.__lock:
+            for digest in digests:
+                self.__digests[digest] = now
+                self.__digests.move_to_end(digest)
+            while len(self.__digests) > self.MAX_SIZE:
+                self.__digests.popitem(last=False)
+
+
+_known_bodies = _KnownBodies()
+
+
+def save_logs(items: Iterable[Union[LogRecord, dict]]) -> int:
+    """
+    Saves log records, or fields of records spilled to disk, with their bodies moved into LogBody.
+    Returns the number of saved logs.
+    """
+    now = timezone.now()
+    new_bodies, logs = {}, []
+    for item in items:
+        if isinstance(item, LogRecord):
+            fields = item.as_model_fields(exclude=BODY_FIELDS)
+            bodies = {name: getattr(item, name) for name in BODY_FIELDS}
+        else:
+            fields = {name: value for name, value in item.items() if name not in BODY_FIELDS}
+            bodies = {name: item.get(name) for name in BODY_FIELDS}
+
+        for name, body in bodies.items():
+            fields[f'{name}_id'] = _add_body(body_to_bytes(body), now=now, new_bodies=new_bodies)
+        logs.append(LogModel(**fields))
+
+    with transaction.atomic():
+        if new_bodies:
+            LogBody.objects.bulk_create(
+                [LogBody(last_seen_at=now, **asdict(encoded)) for encoded in new_bodies.values()],
+                update_conflicts=True,
+                unique_fields=('digest',),
+                update_fields=('last_seen_at',),
+            )
+        LogModel.objects.bulk_create(logs)
+        # a rolled back batch must not mark its bodies as saved
+        transaction.on_commit(lambda: _known_bodies.remember(list(new_bodies), now=now))
+    return len(logs)
+
+
+def _add_body(body: Optional[bytes], now: datetime, new_bodies: dict) -> Optional[str]:
+    if body is None:
+        return None
+    digest = body_digest(body)
+    if digest in new_bodies:
+        return digest
+
+    seen_at = _known_bodies.seen_at(digest)
+    if seen_at is None or now - seen_at > _KnownBodies.REFRESH_INTERVAL:
+        new_bodies[digest] = encode_body(
+            body, digest=digest, max_size=settings.LOGGER_BODY_MAX_SIZE, compression=settings.LOGGER_BODY_COMPRESSION,
+        )
+    return digest
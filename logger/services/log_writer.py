@@ -0,0 +1,229 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+
+from common.metrics import Metrics
+from common.processes import is_process_alive
+from logger.services.log_record import LogRecord
+from logger.services.log_storage import save_logs
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriter:
+    """
+    Background writer of request logs.
+    Views only put their log records into a bounded in-process queue, a daemon thread converts them
+    to LogModel rows and saves them with bulk_create once a batch is full or the flush interval has passed.
+    """
+
+    OVERFLOW_DROP = 'drop'
+    OVERFLOW_BLOCK = 'block'
+    OVERFLOW_SPILL = 'spill'
+
+    __STOP = object()
+    __SPILL_FILE_PREFIX = 'log_spill'
+    __CLAIM_SEPARATOR = '.replaying.'
+    # seconds before spilled logs are replayed again after the database failed to save them
+    __REPLAY_RETRY_INTERVAL = 30.0
+
+    __instance: Optional['LogWriter'] = None
+    __instance_pid: Optional[int] = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.__queue = queue.Queue(maxsize=settings.LOGGER_QUEUE_SIZE)
+        self.__counters = {'queued': 0, 'flushed': 0, 'dropped': 0, 'spilled': 0, 'failed': 0}
+        self.__counters_lock = threading.Lock()
+        self.__spill_lock = threading.Lock()
+        self.__spill_dir = Path(settings.LOGGER_SPILL_DIR)
+        self.__replay_after = 0.0
+        self.__thread = threading.Thread(target=self.__run, name='log-writer', daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def get_instance(cls) -> 'LogWriter':
+        """Returns the writer of the current process, every forked worker starts its own writer thread"""
+        pid = os.getpid()
+        if cls.__instance is None or cls.__instance_pid != pid:
+            with cls.__instance_lock:
+                if cls.__instance is None or cls.__instance_pid != pid:
+                    cls.__instance = cls()
+                    cls.__instance_pid = pid
+        return cls.__instance
+
+    @property
+    def blocks_on_overflow(self) -> bool:
+        return settings.LOGGER_OVERFLOW_POLICY == self.OVERFLOW_BLOCK
+
+    def put(self, record: LogRecord) -> None:
+        try:
+            if self.blocks_on_overflow:
+                self.__queue.put(record, timeout=settings.LOGGER_BLOCK_TIMEOUT)
+            else:
+                self.__queue.put_nowait(record)
+        except queue.Full:
+            if settings.LOGGER_OVERFLOW_POLICY == self.OVERFLOW_SPILL:
+                self.__spill(record.as_model_fields())
+            else:
+                self.__increment('dropped')
+        else:
+            self.__increment('queued')
+
+    def stats(self) -> dict:
+        with self.__counters_lock:
+            counters = dict(self.__counters)
+        counters['pending'] = self.__queue.qsize()
+        return counters
+
+    def close(self) -> None:
+        """Flushes everything queued so far, called on graceful shutdown of the worker"""
+        if not self.__thread.is_alive():
+            return
+        try:
+            self.__queue.put(self.__STOP, timeout=settings.LOGGER_SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            return
+        self.__thread.join(timeout=settings.LOGGER_SHUTDOWN_TIMEOUT)
+
+    def __run(self) -> None:
+        batch = []
+        deadline = None
+        while True:
+            timeout = settings.LOGGER_FLUSH_INTERVAL if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self.__STOP:
+                self.__flush(batch)
+                self.__replay_spilled()
+                return
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + settings.LOGGER_FLUSH_INTERVAL
+
+            if batch and (len(batch) >= settings.LOGGER_BATCH_SIZE or time.monotonic() >= deadline):
+                self.__flush(batch)
+                batch, deadline = [], None
+
+            if not batch and self.__queue.empty():
+                self.__replay_spilled()
+
+    def __flush(self, batch: list[Union[LogRecord, dict]]) -> bool:
+        """Saves queued records and replayed spilled fields, returns whether they were saved"""
+        if not batch:
+            return True
+        close_old_connections()
+        try:
+            save_logs(batch)
+        except DatabaseError:
+            logger.exception('Failed to save %s request logs', len(batch))
+            self.__increment('failed', len(batch))
+            return False
+        else:
+            self.__increment('flushed', len(batch))
+            return True
+        finally:
+            close_old_connections()
+
+    def __spill(self, fields: dict) -> None:
+        path = self.__spill_dir / f'{self.__SPILL_FILE_PREFIX}.{os.getpid()}.jsonl'
+        line = json.dumps(fields, default=str)
+        try:
+            with self.__spill_lock:
+                self.__spill_dir.mkdir(parents=True, exist_ok=True)
+                with path.open('a', encoding='utf-8') as file:
+                    file.write(f'{line}\n')
+        except OSError:
+            logger.exception('Failed to spill a request log to %s', path)
+            self.__increment('dropped')
+        else:
+            self.__increment('spilled')
+
+    def __replay_spilled(self) -> None:
+        """
+        Saves logs spilled by this process or by dead workers, a file is claimed by renaming it first.
+        Claims left by a replay that failed or by a worker that died while replaying are taken over.
+        """
+        if not self.__spill_dir.is_dir() or time.monotonic() < self.__replay_after:
+            return
+        for path in self.__claimable_spill_files():
+            spill_name = path.name.partition(self.__CLAIM_SEPARATOR)[0]
+            claimed = path.with_name(f'{spill_name}{self.__CLAIM_SEPARATOR}{os.getpid()}')
+            if path != claimed:
+                try:
+                    with self.__spill_lock:
+                        if claimed.exists():
+                            continue
+                        path.rename(claimed)
+                except OSError:
+                    continue
+
+            if not self.__replay_file(claimed):
+                self.__replay_after = time.monotonic() + self.__REPLAY_RETRY_INTERVAL
+                return
+
+    def __claimable_spill_files(self) -> Iterator[Path]:
+        """Spill files and claims of this process or of dead workers, claims first so they are never overwritten"""
+        paths = sorted(
+            self.__spill_dir.glob(f'{self.__SPILL_FILE_PREFIX}.*'),
+            key=lambda path: self.__CLAIM_SEPARATOR not in path.name,
+        )
+        for path in paths:
+            spill_name, _, claimer = path.name.partition(self.__CLAIM_SEPARATOR)
+            if not spill_name.endswith('.jsonl'):
+                continue
+            try:
+                pid = int(claimer or spill_name.split('.')[1])
+            except (IndexError, ValueError):
+                continue
+            if pid == os.getpid() or not is_process_alive(pid):
+                yield path
+
+    def __replay_file(self, claimed: Path) -> bool:
+        """Saves the logs of a claimed file, the logs not saved are kept in it for the next replay"""
+        with claimed.open(encoding='utf-8') as file:
+            lines = [line for line in file if line.strip()]
+        for start in range(0, len(lines), settings.LOGGER_BATCH_SIZE):
+            batch = [json.loads(line) for line in lines[start:start + settings.LOGGER_BATCH_SIZE]]
+            if not self.__flush(batch):
+                self.__keep_unsaved(claimed, lines[start:])
+                return False
+        claimed.unlink()
+        return True
+
+    @staticmethod
+    def __keep_unsaved(claimed: Path, lines: list[str]) -> None:
+        """Replaces the claimed file atomically, so a crash while writing it does not lose the logs"""
+        unsaved = claimed.with_name(f'{claimed.name}.tmp')
+        try:
+            with unsaved.open('w', encoding='utf-8') as file:
+                file.writelines(lines)
+            os.replace(unsaved, claimed)
+        except OSError:
+            logger.exception('Failed to keep %s unsaved spilled request logs in %s', len(lines), claimed)
+
+    def __increment(self, name: str, value: int = 1) -> None:
+        with self.__counters_lock:
+            self.__counters[name] += value
+
+
+Metrics.register_collector(
+    prefix='proxy_log_writer',
+    snapshot=lambda: LogWriter.get_instance().stats() if settings.LOGGER_BACKGROUND_WRITES else {},
+    gauges=('pending',),
+)
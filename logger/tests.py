@@ -0,0 +1,249 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from logger.models import LogBody, LogModel
+from logger.services.log_policy import LEVEL_FULL, LEVEL_METADATA, LEVEL_NONE, LogPolicy
+from logger.services.log_record import LogRecord
+from logger.services.log_storage import _KnownBodies, save_logs
+from logger.services.log_writer import LogWriter
+
+
+class _StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Echoes the request back after a random delay, so concurrent requests overlap in the proxy"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        self.__reply()
+
+    def do_POST(self) -> None:
+        self.__reply()
+
+    def __reply(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        time.sleep(random.uniform(0, 0.02))
+        content = json.dumps({
+            'path': self.path,
+            'authorization': self.headers.get('Authorization'),
+            'body': body,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+class LoggerConcurrencyTests(TransactionTestCase):
+    """
+    Parallel requests through the proxy must each save a log row holding only their own fields.
+    Requests run in threads as in a threaded worker, their logs are saved by the background writer.
+    """
+
+    REQUESTS = 60
+    WORKERS = 16
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubUpstreamHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_parallel_requests_do_not_share_log_records(self) -> None:
+        with override_settings(
+            THIRD_PARTY_APP_URL=f'http://127.0.0.1:{self.server.server_port}',
+            APP_ID='app',
+            IS_NEED_LOGGER=True,
+            LOGGER_BACKGROUND_WRITES=True,
+            LOGGER_OVERFLOW_POLICY='block',
+            LOGGER_FLUSH_INTERVAL=0.05,
+            LOGGER_POLICY_DEFAULT_LEVEL='full',
+            LOGGER_POLICY_RULES=[],
+            PROXY_CACHE_ENABLED=False,
+            PROXY_SINGLE_FLIGHT_ENABLED=False,
+            PROXY_RATE_LIMIT_ENABLED=False,
+            PROXY_CONCURRENCY_LIMIT_ENABLED=False,
+        ):
+            flushed = LogWriter.get_instance().stats()['flushed']
+            with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+                statuses = list(executor.map(self.__send, range(1, self.REQUESTS + 1)))
+            self.__wait_for_writer(flushed=flushed + self.REQUESTS)
+
+        self.assertEqual(statuses, [200] * self.REQUESTS)
+        logs = LogModel.objects.select_related('proxy_request_body', 'core_response_body', 'proxy_response_body')
+        self.assertEqual(logs.count(), self.REQUESTS)
+        for log in logs:
+            number = log.proxy_request_headers['Authorization'].removeprefix('Bearer token-')
+            marker = f'/dialogues/{number}/'
+            with self.subTest(log=log.pk, number=number):
+                self.assertEqual(log.proxy_method, 'POST' if int(number) % 2 else 'GET')
+                self.assertIn(marker, log.proxy_url)
+                self.assertIn(marker, log.core_url)
+                self.assertEqual(log.core_request_headers['Authorization'], f'Bearer token-{number}')
+                response = json.loads(log.core_response_body.text)
+                self.assertEqual(response['authorization'], f'Bearer token-{number}')
+                self.assertIn(marker, response['path'])
+                self.assertEqual(log.proxy_response_body.text, log.core_response_body.text)
+                if log.proxy_method == 'POST':
+                    self.assertEqual(json.loads(log.proxy_request_body.text), {'number': int(number)})
+                else:
+                    self.assertIsNone(log.proxy_request_body)
+
+    @staticmethod
+    def __wait_for_writer(flushed: int, timeout: float = 10.0) -> None:
+        """The writer thread is the only one saving logs, as it is in a worker"""
+        deadline = time.monotonic() + timeout
+        while LogWriter.get_instance().stats()['flushed'] < flushed and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    @staticmethod
+    def __send(number: int) -> int:
+        client = Client(headers={'Authorization': f'Bearer token-{number}'})
+        url = f'/api/v0/dialogues/{number}/'
+        if number % 2:
+            response = client.post(url, data={'number': number}, content_type='application/json')
+        else:
+            response = client.get(url)
+        return response.status_code
+
+
+class LogPolicyTests(SimpleTestCase):
+    """Requests sampled out of a full rule are still logged, at metadata level"""
+
+    def test_sampled_out_requests_keep_their_metadata(self) -> None:
+        policy = LogPolicy(rules=[{'endpoint': 'bots', 'sample_rate': 0}], default_level=LEVEL_FULL)
+        sampled_out = LogPolicy.stats.snapshot()['sampled_out']
+        self.assertEqual(policy.decide(self.__record('api/v0/bots/')), LEVEL_METADATA)
+        self.assertEqual(LogPolicy.stats.snapshot()['sampled_out'], sampled_out + 1)
+
+    def test_sampled_in_requests_are_logged_in_full(self) -> None:
+        policy = LogPolicy(rules=[{'endpoint': 'bots', 'sample_rate': 1}], default_level=LEVEL_NONE)
+        self.assertEqual(policy.decide(self.__record('api/v0/bots/<int:bot_id>/')), LEVEL_FULL)
+        self.assertEqual(policy.decide(self.__record('api/v0/dialogues/')), LEVEL_NONE)
+
+    def test_none_rules_are_not_sampled(self) -> None:
+        policy = LogPolicy(rules=[{'endpoint': 'bots', 'level': 'none', 'sample_rate': 0}], default_level=LEVEL_FULL)
+        self.assertEqual(policy.decide(self.__record('api/v0/bots/')), LEVEL_NONE)
+
+    @staticmethod
+    def __record(endpoint: str) -> LogRecord:
+        return LogRecord(proxy_method='GET', endpoint=endpoint, proxy_response_status_code=200)
+
+
+class SaveLogsTests(TestCase):
+    """Bodies this process already saved are upserted again once REFRESH_INTERVAL passed"""
+
+    def test_refresh_saves_a_body_deleted_meanwhile(self) -> None:
+        body = json.dumps({'message': str(uuid.uuid4())})
+        self.__save(body, now=timezone.now())
+        digest = LogModel.objects.get().proxy_request_body_id
+        LogBody.objects.filter(digest=digest).delete()
+
+        later = timezone.now() + _KnownBodies.REFRESH_INTERVAL * 2
+        self.__save(body, now=later)
+        self.assertEqual(LogBody.objects.get(digest=digest).last_seen_at, later)
+
+    def test_known_body_is_not_written_again_within_the_interval(self) -> None:
+        body = json.dumps({'message': str(uuid.uuid4())})
+        now = timezone.now()
+        self.__save(body, now=now)
+        digest = LogModel.objects.get().proxy_request_body_id
+
+        self.__save(body, now=now + _KnownBodies.REFRESH_INTERVAL / 2)
+        self.assertEqual(LogBody.objects.get(digest=digest).last_seen_at, now)
+        self.assertEqual(LogModel.objects.filter(proxy_request_body_id=digest).count(), 2)
+
+    def __save(self, body: str, now: datetime) -> None:
+        with mock.patch('logger.services.log_storage.timezone.now', return_value=now):
+            with self.captureOnCommitCallbacks(execute=True):
+                save_logs([{'proxy_method': 'POST', 'proxy_request_body': body}])
+
+
+class LogWriterSpillTests(SimpleTestCase):
+    """Spilled logs are only removed once they were saved, claims of dead workers are replayed"""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spill_dir = Path(directory.name)
+        settings_override = override_settings(LOGGER_SPILL_DIR=self.spill_dir, LOGGER_FLUSH_INTERVAL=0.02,
+                                              LOGGER_BATCH_SIZE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.saved = []
+
+    def test_keeps_the_logs_the_database_failed_to_save(self) -> None:
+        spilled = self.__spill(f'log_spill.{self.__dead_pid()}.jsonl', count=3)
+
+        def save_logs(batch: list) -> None:
+            if self.saved:
+                raise DatabaseError('database is locked')
+            self.saved.extend(batch)
+
+        claimed = self.spill_dir / f'{spilled.name}.replaying.{os.getpid()}'
+        with self.assertLogs('logger.services.log_writer', level='ERROR'):
+            self.__start_writer(save_logs)
+            self.__wait_for(lambda: claimed.exists() and len(claimed.read_text().splitlines()) == 1)
+        self.assertEqual([fields['number'] for fields in self.saved], [0, 1])
+        self.assertFalse(spilled.exists())
+
+    def test_replays_claims_of_dead_workers(self) -> None:
+        claim = self.__spill(f'log_spill.{self.__dead_pid()}.jsonl.replaying.{self.__dead_pid()}', count=3)
+        self.__start_writer(self.saved.extend)
+        self.__wait_for(lambda: len(self.saved) == 3)
+        self.__wait_for(lambda: not list(self.spill_dir.iterdir()))
+        self.assertFalse(claim.exists())
+
+    def __start_writer(self, save_logs: Callable[[list], None]) -> None:
+        patcher = mock.patch('logger.services.log_writer.save_logs', side_effect=save_logs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        writer = LogWriter()
+        self.addCleanup(writer.close)
+
+    def __spill(self, name: str, count: int) -> Path:
+        path = self.spill_dir / name
+        path.write_text(''.join(f'{json.dumps({"number": number})}\n' for number in range(count)))
+        return path
+
+    @staticmethod
+    def __dead_pid() -> int:
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    @staticmethod
+    def __wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise AssertionError('Timed out waiting for the log writer')
+            time.sleep(0.02)
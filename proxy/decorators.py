@@ -1,19 +1,118 @@
-from typing import Any, Callable
+import asyncio
+from typing import Any, Callable, Optional
 
+import requests
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.http import parse_etags
 from requests.exceptions import JSONDecodeError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
 
+from common.compression import encode_for_client
+from common.metrics import stage_timer
+from common.responses import response_etag
+
+_JSON_CONTENT_TYPES = ('application/json', 'application/problem+json',)
+# headers a 304 keeps from the response it stands for (RFC 9110, 15.4.5)
+_NOT_MODIFIED_HEADERS = ('cache-control', 'content-location', 'date', 'etag', 'expires', 'vary',)
+
 
 def handle_json_decode_error(request: Callable) -> Any:
+    if asyncio.iscoroutinefunction(request):
+        async def _async_wrapped_view(*args: Any, **kwargs: dict) -> Response:
+            response = await request(*args, **kwargs)
+            if isinstance(response, HttpResponseBase):
+                return response
+            with stage_timer('decorator'):
+                client_request = _find_request(args, kwargs)
+                not_modified = _check_not_modified(client_request, response)
+                if not_modified is not None:
+                    return not_modified
+                if _can_pass_through(response):
+                    return _pass_through(client_request, response)
+                return _render_without_api_view(_to_drf_response(response))
+
+        return _async_wrapped_view
+
     def _wrapped_view(*args: Any, **kwargs: dict) -> Response:
         response = request(*args, **kwargs)
-        try:
-            if response.content:
-                data = response.json()
-                return Response(data=data, status=response.status_code, headers=response.headers)
-            else:
-                return Response(status=response.status_code, headers=response.headers)
-        except JSONDecodeError:
-            return Response(data=response.text, status=response.status_code, headers=response.headers)
+        if isinstance(response, HttpResponseBase):
+            return response
+        with stage_timer('decorator'):
+            client_request = _find_request(args, kwargs)
+            not_modified = _check_not_modified(client_request, response)
+            if not_modified is not None:
+                return not_modified
+            if _can_pass_through(response):
+                return _pass_through(client_request, response)
+            return _to_drf_response(response)
 
     return _wrapped_view
+
+
+def _find_request(args: tuple, kwargs: dict) -> Optional[HttpRequest]:
+    """Views pass the request positionally after self, or as the request keyword"""
+    request = kwargs.get('request')
+    if request is None:
+        request = next((arg for arg in args if isinstance(arg, (Request, HttpRequest))), None)
+    return request
+
+
+def _check_not_modified(request: Optional[HttpRequest], response: requests.Response) -> Optional[HttpResponse]:
+    """
+    Sets the ETag of a successful GET response, returns a bodiless 304 when the client already has that body.
+    If-None-Match is compared weakly, as RFC 9110 requires.
+    """
+    if not settings.PROXY_ETAGS_ENABLED or request is None or request.method != 'GET' or response.status_code != 200:
+        return None
+    etag = response.headers['ETag'] = response_etag(response)
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return None
+    etags = parse_etags(if_none_match)
+    if etags != ['*'] and _weak(etag) not in {_weak(candidate) for candidate in etags}:
+        return None
+    headers = {name: value for name, value in response.headers.items() if name.lower() in _NOT_MODIFIED_HEADERS}
+    return HttpResponse(status=304, headers=headers)
+
+
+def _weak(etag: str) -> str:
+    return etag.removeprefix('W/')
+
+
+def _can_pass_through(response: requests.Response) -> bool:
+    """JSON bodies are already in the shape DRF would render, so only other bodies go through the DRF Response"""
+    if not settings.PROXY_PASSTHROUGH_RESPONSES:
+        return False
+    content_type = response.headers.get('Content-Type', '')
+    return not response.content or content_type.split(';', 1)[0].strip().lower() in _JSON_CONTENT_TYPES
+
+
+def _pass_through(request: Optional[HttpRequest], response: requests.Response) -> HttpResponse:
+    """Returns the upstream bytes as they are, without decoding and re-encoding them, compressed when possible"""
+    if request is None:
+        return HttpResponse(content=response.content, status=response.status_code, headers=response.headers)
+    content, headers = encode_for_client(request=request, response=response)
+    return HttpResponse(content=content, status=response.status_code, headers=headers)
+
+
+def _to_drf_response(response: requests.Response) -> Response:
+    try:
+        if response.content:
+            data = response.json()
+            return Response(data=data, status=response.status_code, headers=response.headers)
+        else:
+            return Response(status=response.status_code, headers=response.headers)
+    except JSONDecodeError:
+        return Response(data=response.text, status=response.status_code, headers=response.headers)
+
+
+def _render_without_api_view(response: Response) -> Response:
+    """Async views are not APIViews, so the renderer APIView.finalize_response would pick is set here"""
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = JSONRenderer.media_type
+    response.renderer_context = {}
+    return response
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
+import tempfile
 from pathlib import Path
 
 import environ
@@ -23,11 +24,64 @@ env = environ.Env(
     # Yadro
     APP_ID=str,
     THIRD_PARTY_APP_URL=str,
+    UPSTREAM_POOL_CONNECTIONS=(int, 10),
+    UPSTREAM_POOL_MAXSIZE=(int, 10),
+    UPSTREAM_POOL_BLOCK=(bool, True),
+    UPSTREAM_POOL_TIMEOUT=(float, 3.0),
+    UPSTREAM_KEEP_ALIVE_TIMEOUT=(float, 30.0),
+    UPSTREAM_ASYNC_MAX_CONNECTIONS=(int, 500),
+    UPSTREAM_CONNECT_TIMEOUT=(float, 3.05),
+    UPSTREAM_READ_TIMEOUT=(float, 30.0),
+    UPSTREAM_BREAKER_FAILURE_THRESHOLD=(int, 5),
+    UPSTREAM_BREAKER_RESET_TIMEOUT=(float, 30.0),
+    UPSTREAM_MAX_RETRIES=(int, 2),
+    UPSTREAM_RETRY_BUDGET_RATIO=(float, 0.1),
+    UPSTREAM_RETRY_MIN_PER_SECOND=(float, 1.0),
+    UPSTREAM_RETRY_BACKOFF=(float, 0.05),
+    UPSTREAM_HEDGE_ENABLED=(bool, False),
+    UPSTREAM_HEDGE_PERCENTILE=(float, 95.0),
+    UPSTREAM_HEDGE_MIN_DELAY=(float, 0.05),
+    UPSTREAM_HEDGE_MAX_RATE=(float, 0.05),
+    PROXY_RATE_LIMIT_ENABLED=(bool, True),
+    PROXY_UPSTREAM_RATE_LIMIT=(str, ''),
+    PROXY_UPSTREAM_QUEUE_TIMEOUT=(float, 0.5),
+    PROXY_TRUSTED_PROXY_COUNT=(int, 0),
+    PROXY_CONCURRENCY_LIMIT_ENABLED=(bool, True),
+    PROXY_CONCURRENCY_INITIAL_LIMIT=(int, 20),
+    PROXY_CONCURRENCY_MIN_LIMIT=(int, 4),
+    PROXY_CONCURRENCY_MAX_LIMIT=(int, 200),
+    PROXY_CONCURRENCY_BACKOFF_RATIO=(float, 0.9),
+    PROXY_CONCURRENCY_LATENCY_TOLERANCE=(float, 2.0),
+    PROXY_CONCURRENCY_RETRY_AFTER=(float, 1.0),
+    PROXY_ASYNC_VIEWS=(bool, False),
+    PROXY_STREAMING_ENABLED=(bool, True),
+    PROXY_METRICS_DIR=(str, None),
+    PROXY_METRICS_ALLOWED_IPS=(tuple, ('127.0.0.1', '::1')),
+    PROXY_METRICS_TOKEN=(str, None),
+    PROXY_METRICS_DUMP_INTERVAL=(float, 5.0),
 
     # Redis
     REDIS_HOST=str,
     REDIS_PORT=int,
     CACHE_DEFAULT_TTL=int,
+    PROXY_USER_STATUS_CACHE_TTL=(int, 5),
+    PROXY_CACHE_ENABLED=(bool, True),
+    PROXY_PASSTHROUGH_RESPONSES=(bool, True),
+    PROXY_ETAGS_ENABLED=(bool, True),
+    UPSTREAM_CONDITIONAL_REQUESTS=(bool, False),
+    PROXY_COMPRESSION_ENABLED=(bool, True),
+    PROXY_COMPRESSION_ENCODINGS=(tuple, ('gzip',)),
+    PROXY_COMPRESSION_MIN_SIZE=(int, 1024),
+    PROXY_COMPRESSION_GZIP_LEVEL=(int, 6),
+    PROXY_COMPRESSION_BROTLI_QUALITY=(int, 5),
+    BOT_CATALOG_ENABLED=(bool, True),
+    BOT_CATALOG_TTL=(int, 300),
+    BOT_CATALOG_MAX_STALE=(int, 86400),
+    BOT_CATALOG_AUTH_TTL=(int, 60),
+    PROXY_SINGLE_FLIGHT_ENABLED=(bool, True),
+    PROXY_SINGLE_FLIGHT_DISTRIBUTED=(bool, False),
+    PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT=(float, 5.0),
+    PROXY_SINGLE_FLIGHT_POLL_INTERVAL=(float, 0.05),
 
     # Postgres
     POSTGRES_DB=str,
@@ -38,6 +92,20 @@ env = environ.Env(
 
     # Logging
     IS_NEED_LOGGER=bool,
+    LOGGER_BACKGROUND_WRITES=(bool, True),
+    LOGGER_QUEUE_SIZE=(int, 10000),
+    LOGGER_BATCH_SIZE=(int, 200),
+    LOGGER_FLUSH_INTERVAL=(float, 1.0),
+    LOGGER_OVERFLOW_POLICY=(str, 'drop'),
+    LOGGER_BLOCK_TIMEOUT=(float, 0.5),
+    LOGGER_SHUTDOWN_TIMEOUT=(float, 10.0),
+    LOGGER_SPILL_DIR=(str, None),
+    LOGGER_STREAM_PREFIX_SIZE=(int, 65536),
+    LOGGER_BODY_MAX_SIZE=(int, 65536),
+    LOGGER_BODY_COMPRESSION=(str, 'zlib'),
+    LOGGER_RETENTION_DAYS=(int, 30),
+    LOGGER_PARTITIONS_AHEAD=(int, 3),
+    LOGGER_POLICY_DEFAULT_LEVEL=(str, 'full'),
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -86,6 +154,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.middleware.metrics_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -135,6 +204,51 @@ INTERNAL_IPS = [
 APP_ID = env('APP_ID')
 THIRD_PARTY_APP_URL = env('THIRD_PARTY_APP_URL')
 
+# Upstream connection pool
+# Number of per-host pools kept alive
+UPSTREAM_POOL_CONNECTIONS = env('UPSTREAM_POOL_CONNECTIONS')
+# Max connections per host, requests beyond it wait for a free connection when UPSTREAM_POOL_BLOCK is set.
+# A request waits at most UPSTREAM_POOL_TIMEOUT seconds (also on the async path), then gets 503 with Retry-After
+UPSTREAM_POOL_MAXSIZE = env('UPSTREAM_POOL_MAXSIZE')
+UPSTREAM_POOL_BLOCK = env('UPSTREAM_POOL_BLOCK')
+UPSTREAM_POOL_TIMEOUT = env('UPSTREAM_POOL_TIMEOUT')
+# Seconds an idle keep-alive connection may be reused for
+UPSTREAM_KEEP_ALIVE_TIMEOUT = env('UPSTREAM_KEEP_ALIVE_TIMEOUT')
+# Max concurrent upstream connections of one event loop on the async path
+UPSTREAM_ASYNC_MAX_CONNECTIONS = env('UPSTREAM_ASYNC_MAX_CONNECTIONS')
+# Connect and read timeouts of Yadro calls in seconds, per endpoint pattern (ids are replaced by <id>) in
+# UPSTREAM_TIMEOUTS. A timed out call is answered with 504. The read timeout of a stream bounds the gap between chunks
+UPSTREAM_CONNECT_TIMEOUT = env('UPSTREAM_CONNECT_TIMEOUT')
+UPSTREAM_READ_TIMEOUT = env('UPSTREAM_READ_TIMEOUT')
+UPSTREAM_TIMEOUTS = {
+    # a message is answered once the bot has generated its reply
+    'dialogues/<id>': (UPSTREAM_CONNECT_TIMEOUT, 120.0),
+}
+# After UPSTREAM_BREAKER_FAILURE_THRESHOLD consecutive failed calls (connection errors, timeouts, 502/503/504) of an
+# endpoint group (bots, dialogues, users) the worker answers its requests with 503 for UPSTREAM_BREAKER_RESET_TIMEOUT
+# seconds, then lets a single call through to check whether Yadro is back
+UPSTREAM_BREAKER_FAILURE_THRESHOLD = env('UPSTREAM_BREAKER_FAILURE_THRESHOLD')
+UPSTREAM_BREAKER_RESET_TIMEOUT = env('UPSTREAM_BREAKER_RESET_TIMEOUT')
+# Failed calls of idempotent methods are retried up to UPSTREAM_MAX_RETRIES times after a jittered exponential
+# backoff starting at UPSTREAM_RETRY_BACKOFF seconds, PUT and DELETE only when the connection failed, never after
+# a read timeout or a failure status. Retries of an endpoint group are limited to UPSTREAM_RETRY_BUDGET_RATIO of its
+# requests plus UPSTREAM_RETRY_MIN_PER_SECOND
+UPSTREAM_MAX_RETRIES = env('UPSTREAM_MAX_RETRIES')
+UPSTREAM_RETRY_BUDGET_RATIO = env('UPSTREAM_RETRY_BUDGET_RATIO')
+UPSTREAM_RETRY_MIN_PER_SECOND = env('UPSTREAM_RETRY_MIN_PER_SECOND')
+UPSTREAM_RETRY_BACKOFF = env('UPSTREAM_RETRY_BACKOFF')
+# Async proxy path only: a GET of UPSTREAM_HEDGE_ENDPOINTS not answered within the UPSTREAM_HEDGE_PERCENTILE latency
+# of its endpoint (at least UPSTREAM_HEDGE_MIN_DELAY seconds) is sent a second time, the first response wins.
+# Hedges are limited to UPSTREAM_HEDGE_MAX_RATE of these requests
+UPSTREAM_HEDGE_ENABLED = env('UPSTREAM_HEDGE_ENABLED')
+UPSTREAM_HEDGE_PERCENTILE = env('UPSTREAM_HEDGE_PERCENTILE')
+UPSTREAM_HEDGE_MIN_DELAY = env('UPSTREAM_HEDGE_MIN_DELAY')
+UPSTREAM_HEDGE_MAX_RATE = env('UPSTREAM_HEDGE_MAX_RATE')
+UPSTREAM_HEDGE_ENDPOINTS = ('bots/<id>', 'dialogues/<id>',)
+
+# Serve the proxy routes with async views, enable when running under ASGI (proxy.asgi)
+PROXY_ASYNC_VIEWS = env('PROXY_ASYNC_VIEWS')
+
 # Redis
 REDIS_HOST = env('REDIS_HOST')
 REDIS_PORT = env('REDIS_PORT')
@@ -148,6 +262,109 @@ CACHES = {
     }
 }
 
+# Prometheus metrics on /metrics, every worker dumps its totals to PROXY_METRICS_DIR each
+# PROXY_METRICS_DUMP_INTERVAL seconds and /metrics sums the dumps of all live workers.
+# /metrics answers scrapers from PROXY_METRICS_ALLOWED_IPS (addresses or networks) and,
+# when PROXY_METRICS_TOKEN is set, scrapers sending it as 'Authorization: Bearer <token>'
+PROXY_METRICS_DIR = env('PROXY_METRICS_DIR') or Path(tempfile.gettempdir()) / 'proxy-metrics'
+PROXY_METRICS_DUMP_INTERVAL = env('PROXY_METRICS_DUMP_INTERVAL')
+PROXY_METRICS_ALLOWED_IPS = env('PROXY_METRICS_ALLOWED_IPS')
+PROXY_METRICS_TOKEN = env('PROXY_METRICS_TOKEN')
+
+# Admission control of calls to Yadro. A client (hash of its Authorization header, address when anonymous) may call
+# an endpoint group, or an endpoint pattern listed on its own, at the rate of PROXY_RATE_LIMITS ('<count>/<s|min|h|d>')
+# and gets 429 beyond it. PROXY_UPSTREAM_RATE_LIMIT limits all calls of all workers to Yadro, a call over it waits
+# up to PROXY_UPSTREAM_QUEUE_TIMEOUT seconds for its turn, then the request gets 503
+PROXY_RATE_LIMIT_ENABLED = env('PROXY_RATE_LIMIT_ENABLED')
+PROXY_RATE_LIMITS = {
+    'users/login': '10/min',
+    'users': '30/min',
+    'dialogues': '120/min',
+    'bots': '120/min',
+}
+PROXY_UPSTREAM_RATE_LIMIT = env('PROXY_UPSTREAM_RATE_LIMIT')
+PROXY_UPSTREAM_QUEUE_TIMEOUT = env('PROXY_UPSTREAM_QUEUE_TIMEOUT')
+# Reverse proxies in front of the proxy (e.g. 1 for nginx) that append the address they got a request from to
+# X-Forwarded-For. Anonymous clients are rate limited by that address instead of REMOTE_ADDR, 0 trusts no header
+PROXY_TRUSTED_PROXY_COUNT = env('PROXY_TRUSTED_PROXY_COUNT')
+
+# Adaptive limit of the upstream calls in flight per worker, between PROXY_CONCURRENCY_MIN_LIMIT and
+# PROXY_CONCURRENCY_MAX_LIMIT. It grows while calls are answered in time and shrinks by PROXY_CONCURRENCY_BACKOFF_RATIO
+# on failed calls and calls slower than PROXY_CONCURRENCY_LATENCY_TOLERANCE times the usual latency of their endpoint.
+# Requests over the limit get 503 with Retry-After of PROXY_CONCURRENCY_RETRY_AFTER seconds.
+# Requests of an endpoint pattern ('<METHOD> <pattern>' or '<pattern>') may use the share of the limit of their priority
+PROXY_CONCURRENCY_LIMIT_ENABLED = env('PROXY_CONCURRENCY_LIMIT_ENABLED')
+PROXY_CONCURRENCY_INITIAL_LIMIT = env('PROXY_CONCURRENCY_INITIAL_LIMIT')
+PROXY_CONCURRENCY_MIN_LIMIT = env('PROXY_CONCURRENCY_MIN_LIMIT')
+PROXY_CONCURRENCY_MAX_LIMIT = env('PROXY_CONCURRENCY_MAX_LIMIT')
+PROXY_CONCURRENCY_BACKOFF_RATIO = env('PROXY_CONCURRENCY_BACKOFF_RATIO')
+PROXY_CONCURRENCY_LATENCY_TOLERANCE = env('PROXY_CONCURRENCY_LATENCY_TOLERANCE')
+PROXY_CONCURRENCY_RETRY_AFTER = env('PROXY_CONCURRENCY_RETRY_AFTER')
+PROXY_CONCURRENCY_PRIORITIES = {
+    'users/login': 'high',
+    'users/logout': 'high',
+    'GET dialogues': 'low',
+}
+PROXY_CONCURRENCY_PRIORITY_SHARES = {
+    'high': 1.0,
+    'normal': 0.8,
+    'low': 0.5,
+}
+
+# Relay chunked and text/event-stream dialogue responses to the client as they arrive
+PROXY_STREAMING_ENABLED = env('PROXY_STREAMING_ENABLED')
+
+# Return upstream JSON bodies to the client as they are instead of parsing and rendering them with DRF again
+PROXY_PASSTHROUGH_RESPONSES = env('PROXY_PASSTHROUGH_RESPONSES')
+
+# Successful GET responses carry an ETag, the one Yadro sent or a hash of the body, and requests with a matching
+# If-None-Match get a bodiless 304. With UPSTREAM_CONDITIONAL_REQUESTS, for a Yadro that sends ETags itself,
+# If-None-Match and If-Modified-Since of GETs are also forwarded, so Yadro may skip sending the body as well
+PROXY_ETAGS_ENABLED = env('PROXY_ETAGS_ENABLED')
+UPSTREAM_CONDITIONAL_REQUESTS = env('UPSTREAM_CONDITIONAL_REQUESTS')
+
+# Yadro is asked for compressed bodies, which are relayed as they are to clients accepting their encoding.
+# Other JSON bodies of at least PROXY_COMPRESSION_MIN_SIZE bytes are compressed once with the first encoding of
+# PROXY_COMPRESSION_ENCODINGS (gzip, br with the brotli package) the client accepts. Cached bodies are stored compressed
+PROXY_COMPRESSION_ENABLED = env('PROXY_COMPRESSION_ENABLED')
+PROXY_COMPRESSION_ENCODINGS = env('PROXY_COMPRESSION_ENCODINGS')
+PROXY_COMPRESSION_MIN_SIZE = env('PROXY_COMPRESSION_MIN_SIZE')
+PROXY_COMPRESSION_GZIP_LEVEL = env('PROXY_COMPRESSION_GZIP_LEVEL')
+PROXY_COMPRESSION_BROTLI_QUALITY = env('PROXY_COMPRESSION_BROTLI_QUALITY')
+
+# Response cache of GET proxy routes
+PROXY_CACHE_ENABLED = env('PROXY_CACHE_ENABLED')
+# TTL in seconds per endpoint pattern (ids are replaced by <id>), endpoints not listed here are never cached.
+# Mutations of an endpoint invalidate the client's cached responses of the endpoint and of its parent
+PROXY_CACHE_TTLS = {
+    'bots/<id>': CACHE_DEFAULT_TTL,
+    'dialogues': CACHE_DEFAULT_TTL,
+    'dialogues/<id>': CACHE_DEFAULT_TTL,
+    'users/email-verification/check': env('PROXY_USER_STATUS_CACHE_TTL'),
+}
+# Endpoints whose cached responses of the client are also invalidated by any successful request to the pattern,
+# so a client polling its verification status sees the change as soon as it logs out or verifies the email
+PROXY_CACHE_INVALIDATES = {
+    'users/logout': ('users/email-verification/check',),
+    'users/email-verification/verify': ('users/email-verification/check',),
+}
+
+# The bot list and the bot details are served from the in-memory bot catalog, refreshed by the next request once
+# older than BOT_CATALOG_TTL seconds and not served at all once older than BOT_CATALOG_MAX_STALE seconds.
+# It is only served to clients whose token Yadro accepted for a bots call in the last BOT_CATALOG_AUTH_TTL seconds
+BOT_CATALOG_ENABLED = env('BOT_CATALOG_ENABLED')
+BOT_CATALOG_TTL = env('BOT_CATALOG_TTL')
+BOT_CATALOG_MAX_STALE = env('BOT_CATALOG_MAX_STALE')
+BOT_CATALOG_AUTH_TTL = env('BOT_CATALOG_AUTH_TTL')
+
+# Concurrent identical GETs of a client share one upstream call within the worker.
+# With PROXY_SINGLE_FLIGHT_DISTRIBUTED workers also wait for each other through a Redis lock held up to
+# PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT seconds, polling the response cache every PROXY_SINGLE_FLIGHT_POLL_INTERVAL
+PROXY_SINGLE_FLIGHT_ENABLED = env('PROXY_SINGLE_FLIGHT_ENABLED')
+PROXY_SINGLE_FLIGHT_DISTRIBUTED = env('PROXY_SINGLE_FLIGHT_DISTRIBUTED')
+PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT = env('PROXY_SINGLE_FLIGHT_LOCK_TIMEOUT')
+PROXY_SINGLE_FLIGHT_POLL_INTERVAL = env('PROXY_SINGLE_FLIGHT_POLL_INTERVAL')
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -199,6 +416,39 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Logging
 IS_NEED_LOGGER = env('IS_NEED_LOGGER')
+# Save logs from a background thread in batches instead of inside the request
+LOGGER_BACKGROUND_WRITES = env('LOGGER_BACKGROUND_WRITES')
+LOGGER_QUEUE_SIZE = env('LOGGER_QUEUE_SIZE')
+# A batch is saved when it reaches LOGGER_BATCH_SIZE logs or LOGGER_FLUSH_INTERVAL seconds after its first log
+LOGGER_BATCH_SIZE = env('LOGGER_BATCH_SIZE')
+LOGGER_FLUSH_INTERVAL = env('LOGGER_FLUSH_INTERVAL')
+# What to do with a log when the queue is full: drop, block (for LOGGER_BLOCK_TIMEOUT seconds, then drop)
+# or spill (append to a file in LOGGER_SPILL_DIR, saved later when the queue is idle)
+LOGGER_OVERFLOW_POLICY = env('LOGGER_OVERFLOW_POLICY')
+LOGGER_BLOCK_TIMEOUT = env('LOGGER_BLOCK_TIMEOUT')
+LOGGER_SHUTDOWN_TIMEOUT = env('LOGGER_SHUTDOWN_TIMEOUT')
+LOGGER_SPILL_DIR = env('LOGGER_SPILL_DIR') or Path(tempfile.gettempdir()) / 'proxy-log-spill'
+# Only the first bytes of a streamed response body are logged, together with its total size
+LOGGER_STREAM_PREFIX_SIZE = env('LOGGER_STREAM_PREFIX_SIZE')
+# Logged bodies are cut to LOGGER_BODY_MAX_SIZE bytes and compressed with zlib, zstd (needs the zstandard
+# package) or not at all (empty). Identical bodies are stored once
+LOGGER_BODY_MAX_SIZE = env('LOGGER_BODY_MAX_SIZE')
+LOGGER_BODY_COMPRESSION = env('LOGGER_BODY_COMPRESSION')
+# Used by the maintain_log_partitions command: logs older than LOGGER_RETENTION_DAYS days are dropped and on
+# PostgreSQL daily partitions are created LOGGER_PARTITIONS_AHEAD days in advance
+LOGGER_RETENTION_DAYS = env('LOGGER_RETENTION_DAYS')
+LOGGER_PARTITIONS_AHEAD = env('LOGGER_PARTITIONS_AHEAD')
+# What is logged per request: full, metadata (no headers and bodies) or none. The first rule matching the endpoint
+# (as in PROXY_CACHE_TTLS, 'bots' also matches 'bots/<id>'), methods and status ('5xx', '400-499', 404) of the
+# request wins, with sample_rate only that share of the matching requests is logged in full, the rest at metadata
+# level, so the log rollups still count every request.
+# Requests no rule matches are logged at LOGGER_POLICY_DEFAULT_LEVEL
+LOGGER_POLICY_DEFAULT_LEVEL = env('LOGGER_POLICY_DEFAULT_LEVEL')
+LOGGER_POLICY_RULES = [
+    {'status': '5xx', 'level': 'full'},
+    {'endpoint': 'users/login', 'level': 'metadata'},
+    {'endpoint': 'bots', 'methods': ('GET',), 'status': '2xx', 'level': 'full', 'sample_rate': 0.01},
+]
 
 SITE_ID = 1
 
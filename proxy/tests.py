@@ -0,0 +1,62 @@
+from typing import Optional
+
+import requests
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from common.responses import build_response
+from proxy.decorators import _check_not_modified
+
+
+@override_settings(PROXY_ETAGS_ENABLED=True)
+class CheckNotModifiedTests(SimpleTestCase):
+    """If-None-Match is compared weakly, so a client revalidating a gzip body (weak ETag) still gets 304"""
+
+    ETAG = '"abc"'
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+
+    def test_matching_strong_etag(self) -> None:
+        not_modified = self.__check(if_none_match=self.ETAG)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers['ETag'], self.ETAG)
+        self.assertEqual(not_modified.headers['Cache-Control'], 'private, max-age=60')
+        self.assertEqual(not_modified.content, b'')
+
+    def test_weak_etag_matches_strong_etag(self) -> None:
+        self.assertEqual(self.__check(if_none_match=f'W/{self.ETAG}').status_code, 304)
+
+    def test_strong_etag_matches_weak_etag(self) -> None:
+        self.assertEqual(self.__check(if_none_match=self.ETAG, etag=f'W/{self.ETAG}').status_code, 304)
+
+    def test_any_of_several_etags(self) -> None:
+        self.assertEqual(self.__check(if_none_match=f'"other", W/{self.ETAG}').status_code, 304)
+
+    def test_wildcard(self) -> None:
+        self.assertEqual(self.__check(if_none_match='*').status_code, 304)
+
+    def test_other_etag_gets_the_body(self) -> None:
+        self.assertIsNone(self.__check(if_none_match='"other"'))
+        self.assertIsNone(self.__check(if_none_match='W/"abcd"'))
+
+    def test_only_successful_gets(self) -> None:
+        self.assertIsNone(self.__check(if_none_match=self.ETAG, status_code=404))
+        self.assertIsNone(self.__check(if_none_match=self.ETAG, method='post'))
+
+    def test_sets_an_etag_of_the_body_without_if_none_match(self) -> None:
+        response = self.__response(etag=None)
+        self.assertIsNone(_check_not_modified(self.factory.get('/api/v0/dialogues/'), response))
+        self.assertRegex(response.headers['ETag'], r'^"[0-9a-f]{32}"$')
+
+    def __check(self, if_none_match: str, etag: str = ETAG, status_code: int = 200,
+                method: str = 'get') -> Optional[HttpResponse]:
+        request = getattr(self.factory, method)('/api/v0/dialogues/', HTTP_IF_NONE_MATCH=if_none_match)
+        return _check_not_modified(request, self.__response(etag=etag, status_code=status_code))
+
+    @staticmethod
+    def __response(etag: Optional[str], status_code: int = 200) -> requests.Response:
+        headers = {'Content-Type': 'application/json', 'Cache-Control': 'private, max-age=60'}
+        if etag:
+            headers['ETag'] = etag
+        return build_response(status_code=status_code, headers=headers, content=b'{"result": []}', request=None)
@@ -20,6 +20,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from proxy.views import MetricsView
+
 schema_view = get_schema_view(
     openapi.Info(
         title='API Doc',
@@ -33,5 +35,6 @@ urlpatterns = [
     path('api/v0/users/', include('users.urls')),
     path('api/v0/bots/', include('bots.urls')),
     path('api/v0/dialogues/', include('dialogues.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 ]
@@ -0,0 +1,40 @@
+import hmac
+import ipaddress
+from typing import Any
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+from django.views import View
+
+from common.metrics import Metrics
+
+
+class MetricsView(View):
+    """Prometheus metrics of all workers of this host, for the scrapers allowed by PROXY_METRICS_* settings"""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def get(self, request: HttpRequest, *args: Any, **kwargs: dict) -> HttpResponse:
+        if not self.__is_allowed(request):
+            return HttpResponseForbidden()
+        return HttpResponse(Metrics.get_instance().render(), content_type=self.content_type)
+
+    def __is_allowed(self, request: HttpRequest) -> bool:
+        return self.__has_token(request) or self.__is_allowed_address(request.META.get('REMOTE_ADDR'))
+
+    @staticmethod
+    def __has_token(request: HttpRequest) -> bool:
+        token = settings.PROXY_METRICS_TOKEN
+        if not token:
+            return False
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+    @staticmethod
+    def __is_allowed_address(remote_addr: str) -> bool:
+        """The address the connection came from, X-Forwarded-For is set by the client and not trusted"""
+        try:
+            address = ipaddress.ip_address(remote_addr or '')
+        except ValueError:
+            return False
+        networks = (ipaddress.ip_network(allowed, strict=False) for allowed in settings.PROXY_METRICS_ALLOWED_IPS)
+        return any(address in network for network in networks)
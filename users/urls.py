@@ -1,15 +1,22 @@
+from typing import Callable
+
+from django.conf import settings
 from django.urls import path
 
-from users.views import (EmailVerificationCheckView,
-                         EmailVerificationResendView,
-                         EmailVerificationVerifyView, LoginView, LogoutView,
-                         UserRegistrationView)
+from users import views
+
+
+def _view(name: str) -> Callable:
+    """Returns the async twin of the view when the async proxy path is enabled"""
+    prefix = 'Async' if settings.PROXY_ASYNC_VIEWS else ''
+    return getattr(views, f'{prefix}{name}').as_view()
+
 
 urlpatterns = [
-    path('', UserRegistrationView.as_view(), name='register'),
-    path('login/', LoginView.as_view(), name='login'),
-    path('logout/', LogoutView.as_view(), name='logout'),
-    path('email-verification/check/', EmailVerificationCheckView.as_view(), name='email_check'),
-    path('email-verification/resend/', EmailVerificationResendView.as_view(), name='email_resend'),
-    path('email-verification/verify/', EmailVerificationVerifyView.as_view(), name='email_login')
+    path('', _view('UserRegistrationView'), name='register'),
+    path('login/', _view('LoginView'), name='login'),
+    path('logout/', _view('LogoutView'), name='logout'),
+    path('email-verification/check/', _view('EmailVerificationCheckView'), name='email_check'),
+    path('email-verification/resend/', _view('EmailVerificationResendView'), name='email_resend'),
+    path('email-verification/verify/', _view('EmailVerificationVerifyView'), name='email_login')
 ]
@@ -1,10 +1,13 @@
 from typing import Any
 
+import requests
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from bots.services.bot_catalog import bot_catalog
 from common.route import Route
+from common.views import AsyncProxyView
 from logger.services.Logger import Logger
 from proxy.decorators import handle_json_decode_error
 
@@ -17,11 +20,15 @@ class __BaseUserOperationView(APIView):
 
     @handle_json_decode_error
     def __send_request(self, request: Request) -> Response:
-        response = Route(request=request).send(endpoint=self.endpoint)
+        response = self.route_class(request=request).send(endpoint=self.endpoint)
+        self._on_response(request=request, response=response)
         Logger().log_proxy_response_to_client(response=response)
         Logger().save_to_db()
         return response
 
+    def _on_response(self, request: Request, response: requests.Response) -> None:
+        """Hook for views that act on the Yadro response"""
+
     def get(self, request: Request, *args: Any, **kwargs: dict) -> Response:
         return self.__send_request(request=request)
 
@@ -29,6 +36,30 @@ class __BaseUserOperationView(APIView):
         return self.__send_request(request=request)
 
 
+class __AsyncBaseUserOperationView(AsyncProxyView):
+    """Async base class for users registration and login"""
+
+    route_class: Any = Route
+    endpoint: str = None
+
+    @handle_json_decode_error
+    async def __send_request(self, request: Request) -> Response:
+        response = await self.route_class(request=request).asend(endpoint=self.endpoint)
+        await self._aon_response(request=request, response=response)
+        Logger().log_proxy_response_to_client(response=response)
+        await Logger().asave_to_db()
+        return response
+
+    async def _aon_response(self, request: Request, response: requests.Response) -> None:
+        """Hook for views that act on the Yadro response"""
+
+    async def get(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__send_request(request=request)
+
+    async def post(self, request: Request, *args: Any, **kwargs: dict) -> Response:
+        return await self.__send_request(request=request)
+
+
 class UserRegistrationView(__BaseUserOperationView):
     """Registers User in the third-party service"""
 
@@ -46,6 +77,11 @@ class LogoutView(__BaseUserOperationView):
 
     endpoint = 'users/logout'
 
+    def _on_response(self, request: Request, response: requests.Response) -> None:
+        """A logged out token no longer gets the shared bot catalog"""
+        if response.ok:
+            bot_catalog.forget_client(request)
+
 
 class EmailVerificationCheckView(__BaseUserOperationView):
     """Checks Email Verification status"""
@@ -63,3 +99,43 @@ class EmailVerificationVerifyView(__BaseUserOperationView):
     """Verifies Email"""
 
     endpoint = 'users/email-verification/verify'
+
+
+class AsyncUserRegistrationView(__AsyncBaseUserOperationView):
+    """Registers User in the third-party service"""
+
+    endpoint = UserRegistrationView.endpoint
+
+
+class AsyncLoginView(__AsyncBaseUserOperationView):
+    """Logins User in the third-party service"""
+
+    endpoint = LoginView.endpoint
+
+
+class AsyncLogoutView(__AsyncBaseUserOperationView):
+    """Logouts User in the third-party service"""
+
+    endpoint = LogoutView.endpoint
+
+    async def _aon_response(self, request: Request, response: requests.Response) -> None:
+        if response.ok:
+            await bot_catalog.aforget_client(request)
+
+
+class AsyncEmailVerificationCheckView(__AsyncBaseUserOperationView):
+    """Checks Email Verification status"""
+
+    endpoint = EmailVerificationCheckView.endpoint
+
+
+class AsyncEmailVerificationResendView(__AsyncBaseUserOperationView):
+    """Resends Email Verification"""
+
+    endpoint = EmailVerificationResendView.endpoint
+
+
+class AsyncEmailVerificationVerifyView(__AsyncBaseUserOperationView):
+    """Verifies Email"""
+
+    endpoint = EmailVerificationVerifyView.endpoint